@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+"""
+Run the bookmarks benchmarks on SQLite, using the test settings, e.g.::
+
+    cd benchmarks
+    ./runbenchmarks.py                  # compare with baseline.json
+    ./runbenchmarks.py --save           # store a new baseline
+    ./runbenchmarks.py annotate_bookmarks view_toggle
+
+For each benchmark and size the best time of several runs and the number
+of queries are reported. If a baseline is stored, a benchmark regresses
+when it performs more queries, or when it is slower than the baseline by
+more than the given tolerance: in that case the exit status is 1.
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import sys
+import timeit
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.join(here, '..'), os.path.join(here, '..', 'tests')]
+os.environ['DJANGO_SETTINGS_MODULE'] = 'settings'
+
+DEFAULT_BASELINE = os.path.join(here, 'baseline.json')
+
+
+def measure(benchmark, size):
+    """
+    Return a tuple *(seconds, queries)* for *benchmark* using *size*.
+    """
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+    benchmark.setup(size)
+    try:
+        with CaptureQueriesContext(connection) as context:
+            benchmark.run()
+        queries = len(context)
+        timings = []
+        for i in range(benchmark.repeat):
+            start = timeit.default_timer()
+            benchmark.run()
+            timings.append(timeit.default_timer() - start)
+    finally:
+        benchmark.teardown()
+    return min(timings), queries
+
+
+def compare(name, result, baseline, tolerance):
+    """
+    Return a description of the regression of *result*, or None.
+    """
+    if name not in baseline:
+        return None
+    seconds, queries = result
+    expected = baseline[name]
+    if queries > expected['queries']:
+        return '%d queries, expected %d' % (queries, expected['queries'])
+    if seconds > expected['seconds'] * (1 + tolerance):
+        return '%.2fx slower' % (seconds / expected['seconds'])
+    return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run bookmarks benchmarks.')
+    parser.add_argument('names', nargs='*',
+        help='Benchmarks to run (default: all).')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE,
+        help='Path of the baseline JSON file.')
+    parser.add_argument('--save', action='store_true',
+        help='Store the results as the new baseline.')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+        help='Allowed slowdown relative to the baseline (default: 0.25).')
+    args = parser.parse_args(argv)
+
+    import django
+    if hasattr(django, 'setup'):
+        django.setup()
+    from django.test.runner import DiscoverRunner
+    from django.test.utils import setup_test_environment
+    from bookmarks.handlers import library
+    from bookmarks.tests import BookmarkTestModel
+    import suite
+
+    setup_test_environment()
+    runner = DiscoverRunner(verbosity=0)
+    old_config = runner.setup_databases()
+    library.register(BookmarkTestModel)
+
+    baseline = {}
+    if not args.save and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    results, regressions = {}, []
+    try:
+        for cls in suite.registry:
+            if args.names and cls.name not in args.names:
+                continue
+            for size in cls.sizes:
+                name = cls.name if size is None else '%s[%d]' % (
+                    cls.name, size)
+                try:
+                    result = measure(cls(), size)
+                except ImportError as err:
+                    print('%-40s skipped (%s)' % (name, err))
+                    continue
+                results[name] = {'seconds': result[0], 'queries': result[1]}
+                regression = compare(name, result, baseline, args.tolerance)
+                if regression is not None:
+                    regressions.append(name)
+                print('%-40s %10.2f ms %6d queries%s' % (name,
+                    result[0] * 1000, result[1],
+                    '' if regression is None else '  REGRESSION: ' +
+                    regression))
+    finally:
+        library.unregister(BookmarkTestModel)
+        runner.teardown_databases(old_config)
+
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print('Baseline stored in %s.' % args.baseline)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
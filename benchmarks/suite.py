@@ -0,0 +1,294 @@
+"""
+Benchmarks of the bookmarks hot paths.
+
+Each benchmark is a subclass of *Benchmark*: *setup* creates the data for
+a given size, *run* performs the measured operation, and the database is
+cleaned after each size.
+"""
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.template import Template, Context
+
+from bookmarks import backends, bloom, deferred, handlers, index, views
+from bookmarks.models import Bookmark, annotate_bookmarks
+from bookmarks.tests import BookmarkTestModel, RequestFactory
+
+registry = []
+
+
+def register(cls):
+    registry.append(cls)
+    return cls
+
+
+class Benchmark(object):
+    """
+    Base class for benchmarks.
+
+    .. py:attribute:: sizes
+
+        the data sizes the benchmark is executed with
+
+    .. py:attribute:: repeat
+
+        number of timed runs for each size (the best one is reported)
+    """
+    name = None
+    sizes = [None]
+    repeat = 5
+
+    def setup(self, size):
+        pass
+
+    def run(self):
+        raise NotImplementedError
+
+    def teardown(self):
+        Bookmark.objects.all().delete()
+        BookmarkTestModel.objects.all().delete()
+        User.objects.all().delete()
+
+    def create_users(self, count, prefix='user'):
+        User.objects.bulk_create([User(username='%s%d' % (prefix, i))
+            for i in range(count)])
+        return list(User.objects.filter(username__startswith=prefix))
+
+    def create_instances(self, count):
+        BookmarkTestModel.objects.bulk_create([
+            BookmarkTestModel(name=str(i)) for i in range(count)])
+        return list(BookmarkTestModel.objects.all())
+
+    def create_bookmarks(self, pairs, key='main'):
+        backend = backends.ModelBackend()
+        for user, instance in pairs:
+            backend.add(user, instance, key)
+
+
+@register
+class ToggleView(Benchmark):
+    """
+    Add and remove a bookmark using *views.bookmark*.
+    """
+    name = 'view_toggle'
+
+    def setup(self, size):
+        user = self.create_users(1)[0]
+        instance = self.create_instances(1)[0]
+        data = {
+            'model': str(instance._meta),
+            'object_id': str(instance.pk),
+            'key': handlers.library.get_handler(BookmarkTestModel).default_key,
+        }
+        self.request = RequestFactory(user).post('/', data,
+            HTTP_REFERER='/')
+
+    def run(self):
+        views.bookmark(self.request)
+        views.bookmark(self.request)
+
+
+@register
+class FilterByUser(Benchmark):
+    """
+    Retreive all bookmarks of a user, with contents.
+    """
+    name = 'backend_filter_user'
+    sizes = [10, 100, 1000]
+
+    def setup(self, size):
+        self.backend = backends.ModelBackend()
+        self.user = self.create_users(1)[0]
+        self.create_bookmarks((self.user, instance)
+            for instance in self.create_instances(size))
+
+    def run(self):
+        for bookmark in self.backend.filter(user=self.user):
+            bookmark.content_object
+
+
+@register
+class FilterByInstance(Benchmark):
+    """
+    Retreive all bookmarks of an instance, with users.
+    """
+    name = 'backend_filter_instance'
+    sizes = [10, 100, 1000]
+
+    def setup(self, size):
+        self.backend = backends.ModelBackend()
+        self.instance = self.create_instances(1)[0]
+        self.create_bookmarks((user, self.instance)
+            for user in self.create_users(size))
+
+    def run(self):
+        for bookmark in self.backend.filter(instance=self.instance,
+                with_users=True):
+            bookmark.user.username
+
+
+@register
+class WithContentsMixed(Benchmark):
+    """
+    Iterate over bookmarks of mixed content types using *with_contents*.
+    """
+    name = 'with_contents_mixed'
+    sizes = [100, 1000]
+
+    def setup(self, size):
+        user = self.create_users(1, prefix='owner')[0]
+        instances = self.create_instances(size // 2)
+        users = self.create_users(size - size // 2)
+        self.create_bookmarks((user, i) for i in instances + users)
+
+    def run(self):
+        for bookmark in Bookmark.objects.with_contents():
+            bookmark.content_object
+
+
+@register
+class Annotate(Benchmark):
+    """
+    Annotate a queryset with bookmarks of a user.
+    """
+    name = 'annotate_bookmarks'
+    sizes = [100, 1000, 10000]
+
+    def setup(self, size):
+        self.user = self.create_users(1)[0]
+        instances = self.create_instances(size)
+        self.create_bookmarks((self.user, i) for i in instances[::10])
+
+    def run(self):
+        queryset = annotate_bookmarks(BookmarkTestModel, 'main', self.user)
+        for instance in queryset:
+            instance.is_bookmarked
+
+
+@register
+class RenderForms(Benchmark):
+    """
+    Render the bookmark form of N objects.
+    """
+    name = 'templatetag_bookmark_form'
+    sizes = [10, 100]
+    template = Template(
+        '{% load bookmarks_tags %}'
+        '{% for instance in instances %}'
+        '{% bookmark_form for instance %}'
+        '{% endfor %}')
+
+    def setup(self, size):
+        user = self.create_users(1)[0]
+        self.instances = self.create_instances(size)
+        self.create_bookmarks((user, i) for i in self.instances[::2])
+        self.request = RequestFactory(user).get('/')
+
+    def run(self):
+        self.template.render(Context({
+            'instances': self.instances,
+            'request': self.request,
+        }))
+
+
+@register
+class RenderFormsDeferred(RenderForms):
+    """
+    Same as *RenderForms*, deferring bookmark checks using
+    *bookmarks.deferred.DeferredBookmarksMiddleware*.
+    """
+    name = 'templatetag_bookmark_form_deferred'
+
+    def run(self):
+        middleware = deferred.DeferredBookmarksMiddleware()
+        middleware.process_request(self.request)
+        html = self.template.render(Context({
+            'instances': self.instances,
+            'request': self.request,
+        }))
+        middleware.process_response(self.request, HttpResponse(html))
+
+
+@register
+class ExistsMissing(Benchmark):
+    """
+    Check N objects not bookmarked by a user who bookmarked N other
+    objects, one at a time and in bulk.
+    """
+    name = 'backend_exists_missing'
+    sizes = [10, 100, 1000]
+
+    def get_backend(self):
+        return backends.ModelBackend()
+
+    def setup(self, size):
+        self.backend = self.get_backend()
+        self.user = self.create_users(1)[0]
+        instances = self.create_instances(size * 2)
+        self.create_bookmarks((self.user, i) for i in instances[:size])
+        self.instances = instances[size:]
+
+    def run(self):
+        for instance in self.instances:
+            self.backend.exists(self.user, instance, 'main')
+        self.backend.exists_many(self.user, self.instances, 'main')
+
+
+@register
+class ExistsMissingBloom(ExistsMissing):
+    """
+    Same as *ExistsMissing*, using the Bloom filter of the user
+    (the filter is built during the first run).
+    """
+    name = 'backend_exists_missing_bloom'
+
+    def get_backend(self):
+        return bloom.BloomFilterBackend(backends.ModelBackend())
+
+    def teardown(self):
+        super(ExistsMissingBloom, self).teardown()
+        cache.clear()
+
+
+@register
+class ExistsMissingIndex(ExistsMissing):
+    """
+    Same as *ExistsMissing*, using the in-memory index of the user
+    (the index is built during the first run).
+    """
+    name = 'backend_exists_missing_index'
+
+    def get_backend(self):
+        return index.IndexedBackend(backends.ModelBackend())
+
+    def teardown(self):
+        super(ExistsMissingIndex, self).teardown()
+        index.clear()
+
+
+@register
+class Mongo(Benchmark):
+    """
+    Add, check and retreive bookmarks using *MongoBackend* and mongomock.
+    """
+    name = 'mongo_backend'
+    sizes = [100]
+
+    def setup(self, size):
+        import mongomock  # NOQA
+        from bookmarks import settings
+        settings.MONGODB = {
+            'NAME': 'benchmarks',
+            'PARAMETERS': {'host': 'mongomock://localhost'},
+        }
+        self.backend = backends.MongoBackend()
+        self.user = self.create_users(1)[0]
+        self.instances = self.create_instances(size)
+
+    def run(self):
+        for instance in self.instances:
+            self.backend.add(self.user, instance, 'main')
+            self.backend.exists(self.user, instance, 'main')
+        list(self.backend.filter(user=self.user))
+        for instance in self.instances:
+            self.backend.remove(self.user, instance, 'main')
@@ -1,13 +1,104 @@
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.encoding import force_text
 
-from bookmarks import models
+from bookmarks import models, utils
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator using the database statistics to get the number of bookmarks
+    when the queryset is not filtered, avoiding a full table *COUNT(*)*.
+
+    The exact count is used when the database does not provide statistics
+    or when the table is small enough.
+    """
+    # below this number of rows the exact count is performed
+    threshold = 10000
+
+    def _get_estimated_count(self):
+        query = getattr(self.object_list, 'query', None)
+        if query is None or query.where:
+            return None
+        connection = connections[self.object_list.db]
+        vendor = connection.vendor
+        if vendor == 'postgresql':
+            # the table is resolved using the search path
+            sql = 'SELECT reltuples FROM pg_class WHERE oid = %s::regclass'
+        elif vendor == 'mysql':
+            sql = ('SELECT table_rows FROM information_schema.tables '
+                'WHERE table_schema = DATABASE() AND table_name = %s')
+        else:
+            return None
+        cursor = connection.cursor()
+        cursor.execute(sql, [self.object_list.model._meta.db_table])
+        row = cursor.fetchone()
+        if row is None or row[0] is None or row[0] < self.threshold:
+            return None
+        return int(row[0])
+
+    def _get_count(self):
+        if self._count is None:
+            self._count = self._get_estimated_count()
+        if self._count is None:
+            self._count = super(EstimatedCountPaginator, self)._get_count()
+        return self._count
+    count = property(_get_count)
+
+
+class ContentTypeListFilter(admin.SimpleListFilter):
+    """
+    Filter bookmarks by the content type of bookmarkable models.
+
+    The choices are built using the models registered in the bookmarks
+    library, so no query is performed to build the filter, and
+    the filtering itself uses the content type index.
+    """
+    title = 'content type'
+    parameter_name = 'content_type'
+
+    def lookups(self, request, model_admin):
+        from bookmarks.handlers import library
+        lookups = []
+        for model in library.get_registered_models():
+            content_type = utils.get_content_type_for_model(model)
+            lookups.append((str(content_type.pk), force_text(content_type)))
+        return sorted(lookups, key=lambda i: i[1])
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(content_type=self.value())
 
 
 class BookmarkAdmin(admin.ModelAdmin):
     list_display = ('content_object', 'key', 'user', 'created_at')
-    list_filter = ('created_at',)
+    list_filter = (ContentTypeListFilter, 'created_at')
     ordering = ('-created_at',)
-    search_fields = ('user', 'key')
+    search_fields = ('user__username',)
     readonly_fields = ('user',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        """
+        Retreive content objects and usernames of each page in bulk.
+        """
+        queryset = super(BookmarkAdmin, self).get_queryset(request)
+        return queryset.with_contents().with_users('username')
+
+    def get_search_results(self, request, queryset, search_term):
+        """
+        Search bookmarks by exact username, or also by user id if the search
+        term is a number: both lookups are resolved using indexes.
+        """
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        lookup = Q(user__username=search_term)
+        if search_term.isdigit():
+            lookup |= Q(user_id=int(search_term))
+        return queryset.filter(lookup), False
 
 admin.site.register(models.Bookmark, BookmarkAdmin)
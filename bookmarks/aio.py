@@ -0,0 +1,185 @@
+"""
+Asynchronous bookmarks API.
+
+Backends inherit from *AsyncBackendMixin* the coroutine counterparts of
+their methods: *aadd*, *aremove*, *aremove_all_for*, *afilter*, *aget*,
+*aexists* and *aexists_many*, e.g.::
+
+    from bookmarks.handlers import library
+
+    async def is_favourite(user, article):
+        return await library.backend.aexists(user, article, 'favourite')
+
+This module requires Python >= 3.5.
+"""
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import close_old_connections
+
+from bookmarks import settings, exceptions
+
+_executor = None
+
+
+def get_executor():
+    """
+    Return the thread pool used to run synchronous backend operations.
+    The pool is shared by all backends and lazily created.
+    """
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=settings.ASYNC_WORKERS)
+    return _executor
+
+
+def _call(func, *args, **kwargs):
+    # worker threads are not managed by the request cycle: database
+    # connections are closed as they are at the end of a request
+    close_old_connections()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+async def run_sync(func, *args, **kwargs):
+    """
+    Run *func* in the bookmarks thread pool and return its result.
+    """
+    loop = asyncio.get_event_loop()
+    call = functools.partial(_call, func, *args, **kwargs)
+    return await loop.run_in_executor(get_executor(), call)
+
+
+class AsyncBackendMixin(object):
+    """
+    Coroutine versions of the backend methods.
+
+    By default each coroutine runs the corresponding synchronous method in
+    the bookmarks thread pool: backends able to talk to their storage
+    without blocking the event loop should override them.
+    """
+    async def aadd(self, user, instance, key):
+        return await run_sync(self.add, user, instance, key)
+
+    async def aremove(self, user, instance, key):
+        return await run_sync(self.remove, user, instance, key)
+
+    async def aremove_all_for(self, instance):
+        return await run_sync(self.remove_all_for, instance)
+
+    async def afilter(self, **kwargs):
+        """
+        Return a list of bookmarks: the results are retreived in the
+        thread pool, so that the lazy queryset returned by *filter* is not
+        evaluated in the event loop.
+        """
+        return await run_sync(lambda: list(self.filter(**kwargs)))
+
+    async def aget(self, user, instance, key):
+        return await run_sync(self.get, user, instance, key)
+
+    async def aexists(self, user, instance, key):
+        return await run_sync(self.exists, user, instance, key)
+
+    async def aexists_many(self, user, instances, key):
+        return await run_sync(self.exists_many, user, instances, key)
+
+
+class AsyncMongoBackendMixin(AsyncBackendMixin):
+    """
+    Coroutine versions of the MongoDB backend methods.
+
+    If *motor* is installed, MongoDB is queried using the asynchronous
+    driver, otherwise the thread pool is used.
+    """
+    _async_collection = None
+
+    async def _get_async_collection(self):
+        """
+        Return the motor collection storing bookmarks, or None if motor
+        is not installed.
+        """
+        if self._async_collection is None:
+            try:
+                from motor.motor_asyncio import AsyncIOMotorClient
+            except ImportError:
+                return None
+            parameters = dict(settings.MONGODB.get('PARAMETERS', {}))
+            for name in ('USERNAME', 'PASSWORD'):
+                if settings.MONGODB.get(name):
+                    parameters[name.lower()] = settings.MONGODB[name]
+            client = AsyncIOMotorClient(**parameters)
+            model = self.get_model()
+            # the unique index is usually created by mongoengine
+            # on first use of the collection
+            await run_sync(model.ensure_indexes)
+            database = client[settings.MONGODB['NAME']]
+            self._async_collection = database[model._get_collection_name()]
+        return self._async_collection
+
+    async def aadd(self, user, instance, key):
+        collection = await self._get_async_collection()
+        if collection is None:
+            return await super(AsyncMongoBackendMixin, self).aadd(
+                user, instance, key)
+        from pymongo.errors import DuplicateKeyError
+        bookmark = self.get_model()(**self._get_lookups(user, instance, key))
+        bookmark.validate()
+        try:
+            result = await collection.insert_one(bookmark.to_mongo())
+        except DuplicateKeyError:
+            raise exceptions.AlreadyExists
+        bookmark.id = result.inserted_id
+        return bookmark
+
+    async def aremove(self, user, instance, key):
+        collection = await self._get_async_collection()
+        if collection is None:
+            return await super(AsyncMongoBackendMixin, self).aremove(
+                user, instance, key)
+        bookmark = await self.aget(user, instance, key)
+        await collection.delete_one({'_id': bookmark.id})
+        return bookmark
+
+    async def aremove_all_for(self, instance):
+        collection = await self._get_async_collection()
+        if collection is None:
+            return await super(AsyncMongoBackendMixin, self).aremove_all_for(
+                instance)
+        await collection.delete_many({
+            'content_type_id': self._get_content_type_id(instance),
+            'object_id': instance.pk,
+        })
+
+    async def afilter(self, **kwargs):
+        collection = await self._get_async_collection()
+        if collection is None:
+            return await super(AsyncMongoBackendMixin, self).afilter(**kwargs)
+        direction = -1 if kwargs.pop('reversed', False) else 1
+        lookups = self._get_filter_lookups(kwargs)
+        cursor = collection.find(lookups).sort('created_at', direction)
+        model = self.get_model()
+        return [model._from_son(i) for i in await cursor.to_list(None)]
+
+    async def aget(self, user, instance, key):
+        collection = await self._get_async_collection()
+        if collection is None:
+            return await super(AsyncMongoBackendMixin, self).aget(
+                user, instance, key)
+        document = await collection.find_one(
+            self._get_lookups(user, instance, key))
+        if document is None:
+            raise exceptions.DoesNotExist
+        return self.get_model()._from_son(document)
+
+    async def aexists(self, user, instance, key):
+        collection = await self._get_async_collection()
+        if collection is None:
+            return await super(AsyncMongoBackendMixin, self).aexists(
+                user, instance, key)
+        document = await collection.find_one(
+            self._get_lookups(user, instance, key), projection={'_id': True})
+        return document is not None
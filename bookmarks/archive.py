@@ -0,0 +1,252 @@
+"""
+Archival of old bookmarks.
+
+Bookmarks older than a threshold can be moved in bulk from the *Bookmark*
+table to the *BookmarkArchive* one, so that the table hit by most queries
+stays small, e.g.::
+
+    ./manage.py bookmarks_archive --days=365
+
+If *settings.GENERIC_BOOKMARKS_ARCHIVE['ENABLED']* is True, the model
+backend consults the archive when a bookmark is not found in the
+*Bookmark* table, and *filter* returns a *QuerysetChain* retreiving
+archived bookmarks only when results go past the recent ones.
+"""
+import collections
+import datetime
+import itertools
+import operator
+from functools import reduce
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from bookmarks import settings, models, utils
+
+
+def get_threshold(days=None):
+    """
+    Return the datetime before which bookmarks are archived, given the
+    number of *days* (defaulting to the AFTER_DAYS setting).
+    """
+    if days is None:
+        days = settings.ARCHIVE.get('AFTER_DAYS', 365)
+    return timezone.now() - datetime.timedelta(days=days)
+
+
+def archive_bookmarks(before, batch_size=None, using=None):
+    """
+    Move all bookmarks created before the *before* datetime to the archive,
+    in batches of *batch_size* bookmarks, each one in its own transaction.
+    Return the number of archived bookmarks.
+    """
+    if batch_size is None:
+        batch_size = settings.ARCHIVE.get('BATCH_SIZE', 1000)
+    manager = models.Bookmark.objects.db_manager(using)
+    archive_manager = models.BookmarkArchive.objects.db_manager(using)
+    fields = ('pk', 'user_id', 'content_type_id', 'object_id', 'key',
+        'created_at')
+    archived = 0
+    while True:
+        with transaction.atomic(using=using):
+            rows = list(manager.filter(created_at__lt=before).order_by(
+                'pk').values_list(*fields)[:batch_size])
+            if not rows:
+                break
+            query = reduce(operator.or_, [Q(user_id=user_id,
+                content_type_id=content_type_id, object_id=object_id,
+                key=key) for _, user_id, content_type_id, object_id, key, _
+                in rows])
+            existing = set(archive_manager.filter(query).values_list(
+                'user_id', 'content_type_id', 'object_id', 'key'))
+            archive_manager.bulk_create([models.BookmarkArchive(
+                user_id=user_id, content_type_id=content_type_id,
+                object_id=object_id, key=key, created_at=created_at)
+                for _, user_id, content_type_id, object_id, key, created_at
+                in rows
+                if (user_id, content_type_id, object_id, key) not in existing])
+            manager.filter(pk__in=[row[0] for row in rows]).delete()
+        archived += len(rows)
+    return archived
+
+
+class QuerysetChain(object):
+    """
+    Lazy concatenation of querysets supporting iteration, slicing, *count*
+    and *exists*, so that it can be paginated.
+
+    Querysets are only hit when needed: e.g. slicing the first page
+    of results does not query the following querysets, as long as the
+    first one contains enough results.
+    """
+    def __init__(self, *querysets):
+        self.querysets = querysets
+        self.model = querysets[0].model
+        self._counts = {}
+
+    def _count(self, index):
+        if index not in self._counts:
+            self._counts[index] = self.querysets[index].count()
+        return self._counts[index]
+
+    def count(self):
+        return sum(self._count(i) for i in range(len(self.querysets)))
+
+    def __len__(self):
+        return self.count()
+
+    def exists(self):
+        return any(queryset.exists() for queryset in self.querysets)
+
+    def __bool__(self):
+        return self.exists()
+    __nonzero__ = __bool__
+
+    def __iter__(self):
+        return itertools.chain(*self.querysets)
+
+    def __getitem__(self, k):
+        if not isinstance(k, slice):
+            if k < 0:
+                raise IndexError('Negative indexing is not supported.')
+            results = self[k:k + 1]
+            if not results:
+                raise IndexError('Index out of range.')
+            return results[0]
+        if k.step is not None or (k.start or 0) < 0 or (
+                k.stop is not None and k.stop < 0):
+            raise ValueError('Only positive slices without step '
+                'are supported.')
+        start, stop = k.start or 0, k.stop
+        results, offset = [], 0
+        for index, queryset in enumerate(self.querysets):
+            if stop is not None and offset >= stop:
+                break
+            count = self._count(index)
+            if start - offset < count:
+                queryset_stop = None if stop is None else stop - offset
+                results.extend(queryset[max(start - offset, 0):queryset_stop])
+            offset += count
+        return results
+
+
+class QuerysetMerge(object):
+    """
+    Lazy merge of querysets ordered by creation date, supporting iteration,
+    slicing, *count* and *exists*, so that it can be paginated.
+
+    Slicing the first *n* results only retreives the first *n* results of
+    each queryset, while iterating reads each queryset in chunks of
+    *chunk_size* bookmarks (keyset pagination on the creation date and the
+    primary key). Querysets are evaluated using *map_func(func, items)*
+    (e.g. in parallel), and *callback(bookmarks)* is called with each list
+    of retreived bookmarks (e.g. to load related objects in bulk).
+    """
+    chunk_size = 100
+
+    def __init__(self, querysets, reverse=False, map_func=None,
+            callback=None):
+        self.querysets = list(querysets)
+        self.model = self.querysets[0].model
+        self.reverse = reverse
+        self.map_func = map_func or (lambda func, querysets: [func(i)
+            for i in querysets])
+        self.callback = callback
+        self._count = None
+
+    def count(self):
+        if self._count is None:
+            self._count = sum(self.map_func(lambda queryset: queryset.count(),
+                self.querysets))
+        return self._count
+
+    def __len__(self):
+        return self.count()
+
+    def exists(self):
+        return any(self.map_func(lambda queryset: queryset.exists(),
+            self.querysets))
+
+    def __bool__(self):
+        return self.exists()
+    __nonzero__ = __bool__
+
+    def _merge(self, iterables):
+        return utils.merge_sorted(iterables,
+            operator.attrgetter('created_at'), reverse=self.reverse)
+
+    def _prepare(self, bookmarks):
+        if self.callback is not None and bookmarks:
+            self.callback(bookmarks)
+        return bookmarks
+
+    def _get_chunk(self, queryset, last):
+        # return the *chunk_size* results of *queryset* following *last*;
+        # querysets are sliced rather than iterated using *iterator*, which
+        # would ignore *prefetch_related*
+        if self.reverse:
+            ordering = ('-created_at', '-pk')
+            if last is not None:
+                queryset = queryset.filter(Q(created_at__lt=last.created_at) |
+                    Q(created_at=last.created_at, pk__lt=last.pk))
+        else:
+            ordering = ('created_at', 'pk')
+            if last is not None:
+                queryset = queryset.filter(Q(created_at__gt=last.created_at) |
+                    Q(created_at=last.created_at, pk__gt=last.pk))
+        return list(queryset.order_by(*ordering)[:self.chunk_size])
+
+    def __iter__(self):
+        indexes = range(len(self.querysets))
+        buffers = [collections.deque() for i in indexes]
+        last = [None for i in indexes]
+        done = [False for i in indexes]
+
+        def fill(selected):
+            chunks = self.map_func(lambda i: self._get_chunk(
+                self.querysets[i], last[i]), selected)
+            for i, chunk in zip(selected, chunks):
+                buffers[i].extend(chunk)
+                if chunk:
+                    last[i] = chunk[-1]
+                done[i] = len(chunk) < self.chunk_size
+
+        def read(i):
+            while True:
+                while buffers[i]:
+                    yield buffers[i].popleft()
+                if done[i]:
+                    return
+                # the querysets running low are read together
+                fill([j for j in indexes if j == i or (not done[j] and
+                    len(buffers[j]) < self.chunk_size // 2)])
+
+        fill(list(indexes))
+        merged = self._merge([read(i) for i in indexes])
+        while True:
+            chunk = self._prepare(list(itertools.islice(merged,
+                self.chunk_size)))
+            if not chunk:
+                break
+            for bookmark in chunk:
+                yield bookmark
+
+    def __getitem__(self, k):
+        if not isinstance(k, slice):
+            if k < 0:
+                raise IndexError('Negative indexing is not supported.')
+            results = self[k:k + 1]
+            if not results:
+                raise IndexError('Index out of range.')
+            return results[0]
+        if k.step is not None or (k.start or 0) < 0 or (
+                k.stop is not None and k.stop < 0):
+            raise ValueError('Only positive slices without step '
+                'are supported.')
+        start, stop = k.start or 0, k.stop
+        # each queryset contributes at most *stop* results
+        results = self.map_func(lambda queryset: list(queryset[:stop]),
+            self.querysets)
+        return self._prepare(list(itertools.islice(self._merge(results),
+            start, stop)))
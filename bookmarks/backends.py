@@ -1,20 +1,47 @@
+import atexit
+import calendar
+import datetime
+import logging
+import operator
+import random
+import threading
+import time
+import zlib
+from functools import reduce
+from multiprocessing.pool import ThreadPool
+
 from django import VERSION
 try:
     from importlib import import_module
 except ImportError:
     from django.utils.importlib import import_module
-from django.db import transaction
+from django.db import transaction, close_old_connections, IntegrityError
+from django.db import models as django_models
+from django.db.models import Q
+from django.core.cache import cache
 from django.core.exceptions import ImproperlyConfigured
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
+from django.utils import six, timezone
+
+from bookmarks import (settings, models, utils, exceptions, buffers, archive,
+    keys, instrumentation, summaries, trending, bloom, index)
 
-from bookmarks import settings, models, utils, exceptions
+try:
+    from bookmarks.aio import AsyncBackendMixin, AsyncMongoBackendMixin
+except SyntaxError:
+    # the asynchronous API requires Python >= 3.5
+    class AsyncBackendMixin(object):
+        pass
+    AsyncMongoBackendMixin = AsyncBackendMixin
 
 if VERSION < (1, 6):
     transaction.atomic = transaction.commit_on_success
 
+logger = logging.getLogger('bookmarks')
 
-class BaseBackend(object):
+
+class BaseBackend(AsyncBackendMixin):
     """
     Base bookmarks backend.
 
@@ -68,12 +95,18 @@ class BaseBackend(object):
             - model: a Django model
             - key: the bookmark key to use
             - reversed: reverse the order of results
+            - with_users: retreive bookmark users in bulk
+            - user_fields: only retreive these user fields (implies
+              *with_users*)
 
         The bookmarks must be an iterable (like a Django queryset) of
         *self.get_model()* instances.
 
         The bookmarks must be ordered by creation date (*created_at*):
         if *reversed* is True the order must be descending.
+
+        The *with_users* and *user_fields* arguments are performance hints:
+        backends unable to retreive users in bulk can just ignore them.
         """
         raise NotImplementedError
 
@@ -91,56 +124,377 @@ class BaseBackend(object):
         """
         raise NotImplementedError
 
+    def exists_many(self, user, instances, key):
+        """
+        Return a list of booleans, one for each instance in *instances*,
+        that are True if a bookmark given by *user* using *key* exists
+        for that instance.
+
+        Backends should override this method to retreive all bookmarks
+        in bulk.
+        """
+        return [self.exists(user, instance, key) for instance in instances]
+
+    def bulk_add(self, bookmarks):
+        """
+        Add the bookmarks described by *bookmarks*, a sequence of
+        *(user_id, model, object_id, key, created_at)* tuples, skipping
+        the existing ones. Return the number of added bookmarks.
+
+        Users and bookmarked objects are not retreived: the caller must
+        check that they exist. If *created_at* is None, the current
+        date is used.
+
+        Backends should override this method to add bookmarks in bulk:
+        this implementation calls *add* for each bookmark, ignoring
+        *created_at*.
+        """
+        added = 0
+        for user_id, model, object_id, key, created_at in bookmarks:
+            try:
+                self.add(User(pk=user_id), model(pk=object_id), key)
+            except exceptions.AlreadyExists:
+                continue
+            added += 1
+        return added
+
+    # On Python >= 3.5 backends also expose coroutine versions of the
+    # methods above: *aadd*, *aremove*, *aremove_all_for*, *afilter*,
+    # *aget*, *aexists* and *aexists_many*
+    # (see *bookmarks.aio.AsyncBackendMixin*).
+
 
 class ModelBackend(BaseBackend):
     """
     Bookmarks backend based on Django models.
 
     This is used by default if no other backend is specified.
+
+    If *settings.GENERIC_BOOKMARKS_READ_DATABASES* is not empty, bookmarks
+    are read from one of the given database aliases, and written to
+    *settings.GENERIC_BOOKMARKS_WRITE_DATABASE*. A user who adds or removes
+    a bookmark then reads from the write database for
+    *settings.GENERIC_BOOKMARKS_READ_YOUR_WRITES_TIMEOUT* seconds, so that
+    replication lag never hides the user's own changes.
+
+    If *settings.GENERIC_BOOKMARKS_ARCHIVE['ENABLED']* is True, bookmarks
+    not found in the *Bookmark* table are looked up in the archive (see
+    *bookmarks.archive*), and *filter* returns a
+    *bookmarks.archive.QuerysetChain*.
+
+    Content objects retrieved by *filter* are loaded by Django from the
+    database of their content type (i.e. following the routers), not from
+    the read database of bookmarks.
     """
+    # class level defaults, so that subclasses are not required to call
+    # the constructor; instances can override them
+    read_databases = tuple(settings.READ_DATABASES)
+    write_database = settings.WRITE_DATABASE
+    read_your_writes_timeout = settings.READ_YOUR_WRITES_TIMEOUT
+    use_archive = settings.ARCHIVE.get('ENABLED', False)
+    # never mutated in place, see set_dedicated_model
+    dedicated_models = {}
+
+    def _get_pin_key(self, user):
+        return 'bookmarks:pinned:%s' % getattr(user, 'pk', user)
+
+    def _pin(self, user):
+        """
+        Make *user* read from the write database for a while.
+        """
+        if self.read_databases and self.read_your_writes_timeout:
+            cache.set(self._get_pin_key(user), True,
+                self.read_your_writes_timeout)
+
+    def db_for_read(self, user=None):
+        """
+        Return the database alias to use to read bookmarks, optionally
+        for the given *user*, or None if Django routers must be used.
+        """
+        if not self.read_databases:
+            return None
+        if user is not None and cache.get(self._get_pin_key(user)):
+            return self.write_database
+        return random.choice(self.read_databases)
+
+    def db_for_write(self):
+        """
+        Return the database alias to use to write bookmarks,
+        or None if Django routers must be used.
+        """
+        return self.write_database if self.read_databases else None
+
     def get_model(self):
         return models.Bookmark
 
-    @transaction.atomic
+    def get_model_for(self, model_or_instance):
+        """
+        Return the model storing bookmarks for *model_or_instance*: its
+        dedicated bookmark model if any, otherwise a generic one, based on
+        the type of its primary key.
+        """
+        model = model_or_instance
+        if not isinstance(model, django_models.base.ModelBase):
+            model = type(model)
+        if model in self.dedicated_models:
+            return self.dedicated_models[model]
+        bookmark_model = models.get_bookmark_model(model)
+        if bookmark_model is models.Bookmark:
+            return self.get_model()
+        return bookmark_model
+
+    def set_dedicated_model(self, model, bookmark_model):
+        """
+        Store bookmarks for *model* using the dedicated *bookmark_model*
+        (see *bookmarks.models.create_dedicated_model*).
+        If *bookmark_model* is None, generic bookmarks are used again.
+        """
+        dedicated_models = dict(self.dedicated_models)
+        if bookmark_model is None:
+            dedicated_models.pop(model, None)
+        else:
+            dedicated_models[model] = bookmark_model
+        self.dedicated_models = dedicated_models
+
+    def get_models(self):
+        """
+        Return the list of models storing bookmarks: the table for
+        non-integer primary keys is only included if a registered model
+        needs it.
+        """
+        from bookmarks.handlers import library
+        bookmark_models = [self.get_model()]
+        for model in library.get_registered_models():
+            bookmark_model = self.get_model_for(model)
+            if bookmark_model not in bookmark_models:
+                bookmark_models.append(bookmark_model)
+        return bookmark_models
+
+    def get_archive_model(self):
+        return models.BookmarkArchive
+
+    def _uses_archive(self, model):
+        # only bookmarks with integer object ids are archived
+        return self.use_archive and model is self.get_model()
+
+    def _is_archived(self, user, instance, key, using=None):
+        if not self._uses_archive(self.get_model_for(instance)):
+            return False
+        manager = self.get_archive_model().objects.db_manager(using)
+        return manager.get_for(instance, key, user=user) is not None
+
     def add(self, user, instance, key):
-        return self.get_model().objects.add(user, instance, key)
+        using = self.db_for_write()
+        with transaction.atomic(using=using):
+            if self._is_archived(user, instance, key, using=using):
+                raise exceptions.AlreadyExists
+            bookmark = self.get_model_for(instance).objects.db_manager(
+                using).add(user, instance, key)
+        self._pin(user)
+        return bookmark
 
-    @transaction.atomic
     def remove(self, user, instance, key):
-        return self.get_model().objects.remove(user, instance, key)
+        using = self.db_for_write()
+        model = self.get_model_for(instance)
+        with transaction.atomic(using=using):
+            try:
+                bookmark = model.objects.db_manager(using).remove(
+                    user, instance, key)
+            except exceptions.DoesNotExist:
+                if not self._uses_archive(model):
+                    raise
+                bookmark = self.get_archive_model().objects.db_manager(
+                    using).remove(user, instance, key)
+        self._pin(user)
+        return bookmark
 
-    @transaction.atomic
     def remove_all_for(self, instance):
-        self.get_model().objects.remove_all_for(instance)
+        using = self.db_for_write()
+        model = self.get_model_for(instance)
+        with transaction.atomic(using=using):
+            model.objects.db_manager(using).remove_all_for(instance)
+            # archived bookmarks are removed even if the archive is not
+            # consulted on reads, to mantain the integrity of the table
+            if model is self.get_model():
+                self.get_archive_model().objects.db_manager(
+                    using).remove_all_for(instance)
 
-    def filter(self, **kwargs):
+    def _get_existing(self, bookmark_model, model, bookmarks, using):
         """
-        The *kwargs* can be:
-            - user: Django user object or pk
-            - instance: a Django model instance
-            - content_type: a Django ContentType instance or pk
-            - model: a Django model
-            - key: the bookmark key to use
-            - reversed: reverse the order of results
+        Return the set of *(user_id, object_id, key)* tuples of the
+        *bookmarks* (of *model* instances) already present in the database.
+        """
+        bookmark_models = [bookmark_model]
+        if self._uses_archive(bookmark_model):
+            bookmark_models.append(self.get_archive_model())
+        content_type = utils.get_content_type_for_model(model)
+        existing = set()
+        # lookups are split to respect the query parameters limit of SQLite
+        for i in range(0, len(bookmarks), 300):
+            batch = bookmarks[i:i + 300]
+            lookups = {
+                'content_type': content_type,
+                'user_id__in': set(j[0] for j in batch),
+                'object_id__in': set(j[2] for j in batch),
+            }
+            for m in bookmark_models:
+                rows = m.objects.db_manager(using).filter(
+                    **lookups).values_list('user_id', 'object_id', 'key')
+                existing.update((user_id, object_id, keys.get_name(key) if (
+                    isinstance(key, six.integer_types)) else key)
+                    for user_id, object_id, key in rows)
+        return existing
+
+    def _make_bookmark(self, bookmark_model, model, user_id, object_id, key,
+            created_at):
+        kwargs = {
+            'user_id': user_id,
+            'key': key,
+            'created_at': created_at or timezone.now(),
+        }
+        if issubclass(bookmark_model, models.DedicatedBookmark):
+            kwargs['content_object_id'] = object_id
+        else:
+            kwargs['content_type'] = utils.get_content_type_for_model(model)
+            kwargs['object_id'] = object_id
+        return bookmark_model(**kwargs)
+
+    def _insert(self, bookmarks, using, bulk=True):
+        groups = {}
+        for bookmark in bookmarks:
+            groups.setdefault(bookmark[1], []).append(bookmark)
+        added = 0
+        with transaction.atomic(using=using):
+            for model, group in groups.items():
+                bookmark_model = self.get_model_for(model)
+                existing = self._get_existing(bookmark_model, model, group,
+                    using)
+                objs = []
+                for user_id, _, object_id, key, created_at in group:
+                    identity = (user_id, object_id, key)
+                    if identity not in existing:
+                        existing.add(identity)
+                        objs.append(self._make_bookmark(bookmark_model, model,
+                            user_id, object_id, key, created_at))
+                if bulk:
+                    bookmark_model.objects.db_manager(using).bulk_create(objs)
+                    added += len(objs)
+                    continue
+                for obj in objs:
+                    try:
+                        with transaction.atomic(using=using):
+                            obj.save(using=using, force_insert=True)
+                    except IntegrityError:
+                        # added concurrently
+                        continue
+                    added += 1
+        return added
+
+    def _bulk_add(self, bookmarks, using):
+        try:
+            return self._insert(bookmarks, using)
+        except IntegrityError:
+            pass
+        # some bookmarks were added concurrently: existing bookmarks are
+        # retreived again, and if needed each bookmark is inserted in
+        # its own savepoint
+        try:
+            return self._insert(bookmarks, using)
+        except IntegrityError:
+            return self._insert(bookmarks, using, bulk=False)
+
+    def bulk_add(self, bookmarks):
+        """
+        Bookmarks are grouped by model: existing bookmarks are retreived
+        in bulk for each group, and the others are inserted using
+        *bulk_create*, in a single transaction. If a bookmark is added
+        concurrently, the insert is retried, falling back to inserting
+        each bookmark in a savepoint.
+        """
+        return self._bulk_add(list(bookmarks), self.db_for_write())
+
+    def _get_model_for_lookups(self, kwargs):
+        """
+        Translate *instance* and *model* in *kwargs* to content type
+        lookups, and return the model storing the requested bookmarks,
+        or None if bookmarks of all content types are requested.
         """
-        order = '-created_at' if kwargs.pop('reversed', False) else 'created_at'
         if 'instance' in kwargs:
             instance = kwargs.pop('instance')
             kwargs.update({
                 'content_type': utils.get_content_type_for_model(instance),
                 'object_id': instance.pk,
             })
-        elif 'model' in kwargs:
+            return self.get_model_for(instance)
+        if 'model' in kwargs:
             model = kwargs.pop('model')
             kwargs['content_type'] = utils.get_content_type_for_model(model)
-        if 'user' in kwargs:
-            queryset = self.get_model().objects.filter_with_contents(**kwargs)
-        else:
-            queryset = self.get_model().objects.filter(**kwargs)
-        return queryset.order_by(order)
+            return self.get_model_for(model)
+        if 'content_type' in kwargs:
+            content_type = kwargs['content_type']
+            if not isinstance(content_type, ContentType):
+                content_type = ContentType.objects.get_for_id(content_type)
+            model = content_type.model_class()
+            if model is not None:
+                return self.get_model_for(model)
+        return None
+
+    def filter(self, **kwargs):
+        """
+        The *kwargs* can be:
+            - user: Django user object or pk
+            - instance: a Django model instance
+            - content_type: a Django ContentType instance or pk
+            - model: a Django model
+            - key: the bookmark key to use
+            - reversed: reverse the order of results
+            - with_users: retreive bookmark users in bulk
+            - user_fields: only retreive these user fields (implies
+              *with_users*)
+
+        If bookmarks of any content type are requested and some
+        registered models have non-integer primary keys, a
+        *bookmarks.archive.QuerysetMerge* is returned, lazily merging the
+        results of all bookmark tables.
+        """
+        is_reversed = kwargs.pop('reversed', False)
+        with_users = kwargs.pop('with_users', False)
+        user_fields = tuple(kwargs.pop('user_fields', None) or ())
+        model = self._get_model_for_lookups(kwargs)
+        bookmark_models = self.get_models() if model is None else [model]
+        using = self.db_for_read(kwargs.get('user'))
+        results = []
+        for model in bookmark_models:
+            querysets = [model.objects.db_manager(using).filter(**kwargs)]
+            if self._uses_archive(model):
+                querysets.append(self.get_archive_model().objects.db_manager(
+                    using).filter(**kwargs))
+            for i, queryset in enumerate(querysets):
+                if 'user' in kwargs:
+                    queryset = queryset.with_contents()
+                if with_users or user_fields:
+                    queryset = queryset.with_users(*user_fields)
+                order = '-created_at' if is_reversed else 'created_at'
+                querysets[i] = queryset.order_by(order)
+            if len(querysets) == 1:
+                results.append(querysets[0])
+            else:
+                # archived bookmarks are older than the others
+                if not is_reversed:
+                    querysets.reverse()
+                results.append(archive.QuerysetChain(*querysets))
+        if len(results) == 1:
+            return results[0]
+        return archive.QuerysetMerge(results, reverse=is_reversed)
 
     def get(self, user, instance, key):
-        bookmark = self.get_model().objects.get_for(instance, key, user=user)
+        using = self.db_for_read(user)
+        model = self.get_model_for(instance)
+        bookmark = model.objects.db_manager(using).get_for(
+            instance, key, user=user)
+        if bookmark is None and self._uses_archive(model):
+            bookmark = self.get_archive_model().objects.db_manager(
+                using).get_for(instance, key, user=user)
         if bookmark is None:
             raise exceptions.DoesNotExist
         return bookmark
@@ -148,8 +502,401 @@ class ModelBackend(BaseBackend):
     def exists(self, user, instance, key):
         return self.filter(instance=instance, user=user, key=key).exists()
 
+    def exists_many(self, user, instances, key):
+        """
+        Bookmarks are looked up using one query for each model
+        of *instances*.
+        """
+        using = self.db_for_read(user)
+        object_ids = {}
+        for instance in instances:
+            object_ids.setdefault(type(instance), set()).add(instance.pk)
+        found = set()
+        for model, pk_set in object_ids.items():
+            lookups = {
+                'user': user,
+                'key': key,
+                'content_type': utils.get_content_type_for_model(model),
+                'object_id__in': list(pk_set),
+            }
+            bookmark_model = self.get_model_for(model)
+            existing = set(bookmark_model.objects.db_manager(using).filter(
+                **lookups).values_list('object_id', flat=True))
+            if self._uses_archive(bookmark_model) and existing != pk_set:
+                existing.update(self.get_archive_model().objects.db_manager(
+                    using).filter(**lookups).values_list(
+                    'object_id', flat=True))
+            # e.g. UUID primary keys are stored as strings
+            found.update((model, utils.to_pk(model, i)) for i in existing)
+        return [(type(i), i.pk) in found for i in instances]
+
+    def annotate(self, queryset_or_model, key, user, attr='is_bookmarked'):
+        """
+        Same as *bookmarks.models.annotate_bookmarks*, but the query is
+        performed using the read database for *user*.
+        """
+        if isinstance(queryset_or_model, django_models.base.ModelBase):
+            model = queryset_or_model
+        else:
+            model = queryset_or_model.model
+        queryset = models.annotate_bookmarks(queryset_or_model, key, user,
+            attr=attr, bookmark_model=self.get_model_for(model))
+        using = self.db_for_read(user)
+        return queryset if using is None else queryset.using(using)
+
+
+class BufferedModelBackend(ModelBackend):
+    """
+    Write-behind bookmarks backend based on Django models.
+
+    Bookmarks are not immediately added or removed: operations are stored
+    in a buffer, where adding and then removing the same bookmark (or
+    vice versa) cancel each other out, and written to the database
+    in bulk by a background thread every
+    *settings.GENERIC_BOOKMARKS_BUFFER['FLUSH_INTERVAL']* seconds.
+
+    Existence checks and retreival of single bookmarks take pending
+    operations into account, while *filter* and *remove_all_for* flush the
+    buffer before hitting the database.
+
+    Note that pending operations are only visible to the current process,
+    and that only generic bookmarks of models with integer primary keys are
+    supported.
+    """
+    def __init__(self, buffer=None):
+        super(BufferedModelBackend, self).__init__()
+        self.buffer = buffers.LocalBuffer() if buffer is None else buffer
+        self.flush_interval = settings.BUFFER.get('FLUSH_INTERVAL')
+        self.batch_size = settings.BUFFER.get('BATCH_SIZE', 500)
+        self._flusher = None
+        self._flusher_lock = threading.Lock()
+
+    def set_dedicated_model(self, model, bookmark_model):
+        raise ImproperlyConfigured('Dedicated bookmark models are not '
+            'supported by the buffered backend.')
+
+    def _get_identity(self, user, instance, key):
+        content_type = utils.get_content_type_for_model(instance)
+        return (user.pk, content_type.pk, instance.pk, key)
+
+    def _get_bookmark(self, identity, created_at=None):
+        user_id, content_type_id, object_id, key = identity
+        return self.get_model()(user_id=user_id,
+            content_type_id=content_type_id, object_id=object_id, key=key,
+            created_at=created_at)
+
+    def _get_query(self, identities):
+        return reduce(operator.or_, [Q(user_id=user_id,
+            content_type_id=content_type_id, object_id=object_id, key=key)
+            for user_id, content_type_id, object_id, key in identities])
+
+    def _start_flusher(self):
+        """
+        Start the thread periodically flushing the buffer, if needed.
+        """
+        if self._flusher is not None or not self.flush_interval:
+            return
+        with self._flusher_lock:
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_forever,
+                    name='bookmarks-flusher')
+                self._flusher.daemon = True
+                self._flusher.start()
+                atexit.register(self.flush)
+
+    def _flush_forever(self):
+        from django.db import connection
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                # operations are restored in the buffer: retry later
+                logger.exception('Error flushing the bookmarks buffer.')
+            finally:
+                connection.close()
+
+    def flush(self):
+        """
+        Write all the pending operations to the database, in batches of
+        *self.batch_size* bookmarks. Return the number of operations.
+
+        Operations being written remain visible until the transaction is
+        committed. If the database write fails, they are restored
+        in the buffer.
+        """
+        operations = self.buffer.pop_all()
+        if not operations:
+            return 0
+        added, removed = [], []
+        for identity, (action, created_at) in operations.items():
+            if action == buffers.ADD:
+                added.append((identity, created_at))
+            else:
+                removed.append(identity)
+        using = self.db_for_write()
+        manager = self.get_model().objects.db_manager(using)
+        try:
+            with transaction.atomic(using=using):
+                for i in range(0, len(removed), self.batch_size):
+                    batch = removed[i:i + self.batch_size]
+                    manager.filter(self._get_query(batch)).delete()
+                for i in range(0, len(added), self.batch_size):
+                    batch = added[i:i + self.batch_size]
+                    existing = set((user_id, content_type_id, object_id,
+                        keys.get_name(key)) for user_id, content_type_id,
+                        object_id, key in manager.filter(self._get_query(
+                        [j[0] for j in batch])).values_list('user_id',
+                        'content_type_id', 'object_id', 'key'))
+                    manager.bulk_create([self._get_bookmark(*j)
+                        for j in batch if j[0] not in existing])
+        except Exception:
+            self.buffer.restore(operations)
+            raise
+        self.buffer.commit(operations)
+        return len(operations)
+
+    def add(self, user, instance, key):
+        identity = self._get_identity(user, instance, key)
+        pending = self.buffer.get(identity)
+        if pending is None:
+            if super(BufferedModelBackend, self).exists(user, instance, key):
+                raise exceptions.AlreadyExists
+        elif pending[0] == buffers.ADD:
+            raise exceptions.AlreadyExists
+        created_at = timezone.now()
+        if not self.buffer.toggle(identity, buffers.ADD, created_at):
+            raise exceptions.AlreadyExists
+        self._pin(user)
+        self._start_flusher()
+        return self._get_bookmark(identity, created_at)
+
+    def remove(self, user, instance, key):
+        identity = self._get_identity(user, instance, key)
+        bookmark = self.get(user, instance, key)
+        if not self.buffer.toggle(identity, buffers.REMOVE, None):
+            raise exceptions.DoesNotExist
+        self._pin(user)
+        self._start_flusher()
+        bookmark.pk = None
+        return bookmark
+
+    def remove_all_for(self, instance):
+        self.flush()
+        super(BufferedModelBackend, self).remove_all_for(instance)
+
+    def bulk_add(self, bookmarks):
+        self.flush()
+        return super(BufferedModelBackend, self).bulk_add(bookmarks)
+
+    def filter(self, **kwargs):
+        self.flush()
+        return super(BufferedModelBackend, self).filter(**kwargs)
+
+    def get(self, user, instance, key):
+        pending = self.buffer.get(self._get_identity(user, instance, key))
+        if pending is None:
+            return super(BufferedModelBackend, self).get(user, instance, key)
+        action, created_at = pending
+        if action == buffers.REMOVE:
+            raise exceptions.DoesNotExist
+        return self._get_bookmark(self._get_identity(user, instance, key),
+            created_at)
+
+    def exists(self, user, instance, key):
+        pending = self.buffer.get(self._get_identity(user, instance, key))
+        if pending is None:
+            return super(BufferedModelBackend, self).exists(
+                user, instance, key)
+        return pending[0] == buffers.ADD
+
+    def exists_many(self, user, instances, key):
+        pending = [self.buffer.get(self._get_identity(user, instance, key))
+            for instance in instances]
+        stored = iter(super(BufferedModelBackend, self).exists_many(user,
+            [i for i, p in zip(instances, pending) if p is None], key))
+        return [next(stored) if p is None else p[0] == buffers.ADD
+            for p in pending]
+
 
-class MongoBackend(BaseBackend):
+class ShardedModelBackend(ModelBackend):
+    """
+    Bookmarks backend based on Django models, partitioning bookmarks by
+    user across the database aliases listed in
+    *settings.GENERIC_BOOKMARKS_SHARDS*.
+
+    The shard of a user is chosen using a stable hash of the user id, so
+    that operations on the bookmarks of a single user hit only one
+    database. Other operations (e.g. retreiving all bookmarks of an object)
+    are performed on all shards in parallel, and the results are merged
+    in creation order.
+
+    Each shard must contain the bookmarks table, while content objects,
+    content types and users are always retreived using their default
+    managers: for this reason *filter* returns a
+    *bookmarks.archive.QuerysetMerge* rather than a queryset. Note that
+    bookmark primary keys are only unique inside a shard.
+
+    Shards are queried by a thread pool created when first needed, whose
+    threads keep their database connections open (as long as they are
+    usable, see *CONN_MAX_AGE*). Set *max_workers* to 1, before the pool
+    is created, to query the shards sequentially.
+    """
+    def __init__(self, shards=None):
+        super(ShardedModelBackend, self).__init__()
+        self.shards = list(shards or settings.SHARDS)
+        if not self.shards:
+            raise ImproperlyConfigured('No bookmarks shards are defined.')
+        self.max_workers = len(self.shards)
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def shard_for(self, user):
+        """
+        Return the database alias storing the bookmarks of *user*
+        (a user instance or pk).
+        """
+        user_id = str(getattr(user, 'pk', user)).encode('utf-8')
+        return self.shards[(zlib.crc32(user_id) & 0xffffffff) % len(
+            self.shards)]
+
+    def db_for_read(self, user=None):
+        """
+        Return the shard storing the bookmarks of *user*, or None.
+        """
+        return None if user is None else self.shard_for(user)
+
+    def _get_manager(self, user, model_or_instance):
+        return self.get_model_for(model_or_instance).objects.db_manager(
+            self.shard_for(user))
+
+    def _get_pool(self):
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    self._pool = ThreadPool(min(self.max_workers,
+                        len(self.shards)))
+        return self._pool
+
+    def _map(self, func, items=None):
+        """
+        Call *func* with each item (by default, each shard alias) and
+        return the list of results. When possible, items are processed
+        in parallel.
+        """
+        items = self.shards if items is None else list(items)
+        if self.max_workers <= 1 or len(items) <= 1:
+            return [func(i) for i in items]
+
+        def call(item):
+            # connections are thread local and kept open by the workers:
+            # discard the ones that are broken or too old
+            close_old_connections()
+            return func(item)
+        return self._get_pool().map(call, items)
+
+    def _set_related(self, bookmark, user, instance):
+        bookmark._user_cache = user
+        bookmark._content_type_cache = utils.get_content_type_for_model(
+            instance)
+        bookmark._content_object_cache = instance
+
+    def add(self, user, instance, key):
+        alias = self.shard_for(user)
+        with transaction.atomic(using=alias):
+            bookmark = self._get_manager(user, instance).add(
+                user, instance, key)
+        self._set_related(bookmark, user, instance)
+        return bookmark
+
+    def remove(self, user, instance, key):
+        alias = self.shard_for(user)
+        with transaction.atomic(using=alias):
+            bookmark = self._get_manager(user, instance).remove(
+                user, instance, key)
+        self._set_related(bookmark, user, instance)
+        return bookmark
+
+    def bulk_add(self, bookmarks):
+        """
+        Bookmarks are added in bulk to the shard of each user.
+        """
+        shards = {}
+        for bookmark in bookmarks:
+            shards.setdefault(self.shard_for(bookmark[0]), []).append(
+                bookmark)
+        return sum(self._bulk_add(group, alias)
+            for alias, group in shards.items())
+
+    def remove_all_for(self, instance):
+        model = self.get_model_for(instance)
+
+        def remove(alias):
+            with transaction.atomic(using=alias):
+                model.objects.db_manager(alias).remove_all_for(instance)
+        self._map(remove)
+
+    def filter(self, **kwargs):
+        is_reversed = kwargs.pop('reversed', False)
+        kwargs.pop('with_users', None)
+        kwargs.pop('user_fields', None)
+        model = self._get_model_for_lookups(kwargs)
+        bookmark_models = self.get_models() if model is None else [model]
+        if 'content_type' in kwargs:
+            content_type = kwargs.pop('content_type')
+            kwargs['content_type_id'] = getattr(content_type, 'pk',
+                content_type)
+        user = kwargs.pop('user', None)
+        if user is not None:
+            kwargs['user_id'] = getattr(user, 'pk', user)
+        order = '-created_at' if is_reversed else 'created_at'
+        aliases = self.shards if user is None else [self.shard_for(user)]
+        querysets = [model.objects.db_manager(alias).filter(
+            **kwargs).order_by(order)
+            for alias in aliases for model in bookmark_models]
+
+        def load_related(bookmarks):
+            utils.load_contents(bookmarks)
+            utils.load_users(bookmarks)
+        return archive.QuerysetMerge(querysets, reverse=is_reversed,
+            map_func=self._map, callback=load_related)
+
+    def get(self, user, instance, key):
+        bookmark = self._get_manager(user, instance).get_for(
+            instance, key, user=user)
+        if bookmark is None:
+            raise exceptions.DoesNotExist
+        self._set_related(bookmark, user, instance)
+        return bookmark
+
+    def exists(self, user, instance, key):
+        content_type = utils.get_content_type_for_model(instance)
+        return self._get_manager(user, instance).filter(user=user, key=key,
+            content_type=content_type, object_id=instance.pk).exists()
+
+    def annotate(self, queryset_or_model, key, user, attr='is_bookmarked'):
+        """
+        Same as *bookmarks.models.annotate_bookmarks*: the bookmarked
+        object ids are retreived from the shard of *user*, and the
+        *queryset_or_model* is annotated using them.
+        """
+        if isinstance(queryset_or_model, django_models.base.ModelBase):
+            queryset = queryset_or_model._default_manager.all()
+        else:
+            queryset = queryset_or_model
+        content_type = utils.get_content_type_for_model(queryset.model)
+        pk_list = list(self._get_manager(user, queryset.model).filter(
+            user=user, key=key, content_type=content_type).values_list(
+            'object_id', flat=True))
+        if not pk_list:
+            return queryset.extra(select={attr: '0'})
+        opts = queryset.model._meta
+        sql = '%s.%s IN (%s)' % (opts.db_table, opts.pk.column,
+            ', '.join(['%s'] * len(pk_list)))
+        return queryset.extra(select={attr: sql}, select_params=pk_list)
+
+
+class MongoBackend(BaseBackend, AsyncMongoBackendMixin):
     """
     Bookmarks backend based on MongoDB.
     """
@@ -171,13 +918,53 @@ class MongoBackend(BaseBackend):
     def _get_content_type_id(self, instance):
         return utils.get_content_type_for_model(instance).id
 
+    def _get_lookups(self, user, instance, key):
+        """
+        Return the document lookups identifying a single bookmark.
+        """
+        return {
+            'content_type_id': self._get_content_type_id(instance),
+            'object_id': instance.pk,
+            'key': key,
+            'user_id': user.pk,
+        }
+
+    def _get_filter_lookups(self, kwargs):
+        """
+        Translate the *filter* method *kwargs* to document lookups.
+        """
+        kwargs = dict(kwargs)
+        kwargs.pop('with_users', None)
+        kwargs.pop('user_fields', None)
+        lookups = {}
+        if 'instance' in kwargs:
+            instance = kwargs.pop('instance')
+            lookups.update({
+                'content_type_id': self._get_content_type_id(instance),
+                'object_id': instance.pk,
+            })
+        elif 'model' in kwargs:
+            model = kwargs.pop('model')
+            lookups['content_type_id'] = self._get_content_type_id(model)
+        if 'content_type' in kwargs:
+            content_type = kwargs.pop('content_type')
+            lookups['content_type_id'] = getattr(content_type, 'pk',
+                content_type)
+        if 'user' in kwargs:
+            user = kwargs.pop('user')
+            lookups['user_id'] = getattr(user, 'pk', user)
+        lookups.update(kwargs)
+        return lookups
+
     def _create_model(self):
         import datetime
-        from mongoengine import Document, IntField, StringField, DateTimeField
+        from mongoengine import (Document, IntField, StringField,
+            DateTimeField, DynamicField)
 
         class Bookmark(Document):
             content_type_id = IntField(required=True, min_value=1)
-            object_id = IntField(required=True, min_value=1)
+            # the object id is stored using the type of the primary key
+            object_id = DynamicField(required=True)
 
             key = StringField(required=True, max_length=16)
 
@@ -232,6 +1019,28 @@ class MongoBackend(BaseBackend):
         bookmark.delete()
         return bookmark
 
+    def bulk_add(self, bookmarks):
+        """
+        Bookmarks are inserted using an unordered *insert_many*, so that
+        existing bookmarks are skipped by the unique index.
+        """
+        from pymongo.errors import BulkWriteError
+        model = self.get_model()
+        model.ensure_indexes()
+        now = datetime.datetime.now()
+        documents = [model(content_type_id=self._get_content_type_id(m),
+            object_id=object_id, key=key, user_id=user_id,
+            created_at=created_at or now).to_mongo()
+            for user_id, m, object_id, key, created_at in bookmarks]
+        if not documents:
+            return 0
+        collection = model._get_collection()
+        try:
+            result = collection.insert_many(documents, ordered=False)
+        except BulkWriteError as err:
+            return err.details['nInserted']
+        return len(result.inserted_ids)
+
     def remove_all_for(self, instance):
         model = self.get_model()
         model.objects.filter(
@@ -248,28 +1057,18 @@ class MongoBackend(BaseBackend):
             - model: a Django model
             - key: the bookmark key to use
             - reversed: reverse the order of results
+            - with_users: retreive bookmark users in bulk
+            - user_fields: only retreive these user fields (implies
+              *with_users*)
         """
         order = '-created_at' if kwargs.pop('reversed', False) else 'created_at'
-        if 'instance' in kwargs:
-            instance = kwargs.pop('instance')
-            kwargs.update({
-                'content_type_id': self._get_content_type_id(instance),
-                'object_id': instance.pk,
-            })
-        elif 'model' in kwargs:
-            model = kwargs.pop('model')
-            kwargs['content_type'] = self._get_content_type_id(model)
-        return self.get_model().objects.filter(**kwargs).order_by(order)
+        lookups = self._get_filter_lookups(kwargs)
+        return self.get_model().objects.filter(**lookups).order_by(order)
 
     def get(self, user, instance, key):
         model = self.get_model()
         try:
-            return model.objects.get(
-                content_type_id=self._get_content_type_id(instance),
-                object_id=instance.pk,
-                key=key,
-                user_id=user.pk
-            )
+            return model.objects.get(**self._get_lookups(user, instance, key))
         except model.DoesNotExist:
             raise exceptions.DoesNotExist
 
@@ -280,8 +1079,349 @@ class MongoBackend(BaseBackend):
             return False
         return True
 
+    def exists_many(self, user, instances, key):
+        object_ids = {}
+        for instance in instances:
+            content_type_id = self._get_content_type_id(instance)
+            object_ids.setdefault(content_type_id, set()).add(instance.pk)
+        found = set()
+        for content_type_id, pk_set in object_ids.items():
+            documents = self.get_model().objects(user_id=user.pk, key=key,
+                content_type_id=content_type_id, object_id__in=list(pk_set))
+            found.update((content_type_id, i)
+                for i in documents.scalar('object_id'))
+        return [(self._get_content_type_id(i), i.pk) in found
+            for i in instances]
+
+
+class RedisBookmark(object):
+    """
+    A bookmark stored by *RedisBackend*.
+
+    The bookmark is identified by its *id*, a string containing the user id,
+    the content type id, the object id and the key. The id is None if
+    the bookmark has been removed.
+    """
+    def __init__(self, user_id, content_type_id, object_id, key, score):
+        self.user_id = user_id
+        self.content_type_id = content_type_id
+        self.object_id = object_id
+        self.key = key
+        self.score = score
+        self.id = self.get_id(user_id, content_type_id, object_id, key)
+
+    def __unicode__(self):
+        return u'Bookmark for %s by %s' % (self.content_object, self.user)
+
+    def _get_identity(self):
+        return (self.user_id, self.content_type_id, self.object_id, self.key)
+
+    def __eq__(self, other):
+        return isinstance(other, RedisBookmark) and (
+            self._get_identity() == other._get_identity())
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self._get_identity())
+
+    @classmethod
+    def get_id(cls, user_id, content_type_id, object_id, key):
+        return '%s:%s:%s:%s' % (user_id, content_type_id, object_id, key)
+
+    @classmethod
+    def from_id(cls, bookmark_id, score):
+        if isinstance(bookmark_id, bytes):
+            bookmark_id = bookmark_id.decode('utf-8')
+        # the object id can contain colons
+        user_id, content_type_id, object_id = bookmark_id.split(':', 2)
+        object_id, key = object_id.rsplit(':', 1)
+        if object_id.isdigit():
+            object_id = int(object_id)
+        return cls(int(user_id), int(content_type_id), object_id, key, score)
+
+    @property
+    def pk(self):
+        return self.id
+
+    @property
+    def created_at(self):
+        from django.conf import settings as django_settings
+        if django_settings.USE_TZ:
+            return datetime.datetime.fromtimestamp(self.score, timezone.utc)
+        return datetime.datetime.fromtimestamp(self.score)
+
+    @property
+    def content_type(self):
+        return ContentType.objects.get_for_id(self.content_type_id)
+
+    @property
+    def user(self):
+        if not hasattr(self, '_user_cache'):
+            self._user_cache = User.objects.get(pk=self.user_id)
+        return self._user_cache
+
+    @property
+    def content_object(self):
+        if not hasattr(self, '_content_object_cache'):
+            content_type = self.content_type
+            self._content_object_cache = (
+                content_type.get_object_for_this_type(pk=self.object_id))
+        return self._content_object_cache
+
+
+class RedisBackend(BaseBackend):
+    """
+    Bookmarks backend based on Redis sorted sets.
+
+    Each bookmark is stored in several sorted sets (all bookmarks, by user,
+    by user and key, by object, by content type and by key) scored by
+    creation time, so that existence checks are O(1) and bookmark listings
+    never hit the database (except for retreiving content objects).
+
+    The *client* argument can be any object implementing the *redis-py*
+    sorted sets API: if not given, a client is created using
+    *settings.GENERIC_BOOKMARKS_REDIS*. In tests you can use
+    *fakeredis* or *bookmarks.localredis.LocalRedis*.
+    """
+    def __init__(self, client=None, prefix=None):
+        if client is None:
+            import redis
+            client = redis.StrictRedis(**settings.REDIS.get('PARAMETERS', {}))
+        self.client = client
+        self.prefix = prefix or settings.REDIS.get('PREFIX', 'bookmarks')
+
+    def _get_content_type_id(self, instance):
+        return utils.get_content_type_for_model(instance).id
+
+    def _get_score(self, created_at):
+        """
+        Convert the *created_at* datetime to a timestamp.
+        """
+        if created_at.tzinfo is None:
+            timestamp = time.mktime(created_at.timetuple())
+        else:
+            timestamp = calendar.timegm(created_at.utctimetuple())
+        return timestamp + created_at.microsecond / 1e6
+
+    def _get_name(self, *args):
+        return ':'.join([self.prefix] + [str(i) for i in args])
+
+    def _get_names(self, bookmark):
+        """
+        Return the names of all the sorted sets containing *bookmark*.
+        """
+        return [
+            self._get_name('all'),
+            self._get_name('user', bookmark.user_id),
+            self._get_name('user', bookmark.user_id, bookmark.key),
+            self._get_name('object', bookmark.content_type_id,
+                bookmark.object_id),
+            self._get_name('ct', bookmark.content_type_id),
+            self._get_name('key', bookmark.key),
+        ]
+
+    def _get_bookmark(self, user, instance, key, score=None):
+        return RedisBookmark(user.pk, self._get_content_type_id(instance),
+            instance.pk, key, score)
+
+    def get_model(self):
+        return RedisBookmark
+
+    def add(self, user, instance, key):
+        bookmark = self._get_bookmark(user, instance, key, time.time())
+        mapping = {bookmark.id: bookmark.score}
+        if not self.client.zadd(self._get_name('all'), mapping, nx=True):
+            raise exceptions.AlreadyExists
+        pipeline = self.client.pipeline()
+        for name in self._get_names(bookmark)[1:]:
+            pipeline.zadd(name, mapping)
+        pipeline.execute()
+        return bookmark
+
+    def remove(self, user, instance, key):
+        bookmark = self.get(user, instance, key)
+        if not self.client.zrem(self._get_name('all'), bookmark.id):
+            raise exceptions.DoesNotExist
+        pipeline = self.client.pipeline()
+        for name in self._get_names(bookmark)[1:]:
+            pipeline.zrem(name, bookmark.id)
+        pipeline.execute()
+        bookmark.id = None
+        return bookmark
+
+    def remove_all_for(self, instance):
+        name = self._get_name('object', self._get_content_type_id(instance),
+            instance.pk)
+        pipeline = self.client.pipeline()
+        for bookmark_id, score in self.client.zrange(name, 0, -1,
+                withscores=True):
+            bookmark = RedisBookmark.from_id(bookmark_id, score)
+            for i in self._get_names(bookmark):
+                pipeline.zrem(i, bookmark.id)
+        pipeline.delete(name)
+        pipeline.execute()
+
+    def filter(self, **kwargs):
+        """
+        The *kwargs* can be:
+            - user: Django user object or pk
+            - instance: a Django model instance
+            - content_type: a Django ContentType instance or pk
+            - model: a Django model
+            - key: the bookmark key to use
+            - reversed: reverse the order of results
+            - with_users: retreive bookmark users in bulk
+            - user_fields: only retreive these user fields (implies
+              *with_users*)
+
+        Return a list of bookmarks, read from the most selective sorted set
+        available for given *kwargs*.
+        """
+        is_reversed = kwargs.pop('reversed', False)
+        with_users = kwargs.pop('with_users', False)
+        with_users = kwargs.pop('user_fields', None) or with_users
+        lookups = {}
+        object_model = None
+        if 'instance' in kwargs:
+            instance = kwargs.pop('instance')
+            object_model = type(instance)
+            lookups['content_type_id'] = self._get_content_type_id(instance)
+            # e.g. UUID primary keys are stored as strings
+            lookups['object_id'] = utils.to_pk(object_model, instance.pk)
+        elif 'model' in kwargs:
+            model = kwargs.pop('model')
+            lookups['content_type_id'] = self._get_content_type_id(model)
+        if 'content_type' in kwargs:
+            content_type = kwargs.pop('content_type')
+            lookups['content_type_id'] = getattr(content_type, 'pk',
+                content_type)
+        if 'user' in kwargs:
+            user = kwargs.pop('user')
+            lookups['user_id'] = getattr(user, 'pk', user)
+        if 'key' in kwargs:
+            lookups['key'] = kwargs.pop('key')
+        if kwargs:
+            raise TypeError('Invalid lookups: %s' % ', '.join(kwargs))
+        # choosing the sorted set
+        if 'object_id' in lookups:
+            name = self._get_name('object', lookups['content_type_id'],
+                lookups['object_id'])
+        elif 'user_id' in lookups and 'key' in lookups:
+            name = self._get_name('user', lookups['user_id'], lookups['key'])
+        elif 'user_id' in lookups:
+            name = self._get_name('user', lookups['user_id'])
+        elif 'content_type_id' in lookups:
+            name = self._get_name('ct', lookups['content_type_id'])
+        elif 'key' in lookups:
+            name = self._get_name('key', lookups['key'])
+        else:
+            name = self._get_name('all')
+        members = self.client.zrange(name, 0, -1, desc=is_reversed,
+            withscores=True)
+        bookmarks = []
+        for bookmark_id, score in members:
+            bookmark = RedisBookmark.from_id(bookmark_id, score)
+            values = dict((k, getattr(bookmark, k)) for k in lookups)
+            if object_model is not None:
+                values['object_id'] = utils.to_pk(object_model,
+                    values['object_id'])
+            if values == lookups:
+                bookmarks.append(bookmark)
+        if 'user_id' in lookups:
+            utils.load_contents(bookmarks)
+        if with_users:
+            utils.load_users(bookmarks)
+        return bookmarks
+
+    def get(self, user, instance, key):
+        bookmark = self._get_bookmark(user, instance, key)
+        bookmark.score = self.client.zscore(
+            self._get_name('user', user.pk, key), bookmark.id)
+        if bookmark.score is None:
+            raise exceptions.DoesNotExist
+        return bookmark
+
+    def exists(self, user, instance, key):
+        bookmark = self._get_bookmark(user, instance, key)
+        return self.client.zscore(self._get_name('user', user.pk, key),
+            bookmark.id) is not None
+
+    def exists_many(self, user, instances, key):
+        name = self._get_name('user', user.pk, key)
+        pipeline = self.client.pipeline(transaction=False)
+        for instance in instances:
+            pipeline.zscore(name, self._get_bookmark(user, instance, key).id)
+        return [score is not None for score in pipeline.execute()]
+
+    def check_consistency(self, backend=None, repair=False):
+        """
+        Compare the bookmarks stored in Redis with the ones stored by
+        another *backend* (by default the Django model backend).
+
+        Return a tuple *(missing, unexpected)* of sets of bookmark ids:
+        *missing* are the bookmarks not present in Redis, *unexpected*
+        are the bookmarks present only in Redis.
+
+        If *repair* is True, Redis is updated to match the other backend.
+        """
+        if backend is None:
+            backend = ModelBackend()
+        expected = {}
+        for bookmark in backend.filter():
+            bookmark_id = RedisBookmark.get_id(bookmark.user_id,
+                bookmark.content_type_id, bookmark.object_id, bookmark.key)
+            expected[bookmark_id] = bookmark.created_at
+        stored = set(RedisBookmark.from_id(i, None).id
+            for i in self.client.zrange(self._get_name('all'), 0, -1))
+        missing = set(expected) - stored
+        unexpected = stored - set(expected)
+        if repair:
+            pipeline = self.client.pipeline()
+            for bookmark_id in missing:
+                score = self._get_score(expected[bookmark_id])
+                bookmark = RedisBookmark.from_id(bookmark_id, score)
+                for name in self._get_names(bookmark):
+                    pipeline.zadd(name, {bookmark_id: score})
+            for bookmark_id in unexpected:
+                bookmark = RedisBookmark.from_id(bookmark_id, None)
+                for name in self._get_names(bookmark):
+                    pipeline.zrem(name, bookmark_id)
+            pipeline.execute()
+        return missing, unexpected
+
 
 def get_backend():
+    backend = _load_backend()
+    if settings.SUMMARIES['ENABLED']:
+        backend = summaries.SummarizedBackend(backend)
+    if settings.TRENDING['ENABLED']:
+        backend = trending.TrendingBackend(backend)
+    if settings.BLOOM['ENABLED']:
+        backend = bloom.BloomFilterBackend(backend)
+    if settings.INDEX['ENABLED']:
+        backend = index.IndexedBackend(backend)
+    if settings.INSTRUMENTATION['ENABLED']:
+        return instrumentation.InstrumentedBackend(backend)
+    return backend
+
+
+def unwrap(backend):
+    """
+    Return the backend wrapped by the summaries, trending, Bloom filters,
+    index and instrumentation wrappers (see *get_backend*), e.g. to check
+    its type.
+    """
+    wrappers = (summaries.SummarizedBackend, trending.TrendingBackend,
+        bloom.BloomFilterBackend, index.IndexedBackend,
+        instrumentation.InstrumentedBackend)
+    while isinstance(backend, wrappers):
+        backend = backend.backend
+    return backend
+
+
+def _load_backend():
     if settings.BACKEND is None:
         return ModelBackend()
     i = settings.BACKEND.rfind('.')
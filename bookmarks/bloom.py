@@ -0,0 +1,256 @@
+"""
+Bloom filters of the bookmarks saved by each user.
+
+Most objects rendered in a page are not bookmarked by the current user,
+but checking that a bookmark does not exist still requires a query. If
+*settings.GENERIC_BOOKMARKS_BLOOM['ENABLED']* is True, the backend is
+wrapped by *BloomFilterBackend*, which keeps in the Django cache a Bloom
+filter of the *(key, content type, object id)* of the bookmarks of each
+user: *exists*, *exists_many* and *get* answer "not bookmarked" without
+queries when the filter does not contain the bookmark, and only possible
+positives (including a fraction *ERROR_RATE* of false positives) are
+looked up using the backend.
+
+Filters are built from the backend the first time they are needed, and
+updated when bookmarks are added. Since a Bloom filter does not support
+removals, removed bookmarks remain (harmless) positives until the filter
+expires after *TIMEOUT* seconds, or until it is full, and is rebuilt.
+
+Each filter is stored with a version number, incremented in the cache
+(atomically) before updating the filter: a filter whose version is not
+the current one, e.g. because it was built while a bookmark was being
+added, is never used, so that bookmarks are never reported missing.
+"""
+import hashlib
+import math
+import random
+import struct
+
+from django.core.cache import cache
+from django.utils import six
+
+from bookmarks import settings, exceptions, utils, export, instrumentation
+
+try:
+    from bookmarks.aio import AsyncBackendMixin
+except SyntaxError:
+    # the asynchronous API requires Python >= 3.5
+    AsyncBackendMixin = object
+
+
+class BloomFilter(object):
+    """
+    A Bloom filter sized to contain *capacity* items with the given
+    false positive *error_rate*.
+    """
+    def __init__(self, capacity, error_rate, bits=None, count=0):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(8, int(math.ceil(
+            -capacity * math.log(error_rate) / math.log(2) ** 2)))
+        self.hashes = max(1, int(round(
+            float(self.size) / capacity * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8) if bits is None else (
+            bytearray(bits))
+        self.count = count
+
+    def _get_positions(self, item):
+        # double hashing: positions are h1 + i * h2 (Kirsch-Mitzenmacher)
+        digest = hashlib.md5(item.encode('utf-8')).digest()
+        h1, h2 = struct.unpack('<QQ', digest)
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, item):
+        for position in self._get_positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7))
+            for position in self._get_positions(item))
+
+    @property
+    def is_full(self):
+        return self.count > self.capacity
+
+    def to_data(self):
+        return (self.capacity, self.error_rate, bytes(self.bits), self.count)
+
+    @classmethod
+    def from_data(cls, data):
+        return cls(*data)
+
+
+def get_item(key, content_type_id, object_id):
+    return u'%s:%s:%s' % (key, content_type_id, object_id)
+
+
+def _get_user_id(user):
+    return getattr(user, 'pk', user)
+
+
+def get_cache_key(user):
+    return 'bookmarks:bloom:%s' % _get_user_id(user)
+
+
+def get_version_key(user):
+    return 'bookmarks:bloom:%s:version' % _get_user_id(user)
+
+
+def _new_version():
+    # random, so that filters stored before the version was evicted
+    # from the cache do not match
+    return random.randint(1, 1 << 62)
+
+
+def get_version(user):
+    """
+    Return the current version of the filter of *user*.
+    """
+    version_key = get_version_key(user)
+    version = cache.get(version_key)
+    if version is None:
+        cache.add(version_key, _new_version(), None)
+        version = cache.get(version_key)
+    return version
+
+
+def incr_version(user):
+    """
+    Invalidate the stored filter of *user* and return the new version.
+    """
+    version_key = get_version_key(user)
+    try:
+        return cache.incr(version_key)
+    except ValueError:
+        # the version is missing from the cache: a new random version is
+        # set, since a concurrent *get_version* may have added the version
+        # of a filter being built
+        version = _new_version()
+        cache.set(version_key, version, None)
+        return version
+
+
+def build(user, backend, error_rate=None):
+    """
+    Return a *BloomFilter* containing the bookmarks of *user*, built
+    using *backend*. Buffered operations are flushed first.
+    """
+    from bookmarks import summaries
+    export.flush(backend)
+    options = settings.BLOOM
+    items = [get_item(key, content_type_id, object_id)
+        for content_type_id, object_id, key, created_at in
+        summaries._iter_bookmarks(backend, user)]
+    bloom_filter = BloomFilter(max(len(items) * 2, options['MIN_CAPACITY']),
+        error_rate or options['ERROR_RATE'])
+    for item in items:
+        bloom_filter.add(item)
+    return bloom_filter
+
+
+def _store(user, version, bloom_filter):
+    cache.set(get_cache_key(user), (version, bloom_filter.to_data()),
+        settings.BLOOM['TIMEOUT'])
+
+
+def get_filter(user, backend):
+    """
+    Return the current *BloomFilter* of *user*, building it if missing.
+    """
+    data = cache.get_many([get_cache_key(user), get_version_key(user)])
+    stored = data.get(get_cache_key(user))
+    version = data.get(get_version_key(user))
+    hit = stored is not None and version is not None and stored[0] == version
+    instrumentation.record_cache('bloom', hit)
+    if hit:
+        return BloomFilter.from_data(stored[1])
+    # the version is read before the bookmarks: if a bookmark is added
+    # meanwhile, the stored filter is not used
+    version = get_version(user)
+    bloom_filter = build(user, backend)
+    _store(user, version, bloom_filter)
+    return bloom_filter
+
+
+def record_add(user, instance, key):
+    """
+    Update the filter of *user* after a bookmark is added.
+    """
+    version = incr_version(user)
+    stored = cache.get(get_cache_key(user))
+    if stored is None or stored[0] != version - 1:
+        # missing, or updated concurrently: built when needed
+        return
+    bloom_filter = BloomFilter.from_data(stored[1])
+    bloom_filter.add(_get_instance_item(instance, key))
+    if bloom_filter.is_full:
+        cache.delete(get_cache_key(user))
+    else:
+        _store(user, version, bloom_filter)
+
+
+def _get_instance_item(instance, key):
+    content_type_id = utils.get_content_type_for_model(type(instance)).pk
+    return get_item(key, content_type_id, six.text_type(instance.pk))
+
+
+class BloomFilterBackend(AsyncBackendMixin):
+    """
+    Wrap a bookmarks *backend*, answering negative existence checks
+    using the Bloom filters of users. Other attributes are delegated
+    to the backend.
+
+    Coroutine methods run the wrapped synchronous methods in the bookmarks
+    thread pool (see *bookmarks.aio*).
+    """
+    def __init__(self, backend):
+        self.backend = backend
+
+    def _is_enabled_for(self, user):
+        return user is not None and _get_user_id(user) is not None
+
+    def add(self, user, instance, key):
+        bookmark = self.backend.add(user, instance, key)
+        record_add(user, instance, key)
+        return bookmark
+
+    def bulk_add(self, bookmarks):
+        bookmarks = list(bookmarks)
+        added = self.backend.bulk_add(bookmarks)
+        if added:
+            for user_id in set(i[0] for i in bookmarks):
+                incr_version(user_id)
+        return added
+
+    def get(self, user, instance, key):
+        if self._is_enabled_for(user) and _get_instance_item(
+                instance, key) not in get_filter(user, self.backend):
+            raise exceptions.DoesNotExist
+        return self.backend.get(user, instance, key)
+
+    def exists(self, user, instance, key):
+        if self._is_enabled_for(user) and _get_instance_item(
+                instance, key) not in get_filter(user, self.backend):
+            return False
+        return self.backend.exists(user, instance, key)
+
+    def exists_many(self, user, instances, key):
+        """
+        Only the instances possibly bookmarked are looked up using
+        the backend.
+        """
+        instances = list(instances)
+        if not self._is_enabled_for(user) or not instances:
+            return self.backend.exists_many(user, instances, key)
+        bloom_filter = get_filter(user, self.backend)
+        candidates = [i for i in instances
+            if _get_instance_item(i, key) in bloom_filter]
+        if not candidates:
+            return [False] * len(instances)
+        found = set(id(i) for i, exists in zip(candidates,
+            self.backend.exists_many(user, candidates, key)) if exists)
+        return [id(i) in found for i in instances]
+
+    def __getattr__(self, attr):
+        return getattr(self.backend, attr)
@@ -0,0 +1,95 @@
+"""
+Buffers storing the pending operations of
+*bookmarks.backends.BufferedModelBackend*.
+
+A pending operation is identified by a tuple
+*(user_id, content_type_id, object_id, key)* and its value is a tuple
+*(action, created_at)*, where *action* is *ADD* or *REMOVE*.
+
+Operations being flushed are kept "in flight" until the flush is
+committed (or failed), so that they are still visible while they are
+written to the database.
+"""
+import threading
+
+ADD = 'add'
+REMOVE = 'remove'
+
+
+class LocalBuffer(object):
+    """
+    Thread-safe in-process buffer.
+
+    Pending operations are only visible to the current process and are
+    lost if the process is killed before they are flushed.
+    """
+    def __init__(self):
+        self._operations = {}
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._operations)
+
+    def get(self, identity):
+        """
+        Return the pending operation for *identity*, or None. Operations
+        being flushed are taken into account.
+        """
+        operation = self._operations.get(identity)
+        if operation is None:
+            operation = self._in_flight.get(identity)
+        return operation
+
+    def toggle(self, identity, action, created_at):
+        """
+        Add a pending *action* for *identity*: if the opposite action is
+        pending, both are cancelled.
+
+        Return False if the same action is already pending, True otherwise.
+        """
+        with self._lock:
+            pending = self._operations.get(identity)
+            if pending is None:
+                self._operations[identity] = (action, created_at)
+            elif pending[0] == action:
+                return False
+            else:
+                del self._operations[identity]
+            return True
+
+    def pop_all(self):
+        """
+        Remove and return all the pending operations as a dict. They are
+        kept in flight until *commit* or *restore* is called.
+        """
+        with self._lock:
+            operations, self._operations = self._operations, {}
+            self._in_flight.update(operations)
+        return operations
+
+    def _discard(self, operations):
+        for identity, operation in operations.items():
+            if self._in_flight.get(identity) is operation:
+                del self._in_flight[identity]
+
+    def commit(self, operations):
+        """
+        Forget *operations*, written to the database.
+        """
+        with self._lock:
+            self._discard(operations)
+
+    def restore(self, operations):
+        """
+        Put back *operations* that could not be flushed. A newer operation
+        pending for the same bookmark was the opposite action, and
+        cancels the restored one.
+        """
+        with self._lock:
+            self._discard(operations)
+            for identity, operation in operations.items():
+                if identity in self._operations:
+                    del self._operations[identity]
+                else:
+                    self._operations[identity] = operation
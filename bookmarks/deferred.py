@@ -0,0 +1,199 @@
+"""
+Deferred, batched bookmark checks during template rendering.
+
+Templates rendering a *bookmark_form* for each object in a list check the
+existence of each bookmark with a query. If
+*bookmarks.deferred.DeferredBookmarksMiddleware* is installed, the
+*bookmark_form* and *bookmark_state* templatetags do not check bookmarks
+while rendering: they register a demand with the *Collector* of the
+request, and output a placeholder. When the response is returned the
+middleware checks all the demands using the *exists_many* method of the
+backend (i.e. one query for each content type and key using the model
+backend), renders the final markup and replaces the placeholders.
+
+The *bookmark* templatetag, whose result is used while rendering, cannot
+be deferred: if the middleware is installed, the first tag retreives in
+bulk the bookmarks of the current user for the model and key, and the
+following tags for the same model and key do not hit the database.
+
+Placeholders are only valid for the request rendering them: templatetags
+must not be used inside cached template fragments. Since placeholders are
+replaced in the response content, the middleware must be listed after the
+middlewares changing the content in their *process_response* (e.g.
+*GZipMiddleware*, and *CommonMiddleware* computing ETags), so that it runs
+before them: encoded responses containing placeholders raise
+*ImproperlyConfigured*, other encoded responses are not changed.
+
+Streamed responses are buffered in chunks of *STREAM_BUFFER_SIZE* bytes:
+the bookmarks of the placeholders in each chunk are checked together.
+"""
+import re
+import uuid
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import six
+
+from bookmarks import utils
+
+PLACEHOLDER = u'<!--bookmarks:%s:%d-->'
+
+# minimum size of the chunks of streamed responses
+STREAM_BUFFER_SIZE = 64 * 1024
+
+
+def get_collector(request):
+    """
+    Return the *Collector* of *request*, or None if bookmark checks
+    cannot be deferred.
+    """
+    return getattr(request, 'bookmarks_collector', None)
+
+
+def prime(form, instance, exists):
+    """
+    Set in *form* the bookmarked *instance* and whether the bookmark
+    exists, if supported by the form class.
+    """
+    method = getattr(form, 'prime', None)
+    if method is not None:
+        method(instance, exists)
+
+
+class Collector(object):
+    """
+    The bookmark checks deferred while rendering the response
+    to *request*.
+    """
+    def __init__(self, request):
+        self.request = request
+        self.nonce = uuid.uuid4().hex
+        self.demands = []
+        self.results = {}
+        self.bookmarks = {}
+        prefix = PLACEHOLDER.split('%d')[0] % self.nonce
+        self.pattern = re.compile(re.escape(prefix).encode('ascii') +
+            br'(\d+)-->')
+        # placeholders are shorter, with less than 20 digits
+        self.max_length = len(prefix) + 23
+
+    def defer(self, backend, instance, key, callback):
+        """
+        Register the check of the bookmark of the current user for
+        *instance* using *key*, and return a placeholder, replaced by
+        *callback(exists)* when the response is returned.
+        """
+        self.demands.append((backend, instance, key, callback))
+        return PLACEHOLDER % (self.nonce, len(self.demands) - 1)
+
+    def get_bookmark(self, backend, instance, key):
+        """
+        Return the bookmark of the current user for *instance* using *key*,
+        or None. The bookmarks of the user for the model of *instance* and
+        *key* are retreived in bulk the first time.
+        """
+        model = type(instance)
+        bookmarks = self.bookmarks.get((id(backend), model, key))
+        if bookmarks is None:
+            bookmarks = self.bookmarks[id(backend), model, key] = dict(
+                (utils.to_pk(model, i.object_id), i) for i in backend.filter(
+                user=self.request.user, model=model, key=key))
+        return bookmarks.get(instance.pk)
+
+    def resolve(self):
+        """
+        Check the bookmarks of the pending demands in bulk, and return
+        a dict mapping demand indexes to the final markup.
+        """
+        pending = [i for i in range(len(self.demands))
+            if i not in self.results]
+        groups = {}
+        for i in pending:
+            backend, instance, key, callback = self.demands[i]
+            group = groups.setdefault((id(backend), key), (backend, key, {}))
+            group[2].setdefault((type(instance), instance.pk), instance)
+        found = {}
+        for backend, key, instances in groups.values():
+            results = backend.exists_many(self.request.user,
+                list(instances.values()), key)
+            for identity, exists in zip(instances, results):
+                found[(id(backend), key) + identity] = exists
+        for i in pending:
+            backend, instance, key, callback = self.demands[i]
+            exists = found[id(backend), key, type(instance), instance.pk]
+            self.results[i] = callback(exists)
+        return self.results
+
+    def substitute(self, content, charset):
+        """
+        Return *content* (bytes) replacing the placeholders.
+        """
+        if len(self.results) < len(self.demands):
+            self.resolve()
+
+        def replace(match):
+            markup = self.results.get(int(match.group(1)))
+            if markup is None:
+                return match.group(0)
+            return six.text_type(markup).encode(charset)
+        return self.pattern.sub(replace, content)
+
+    def _get_complete(self, content):
+        # return the length of *content* excluding a trailing incomplete
+        # placeholder, continued by the next chunk
+        start = content.rfind(b'<', max(0, len(content) - self.max_length))
+        if start == -1 or b'>' in content[start:]:
+            return len(content)
+        return start
+
+    def substitute_stream(self, chunks, charset):
+        """
+        Yield the *chunks* (bytes) of a streamed response replacing the
+        placeholders, in chunks of at least *STREAM_BUFFER_SIZE* bytes.
+        """
+        pending, size = [], 0
+        for chunk in chunks:
+            pending.append(chunk)
+            size += len(chunk)
+            if size >= STREAM_BUFFER_SIZE:
+                content = b''.join(pending)
+                end = self._get_complete(content)
+                yield self.substitute(content[:end], charset)
+                pending, size = [content[end:]], len(content) - end
+        content = b''.join(pending)
+        if content:
+            yield self.substitute(content, charset)
+
+
+class DeferredBookmarksMiddleware(object):
+    """
+    Defer bookmark checks of templatetags until the response is returned:
+    add *'bookmarks.deferred.DeferredBookmarksMiddleware'* to
+    *MIDDLEWARE_CLASSES*, after the authentication middleware and the
+    middlewares encoding or hashing the content (e.g. *GZipMiddleware*).
+    """
+    def process_request(self, request):
+        request.bookmarks_collector = Collector(request)
+
+    def process_response(self, request, response):
+        collector = get_collector(request)
+        if collector is None:
+            return response
+        if response.has_header('Content-Encoding'):
+            # e.g. compressed files are streamed unchanged
+            if collector.demands:
+                raise ImproperlyConfigured('DeferredBookmarksMiddleware '
+                    'cannot replace placeholders in encoded responses: it '
+                    'must be listed after the middlewares encoding them.')
+            return response
+        charset = getattr(response, 'charset', None) or getattr(
+            response, '_charset', settings.DEFAULT_CHARSET)
+        if getattr(response, 'streaming', False):
+            # templatetags are rendered while the content is streamed
+            response.streaming_content = collector.substitute_stream(
+                response.streaming_content, charset)
+        elif collector.demands:
+            response.content = collector.substitute(response.content, charset)
+            if response.has_header('Content-Length'):
+                response['Content-Length'] = str(len(response.content))
+        return response
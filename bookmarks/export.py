@@ -0,0 +1,180 @@
+"""
+Streaming export of bookmarks to CSV or JSON Lines.
+
+Bookmarks are read in chunks ordered by primary key, retreiving the
+content objects of each chunk in bulk, and rows are generated one by one,
+so that the whole table can be exported using constant memory, e.g.::
+
+    from bookmarks import export
+    from bookmarks.handlers import library
+
+    with open('bookmarks.csv', 'w') as f:
+        for line in export.export(library.backend, user=user):
+            f.write(line)
+
+Each row contains the user id, the bookmarked model (as
+*app_label.model*), the object id, the key, the creation date (ISO 8601)
+and the text representation of the bookmarked object.
+"""
+import collections
+import csv
+import json
+
+from django.contrib.contenttypes.models import ContentType
+from django.utils import six
+
+from bookmarks import settings, utils
+
+FIELDS = ('user', 'model', 'object_id', 'key', 'created_at', 'object')
+
+CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+
+
+def flush(backend):
+    """
+    Write the operations pending in the buffer of *backend*, if any
+    (see *bookmarks.backends.BufferedModelBackend*).
+    """
+    method = getattr(backend, 'flush', None)
+    if method is not None:
+        method()
+
+
+def get_querysets(backend, user=None, model=None):
+    """
+    Return the querysets of bookmarks saved by *user* and/or of *model*
+    instances, one for each table (and database) storing them.
+
+    Pending operations of buffered backends are flushed first.
+    """
+    flush(backend)
+    lookups = {}
+    if user is not None:
+        lookups['user'] = user
+    if model is not None:
+        lookups['content_type'] = utils.get_content_type_for_model(model)
+        bookmark_models = [backend.get_model_for(model)]
+    else:
+        bookmark_models = backend.get_models()
+    if user is None and getattr(backend, 'shards', None):
+        databases = backend.shards
+    else:
+        databases = [backend.db_for_read(user)]
+    querysets = []
+    for using in databases:
+        for bookmark_model in bookmark_models:
+            querysets.append(bookmark_model.objects.db_manager(using).filter(
+                **lookups))
+            if backend._uses_archive(bookmark_model):
+                manager = backend.get_archive_model().objects
+                querysets.append(manager.db_manager(using).filter(**lookups))
+    return querysets
+
+
+def iter_chunks(queryset, chunk_size=None):
+    """
+    Yield lists of at most *chunk_size* bookmarks from *queryset*, with
+    content objects, using keyset pagination on the primary key.
+    """
+    chunk_size = chunk_size or settings.EXPORT_CHUNK_SIZE
+    queryset = queryset.order_by('pk').with_contents()
+    chunk = list(queryset[:chunk_size])
+    while chunk:
+        yield chunk
+        chunk = list(queryset.filter(pk__gt=chunk[-1].pk)[:chunk_size])
+
+
+def iter_bookmarks(backend, user=None, model=None, chunk_size=None):
+    """
+    Yield the bookmarks saved by *user* and/or of *model* instances
+    (all the bookmarks if both are None).
+
+    Backends not storing bookmarks using Django models are
+    consulted using their *filter* method.
+    """
+    if not hasattr(backend, 'get_models'):
+        lookups = {}
+        if user is not None:
+            lookups['user'] = user
+        if model is not None:
+            lookups['model'] = model
+        for bookmark in backend.filter(**lookups):
+            yield bookmark
+        return
+    for queryset in get_querysets(backend, user=user, model=model):
+        for chunk in iter_chunks(queryset, chunk_size):
+            for bookmark in chunk:
+                yield bookmark
+
+
+def get_row(bookmark):
+    """
+    Return an ordered dict representing *bookmark*.
+    """
+    # bookmarks stored by MongoDB only have the content type id
+    content_type = getattr(bookmark, 'content_type', None) or (
+        ContentType.objects.get_for_id(bookmark.content_type_id))
+    content_object = bookmark.content_object
+    return collections.OrderedDict([
+        ('user', bookmark.user_id),
+        ('model', '%s.%s' % (content_type.app_label, content_type.model)),
+        ('object_id', bookmark.object_id),
+        ('key', bookmark.key),
+        ('created_at', bookmark.created_at.isoformat()),
+        ('object', u'' if content_object is None else
+            six.text_type(content_object)),
+    ])
+
+
+class _Echo(object):
+    # file-like object returning written values instead of storing them
+    def write(self, value):
+        return value
+
+
+def _encode(value):
+    # the csv module of Python 2 does not support unicode
+    if six.PY2 and isinstance(value, six.text_type):
+        return value.encode('utf-8')
+    return value
+
+
+def to_csv(rows):
+    """
+    Yield the lines of the CSV file containing *rows*, with header.
+    """
+    writer = csv.writer(_Echo())
+    yield writer.writerow(FIELDS)
+    for row in rows:
+        yield writer.writerow([_encode(i) for i in row.values()])
+
+
+def to_jsonl(rows):
+    """
+    Yield the lines of the JSON Lines file containing *rows*.
+    """
+    for row in rows:
+        yield json.dumps(row) + '\n'
+
+
+FORMATS = {
+    'csv': to_csv,
+    'jsonl': to_jsonl,
+}
+
+
+def export(backend, user=None, model=None, format='csv', chunk_size=None):
+    """
+    Yield the lines of the export of bookmarks saved by *user* and/or
+    of *model* instances, using *format* (*'csv'* or *'jsonl'*).
+    """
+    try:
+        writer = FORMATS[format]
+    except KeyError:
+        raise ValueError('Invalid export format: %s.' % format)
+    rows = (get_row(i) for i in iter_bookmarks(backend, user=user,
+        model=model, chunk_size=chunk_size))
+    return writer(rows)
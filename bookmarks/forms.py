@@ -1,5 +1,8 @@
 from django.apps import apps
 from django import forms
+from django.utils import six
+
+from bookmarks import instrumentation
 
 
 class BookmarkForm(forms.Form):
@@ -49,6 +52,7 @@ class BookmarkForm(forms.Form):
         self.request = request
         self.backend = backend
         self._instance = None
+        self._bookmark_exists = None
 
     def clean(self):
         """
@@ -65,14 +69,29 @@ class BookmarkForm(forms.Form):
             model = apps.get_model(*model_name.split('.'))
             if model is None:
                 raise forms.ValidationError(u'Invalid model.')
-            # getting instance
-            try:
-                self._instance = model.objects.get(pk=object_id)
-            except model.DoesNotExist:
-                raise forms.ValidationError(u'Invalid instance.')
+            # getting instance, unless already given
+            if not self._is_primed(model, object_id):
+                try:
+                    self._instance = model.objects.get(pk=object_id)
+                except model.DoesNotExist:
+                    raise forms.ValidationError(u'Invalid instance.')
         # call the parent
         return super(BookmarkForm, self).clean()
 
+    def _is_primed(self, model, object_id):
+        return (isinstance(self._instance, model) and
+            six.text_type(self._instance.pk) == object_id)
+
+    def prime(self, instance, exists=None):
+        """
+        Set the bookmarked *instance* and, if not None, whether the bookmark
+        exists, so that they are not retreived again during validation
+        (see *bookmarks.deferred*).
+        """
+        self._instance = instance
+        if exists is not None:
+            self._bookmark_exists = exists
+
     def instance(self):
         """
         Return the bookmarked instance or None if the form is not valid.
@@ -83,8 +102,15 @@ class BookmarkForm(forms.Form):
             return self._instance
 
     def _exists(self):
-        key = self.cleaned_data['key']
-        return self.backend.exists(self.request.user, self._instance, key)
+        # the result is cached: the existence of the bookmark is usually
+        # checked several times while processing the same request
+        instrumentation.record_cache('form.exists',
+            self._bookmark_exists is not None)
+        if self._bookmark_exists is None:
+            key = self.cleaned_data['key']
+            self._bookmark_exists = self.backend.exists(self.request.user,
+                self._instance, key)
+        return self._bookmark_exists
 
     def bookmark_exists(self):
         """
@@ -106,5 +132,8 @@ class BookmarkForm(forms.Form):
         You must call this method only after form validation.
         """
         key = self.cleaned_data['key']
-        method = self.backend.remove if self._exists() else self.backend.add
-        return method(self.request.user, self._instance, key)
+        exists = self._exists()
+        method = self.backend.remove if exists else self.backend.add
+        bookmark = method(self.request.user, self._instance, key)
+        self._bookmark_exists = not exists
+        return bookmark
@@ -2,10 +2,12 @@ try:
     import json
 except ImportError:
     from django.utils import simplejson as json
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ImproperlyConfigured
 from django.db.models.base import ModelBase
 from django.db.models.signals import pre_delete
 
-from bookmarks import settings, backends, forms, exceptions, signals
+from bookmarks import settings, backends, forms, exceptions, signals, models
 
 
 class Handler(object):
@@ -50,6 +52,18 @@ class Handler(object):
         form class that will be used to handle bookmark's adding and removing
         (default: *bookmarks.forms.BookmarkForm*)
 
+    .. py:attribute:: db_cascade
+
+        set to True if bookmarks of deleted objects are removed by database
+        triggers (see *bookmarks.triggers*): the *pre_delete* receiver is
+        not connected (default: *False*)
+
+    .. py:attribute:: storage
+
+        *'dedicated'* to store bookmarks in the model created by
+        *bookmarks.models.create_dedicated_model*, *'shared'* to use the
+        generic bookmarks table (default: *'shared'*)
+
     For situations where the built-in options listed above are not sufficient,
     subclasses of *Handler* can also override the methods which
     actually perform the bookmarking process, and apply any logic they desire.
@@ -63,6 +77,8 @@ class Handler(object):
     can_remove_bookmarks = settings.CAN_REMOVE_BOOKMARKS
 
     form_class = forms.BookmarkForm
+    db_cascade = settings.DB_CASCADE
+    storage = 'shared'
     failure_message = u'Invalid data in bookmark form.'
 
     def __init__(self, model, backend):
@@ -287,6 +303,22 @@ class Registry(object):
         """
         pre_delete.connect(handler.remove_all_for, sender=model)
 
+    def _set_dedicated_model(self, model):
+        """
+        Make the backend store bookmarks for *model* in its dedicated
+        bookmark model. No *pre_delete* receiver is needed, since
+        dedicated bookmarks are deleted in cascade.
+        """
+        bookmark_model = models.get_dedicated_model(model)
+        if bookmark_model is None:
+            raise ImproperlyConfigured('No dedicated bookmark model found '
+                'for %s: use bookmarks.models.create_dedicated_model.' %
+                model.__name__)
+        if not hasattr(self.backend, 'set_dedicated_model'):
+            raise ImproperlyConfigured('Dedicated bookmark models are not '
+                'supported by the current backend.')
+        self.backend.set_dedicated_model(model, bookmark_model)
+
     def _get_handler_instance(self, model, handler_class, options):
         """
         Return an handler instance for the given *model*.
@@ -316,6 +348,12 @@ class Registry(object):
             library.register(Article, Handler,
                 can_remove_bookmarks=False, form_class=MyForm)
 
+        Bookmarks of models registered with *storage='dedicated'* are
+        stored in their own table (see
+        *bookmarks.models.create_dedicated_model*), e.g.::
+
+            library.register(Article, storage='dedicated')
+
         Raise *AlreadyHandled* if any of the models are already registered.
         """
         if handler_class is None:
@@ -328,8 +366,11 @@ class Registry(object):
                     "The model '%s' is already being handled" %
                     model._meta.module_name)
             handler = self._get_handler_instance(model, handler_class, kwargs)
+            if handler.storage == 'dedicated':
+                self._set_dedicated_model(model)
+            elif not handler.db_cascade:
+                self._connect_model_signals(model, handler)
             self._registry[model] = handler
-            self._connect_model_signals(model, handler)
 
     def unregister(self, model_or_iterable):
         """
@@ -345,7 +386,17 @@ class Registry(object):
                 raise exceptions.NotHandled(
                     "The model '%s' is not currently being handled" %
                     model._meta.module_name)
-            del self._registry[model]
+            handler = self._registry.pop(model)
+            if handler.storage == 'dedicated':
+                self.backend.set_dedicated_model(model, None)
+            else:
+                pre_delete.disconnect(handler.remove_all_for, sender=model)
+
+    def get_registered_models(self):
+        """
+        Return a list of all the models registered for bookmarks.
+        """
+        return list(self._registry)
 
     def get_handler(self, model_or_instance):
         """
@@ -379,7 +430,14 @@ class Registry(object):
         """
         Apply any necessary post-save steps to new bookmarks.
         """
-        model = bookmark.content_type.model_class()
+        # removed bookmarks are fetched without their content type: use
+        # the content types cache to avoid another query
+        content_type_id = getattr(bookmark, 'content_type_id', None)
+        if content_type_id is None:
+            content_type = bookmark.content_type
+        else:
+            content_type = ContentType.objects.get_for_id(content_type_id)
+        model = content_type.model_class()
         if model in self._registry:
             return self._registry[model].post_save(request, bookmark, created)
 
@@ -0,0 +1,248 @@
+"""
+Bulk import of bookmarks from CSV or JSON Lines.
+
+The input has the format produced by *bookmarks.export*: each row
+contains the user id, the bookmarked model (as *app_label.model*), the
+object id, the key and, optionally, the creation date (ISO 8601), e.g.::
+
+    user,model,object_id,key,created_at
+    1,blog.article,42,main,2014-03-01T10:00:00+00:00
+
+Naive dates are considered UTC when time zone support is enabled, while
+aware dates are converted to the current time zone when it is disabled.
+
+Rows are read as a stream and processed in chunks: for each chunk
+models are resolved once, users and bookmarked objects are validated
+using one query for each content type, and bookmarks are added using
+the *bulk_add* method of the backend, skipping the existing ones, e.g.::
+
+    from bookmarks import importer
+    from bookmarks.handlers import library
+
+    with open('bookmarks.csv') as f:
+        result = importer.import_bookmarks(library.backend,
+            importer.read_csv(f))
+    print(result.added, result.duplicates, result.rejected)
+"""
+import csv
+import json
+
+from django.apps import apps
+from django.conf import settings as django_settings
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.utils import six, timezone
+from django.utils.dateparse import parse_datetime
+
+from bookmarks import settings, handlers
+
+KEY_MAX_LENGTH = 16
+
+# maximum number of primary keys in a single lookup
+# (SQLite limits the number of query parameters)
+LOOKUP_BATCH_SIZE = 500
+
+
+def _get_existing_pks(manager, pks):
+    pks = list(pks)
+    existing = set()
+    for i in range(0, len(pks), LOOKUP_BATCH_SIZE):
+        existing.update(manager.filter(
+            pk__in=pks[i:i + LOOKUP_BATCH_SIZE]).values_list('pk', flat=True))
+    return existing
+
+
+def read_csv(lines):
+    """
+    Yield the rows, as dicts, of the CSV file given as an iterable
+    of *lines*. The first line must contain the field names.
+    """
+    for row in csv.DictReader(lines):
+        if six.PY2:
+            row = dict((k, v.decode('utf-8') if v else v)
+                for k, v in row.items())
+        yield row
+
+
+def read_jsonl(lines):
+    """
+    Yield the rows, as dicts, of the JSON Lines file given as an iterable
+    of *lines*.
+    """
+    for line in lines:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+READERS = {
+    'csv': read_csv,
+    'jsonl': read_jsonl,
+}
+
+
+class ImportResult(object):
+    """
+    Counters of an import.
+
+    .. py:attribute:: processed
+
+        the number of processed rows
+
+    .. py:attribute:: added
+
+        the number of added bookmarks
+
+    .. py:attribute:: duplicates
+
+        the number of valid rows skipped because the bookmark exists
+
+    .. py:attribute:: rejected
+
+        the number of invalid rows
+    """
+    def __init__(self):
+        self.processed = self.added = self.duplicates = self.rejected = 0
+
+
+class Importer(object):
+    """
+    Import bookmarks using *backend*, processing rows in chunks of
+    *chunk_size* rows (default:
+    *settings.GENERIC_BOOKMARKS_IMPORT_CHUNK_SIZE*).
+
+    If given, *progress* is called with the *ImportResult* after each chunk,
+    and *reject* is called with the row number (starting from 1), the row
+    and the reason for each invalid row.
+    """
+    def __init__(self, backend, chunk_size=None, progress=None, reject=None):
+        self.backend = backend
+        self.chunk_size = chunk_size or settings.IMPORT_CHUNK_SIZE
+        self.progress = progress
+        self.reject = reject
+        self.result = ImportResult()
+        # model labels are resolved once
+        self._models = {}
+
+    def _reject(self, number, row, reason):
+        self.result.rejected += 1
+        if self.reject is not None:
+            self.reject(number, row, reason)
+
+    def get_model(self, label):
+        """
+        Return the model given its *label*, or None if the label
+        is not valid.
+        """
+        if label not in self._models:
+            try:
+                model = apps.get_model(*label.split('.'))
+            except (LookupError, TypeError, ValueError):
+                model = None
+            self._models[label] = model
+        return self._models[label]
+
+    def parse(self, row):
+        """
+        Return a tuple *(user_id, model, object_id, key, created_at)*
+        for *row*. Raise *ValueError* if the row is not valid.
+        """
+        try:
+            user_id = int(row['user'])
+            label, object_id, key = row['model'], row['object_id'], row['key']
+        except (KeyError, TypeError, ValueError):
+            raise ValueError('Invalid row.')
+        model = self.get_model(label)
+        if model is None:
+            raise ValueError('Invalid model.')
+        handler = handlers.library.get_handler(model)
+        if handler is None:
+            raise ValueError('Model not registered.')
+        try:
+            object_id = model._meta.pk.to_python(object_id)
+        except ValidationError:
+            raise ValueError('Invalid object id.')
+        if not key or len(key) > KEY_MAX_LENGTH:
+            raise ValueError('Invalid key.')
+        # there is no request: the instance is not retreived
+        if not handler.allow_key(None, model(pk=object_id), key):
+            raise ValueError('Key not allowed.')
+        created_at = row.get('created_at') or None
+        if created_at is not None:
+            try:
+                created_at = parse_datetime(created_at)
+            except ValueError:
+                created_at = None
+            if created_at is None:
+                raise ValueError('Invalid creation date.')
+            if django_settings.USE_TZ:
+                if timezone.is_naive(created_at):
+                    created_at = timezone.make_aware(created_at, timezone.utc)
+            elif timezone.is_aware(created_at):
+                # without time zone support dates are stored in local time
+                created_at = timezone.make_naive(created_at)
+        return user_id, model, object_id, key, created_at
+
+    def validate(self, bookmarks):
+        """
+        Return the subset of *bookmarks*, a list of *(number, row,
+        bookmark)* tuples, whose users and objects exist, rejecting
+        the others.
+        """
+        users = _get_existing_pks(User.objects, set(
+            i[2][0] for i in bookmarks))
+        object_ids = {}
+        for number, row, bookmark in bookmarks:
+            object_ids.setdefault(bookmark[1], set()).add(bookmark[2])
+        objects = {}
+        for model, ids in object_ids.items():
+            objects[model] = _get_existing_pks(model._default_manager, ids)
+        valid = []
+        for number, row, bookmark in bookmarks:
+            if bookmark[0] not in users:
+                self._reject(number, row, 'Invalid user.')
+            elif bookmark[2] not in objects[bookmark[1]]:
+                self._reject(number, row, 'Invalid object.')
+            else:
+                valid.append(bookmark)
+        return valid
+
+    def process(self, chunk):
+        """
+        Import a *chunk*, a list of *(number, row)* tuples.
+        """
+        bookmarks = []
+        for number, row in chunk:
+            try:
+                bookmarks.append((number, row, self.parse(row)))
+            except ValueError as err:
+                self._reject(number, row, str(err))
+        valid = self.validate(bookmarks) if bookmarks else []
+        added = self.backend.bulk_add(valid) if valid else 0
+        self.result.processed += len(chunk)
+        self.result.added += added
+        self.result.duplicates += len(valid) - added
+        if self.progress is not None:
+            self.progress(self.result)
+
+    def run(self, rows):
+        """
+        Import all the *rows* and return the *ImportResult*.
+        """
+        chunk = []
+        for number, row in enumerate(rows, 1):
+            chunk.append((number, row))
+            if len(chunk) >= self.chunk_size:
+                self.process(chunk)
+                chunk = []
+        if chunk:
+            self.process(chunk)
+        return self.result
+
+
+def import_bookmarks(backend, rows, **kwargs):
+    """
+    Import *rows* using *backend* and return the *ImportResult*.
+    The *kwargs* are passed to *Importer*.
+    """
+    return Importer(backend, **kwargs).run(rows)
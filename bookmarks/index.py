@@ -0,0 +1,296 @@
+"""
+In-memory indexes of the bookmarks saved by each user.
+
+Pages of users with many bookmarks check the same bookmarks several times
+(e.g. a *bookmark_form* for each object in a list, in several lists). If
+*settings.GENERIC_BOOKMARKS_INDEX['ENABLED']* is True, the backend is
+wrapped by *IndexedBackend*: the first check loads all the bookmarks of
+the user with one *values_list* query for each bookmarks table, and
+stores them in a *BookmarkIndex*, where the content type and object id of
+each bookmark are packed in a 64 bits integer, kept in a sorted
+*array('Q')* for each key (8 bytes for each bookmark). Then *exists*,
+*exists_many* and negative *get* calls are answered using binary searches.
+
+If *SCOPE* is 'request', indexes are stored in a thread local and dropped
+by *bookmarks.index.IndexMiddleware* at the end of each request; if
+*SCOPE* is 'process', they are shared by the threads of the process. In
+both cases at most *MAX_USERS* indexes are kept, for at most *TIMEOUT*
+seconds: bookmarks added or removed using the backend are reflected in the
+index of the current scope, changes made by other processes (or, in the
+'request' scope, other threads) are seen when the index expires.
+
+Only bookmarks of objects with integer primary keys are indexed, other
+lookups are delegated to the backend.
+"""
+import bisect
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+from django.utils import six
+
+from bookmarks import settings, exceptions, models, utils, keys, export
+from bookmarks import summaries
+from bookmarks import instrumentation
+
+try:
+    from bookmarks.aio import AsyncBackendMixin
+except SyntaxError:
+    # the asynchronous API requires Python >= 3.5
+    AsyncBackendMixin = object
+
+# codes combine the content type id and the object id
+OBJECT_ID_BITS = 32
+
+_local = threading.local()
+_process_indexes = OrderedDict()
+_lock = threading.Lock()
+
+
+def encode(content_type_id, object_id):
+    """
+    Return the code of the given object, or None if it cannot be indexed.
+    """
+    if not isinstance(object_id, six.integer_types) or not (
+            0 <= object_id < 1 << OBJECT_ID_BITS):
+        return None
+    return (content_type_id << OBJECT_ID_BITS) | object_id
+
+
+def _get_user_id(user):
+    return getattr(user, 'pk', user)
+
+
+class BookmarkIndex(object):
+    """
+    The bookmarks of a user, as a sorted *array('Q')* of codes
+    (see *encode*) for each key.
+    """
+    def __init__(self, codes=None):
+        self.codes = codes or {}
+        self.created_at = time.time()
+
+    @classmethod
+    def build(cls, user, backend):
+        """
+        Return the index of the bookmarks saved by *user*, built using
+        *backend*. Buffered operations are flushed first.
+        """
+        codes = {}
+        if not hasattr(backend, 'get_models'):
+            # backends not storing bookmarks using Django models
+            export.flush(backend)
+            for bookmark in backend.filter(user=user):
+                item = encode(summaries._get_content_type_id(bookmark),
+                    bookmark.object_id)
+                if item is not None:
+                    codes.setdefault(bookmark.key, []).append(item)
+            return cls(dict((key, array('Q', sorted(items)))
+                for key, items in codes.items()))
+        # querysets are retreived after flushing the backend
+        for queryset in export.get_querysets(backend, user=user):
+            bookmark_model = queryset.model
+            if bookmark_model is models.StringBookmark:
+                continue
+            if issubclass(bookmark_model, models.DedicatedBookmark):
+                content_type_id = utils.get_content_type_for_model(
+                    bookmark_model._meta.get_field('content_object').rel.to).pk
+                rows = ((code, content_type_id, object_id)
+                    for code, object_id in queryset.values_list(
+                        'key', 'content_object_id').iterator())
+            else:
+                rows = queryset.values_list('key', 'content_type_id',
+                    'object_id').iterator()
+            for code, content_type_id, object_id in rows:
+                item = encode(content_type_id, object_id)
+                if item is not None:
+                    codes.setdefault(keys.get_name(code), []).append(item)
+        return cls(dict((key, array('Q', sorted(items)))
+            for key, items in codes.items()))
+
+    def __len__(self):
+        return sum(len(i) for i in self.codes.values())
+
+    @property
+    def nbytes(self):
+        """
+        The memory used by the codes.
+        """
+        return sum(i.itemsize * len(i) for i in self.codes.values())
+
+    def is_expired(self):
+        return time.time() - self.created_at > settings.INDEX['TIMEOUT']
+
+    def contains(self, key, item):
+        codes = self.codes.get(key)
+        if not codes:
+            return False
+        i = bisect.bisect_left(codes, item)
+        return i < len(codes) and codes[i] == item
+
+    def add(self, key, item):
+        codes = self.codes.setdefault(key, array('Q'))
+        if not self.contains(key, item):
+            codes.insert(bisect.bisect_left(codes, item), item)
+
+    def remove(self, key, item):
+        if self.contains(key, item):
+            codes = self.codes[key]
+            del codes[bisect.bisect_left(codes, item)]
+
+
+def _get_indexes():
+    if settings.INDEX['SCOPE'] == 'process':
+        return _process_indexes
+    indexes = getattr(_local, 'indexes', None)
+    if indexes is None:
+        indexes = _local.indexes = OrderedDict()
+    return indexes
+
+
+def get_index(user, backend):
+    """
+    Return the index of *user* in the current scope, building it
+    if missing or expired.
+    """
+    user_id = _get_user_id(user)
+    indexes = _get_indexes()
+    with _lock:
+        index = indexes.pop(user_id, None)
+        if index is not None and not index.is_expired():
+            # most recently used last
+            indexes[user_id] = index
+    hit = index is not None and not index.is_expired()
+    instrumentation.record_cache('index', hit)
+    if hit:
+        return index
+    index = BookmarkIndex.build(user_id, backend)
+    if instrumentation.is_enabled():
+        instrumentation.emit('index.build', bookmarks=len(index),
+            bytes=index.nbytes)
+    with _lock:
+        indexes[user_id] = index
+        while len(indexes) > settings.INDEX['MAX_USERS']:
+            indexes.popitem(last=False)
+    return index
+
+
+def get_memory_usage():
+    """
+    Return a tuple *(users, bookmarks, bytes)* describing the indexes
+    of the current scope.
+    """
+    indexes = list(_get_indexes().values())
+    return (len(indexes), sum(len(i) for i in indexes),
+        sum(i.nbytes for i in indexes))
+
+
+def clear(users=None):
+    """
+    Drop the indexes of *users* (all the indexes if None) from
+    the current scope.
+    """
+    indexes = _get_indexes()
+    with _lock:
+        if users is None:
+            indexes.clear()
+        else:
+            for user in users:
+                indexes.pop(_get_user_id(user), None)
+
+
+def _get_item(instance):
+    content_type_id = utils.get_content_type_for_model(type(instance)).pk
+    return encode(content_type_id, instance.pk)
+
+
+class IndexMiddleware(object):
+    """
+    Drop the indexes of the 'request' scope at the end of each request:
+    add *'bookmarks.index.IndexMiddleware'* to *MIDDLEWARE_CLASSES*.
+    """
+    def process_request(self, request):
+        _local.indexes = None
+
+    def process_response(self, request, response):
+        _local.indexes = None
+        return response
+
+
+class IndexedBackend(AsyncBackendMixin):
+    """
+    Wrap a bookmarks *backend*, answering existence checks using the
+    in-memory indexes of users. Other attributes are delegated to the
+    backend.
+
+    Coroutine methods run the wrapped synchronous methods in the bookmarks
+    thread pool (see *bookmarks.aio*).
+    """
+    def __init__(self, backend):
+        self.backend = backend
+
+    def _lookup(self, user, instance, key):
+        # return None if the bookmark is not indexable
+        if user is None or _get_user_id(user) is None:
+            return None
+        item = _get_item(instance)
+        if item is None:
+            return None
+        return get_index(user, self.backend).contains(key, item)
+
+    def _update(self, user, instance, key, method):
+        item = _get_item(instance)
+        index = _get_indexes().get(_get_user_id(user))
+        if item is not None and index is not None:
+            with _lock:
+                getattr(index, method)(key, item)
+
+    def add(self, user, instance, key):
+        bookmark = self.backend.add(user, instance, key)
+        self._update(user, instance, key, 'add')
+        return bookmark
+
+    def remove(self, user, instance, key):
+        bookmark = self.backend.remove(user, instance, key)
+        self._update(user, instance, key, 'remove')
+        return bookmark
+
+    def remove_all_for(self, instance):
+        self.backend.remove_all_for(instance)
+        clear()
+
+    def bulk_add(self, bookmarks):
+        bookmarks = list(bookmarks)
+        added = self.backend.bulk_add(bookmarks)
+        if added:
+            clear(set(i[0] for i in bookmarks))
+        return added
+
+    def get(self, user, instance, key):
+        if self._lookup(user, instance, key) is False:
+            raise exceptions.DoesNotExist
+        return self.backend.get(user, instance, key)
+
+    def exists(self, user, instance, key):
+        exists = self._lookup(user, instance, key)
+        if exists is None:
+            return self.backend.exists(user, instance, key)
+        return exists
+
+    def exists_many(self, user, instances, key):
+        """
+        Instances that cannot be indexed are looked up using the backend.
+        """
+        instances = list(instances)
+        results = [self._lookup(user, i, key) for i in instances]
+        missing = [i for i, exists in enumerate(results) if exists is None]
+        if missing:
+            found = self.backend.exists_many(user,
+                [instances[i] for i in missing], key)
+            for i, exists in zip(missing, found):
+                results[i] = exists
+        return results
+
+    def __getattr__(self, attr):
+        return getattr(self.backend, attr)
@@ -0,0 +1,307 @@
+"""
+Timing, query counts and cache statistics of bookmark operations.
+
+If *settings.GENERIC_BOOKMARKS_INSTRUMENTATION['ENABLED']* is True:
+
+    - the backend operations (*add*, *remove*, *remove_all_for*, *filter*,
+      *get*, *exists* and *exists_many*) are measured, e.g. as
+      *'backend.add'*;
+    - the *bookmark* and *ajax_form* views and the templatetags are
+      measured, e.g. as *'view.bookmark'* or *'tag.bookmark_form'*;
+    - hits and misses of the key codes cache (*'keys'*) and of the form
+      existence memo (*'form.exists'*) are recorded.
+
+Measurements are sent to the configured sinks. A sink is a callable
+receiving the name of the operation and the measured values as kwargs:
+*seconds* and *queries* for operations, *hit* for cache lookups.
+Sinks can be given as callables or dotted paths, e.g.::
+
+    from bookmarks.instrumentation import StatsdSink
+
+    GENERIC_BOOKMARKS_INSTRUMENTATION = {
+        'ENABLED': True,
+        'SINKS': [
+            'bookmarks.instrumentation.log_sink',
+            StatsdSink(statsd.StatsClient('localhost', 8125)),
+        ],
+    }
+
+Note that *filter* returns lazy results: the queries retreiving
+bookmarks are counted where results are evaluated. Streaming responses,
+e.g. of the *export* view, are measured while their content is consumed
+(see *measure_iteration*).
+
+When instrumentation is disabled, the backend is not wrapped and the
+other measured functions only check the setting.
+"""
+import functools
+import logging
+import threading
+import timeit
+
+from django.db import connections
+from django.utils import six
+from django.utils.module_loading import import_string
+
+from bookmarks import settings, signals
+
+logger = logging.getLogger('bookmarks')
+
+BACKEND_OPERATIONS = ('add', 'remove', 'remove_all_for', 'filter', 'get',
+    'exists', 'exists_many')
+
+SUMMARY_HEADER = 'X-Bookmarks-Summary'
+
+_sinks = None
+_local = threading.local()
+
+
+def log_sink(name, **values):
+    """
+    Log measurements using the *bookmarks* logger, with DEBUG level.
+    """
+    logger.debug('%s %s', name, ' '.join('%s=%s' % i
+        for i in sorted(values.items())))
+
+
+def signal_sink(name, **values):
+    """
+    Send measurements using the *bookmark_measured* signal.
+    """
+    signals.bookmark_measured.send(sender=None, name=name, **values)
+
+
+class StatsdSink(object):
+    """
+    Send measurements to a statsd-style *client* providing
+    *timing(name, milliseconds)* and *incr(name, count)* methods.
+    """
+    def __init__(self, client, prefix='bookmarks'):
+        self.client = client
+        self.prefix = prefix
+
+    def __call__(self, name, seconds=None, queries=None, hit=None):
+        name = '%s.%s' % (self.prefix, name)
+        if seconds is not None:
+            self.client.timing(name, seconds * 1000)
+        if queries:
+            self.client.incr('%s.queries' % name, queries)
+        if hit is not None:
+            self.client.incr('%s.%s' % (name, 'hit' if hit else 'miss'), 1)
+
+
+def is_enabled():
+    return settings.INSTRUMENTATION['ENABLED']
+
+
+def get_sinks():
+    """
+    Return the list of sinks, loading the configured ones on first use.
+    """
+    global _sinks
+    if _sinks is None:
+        _sinks = [import_string(i) if isinstance(i, six.string_types) else i
+            for i in settings.INSTRUMENTATION.get('SINKS', [])]
+    return _sinks
+
+
+def register_sink(sink):
+    get_sinks().append(sink)
+
+
+def unregister_sink(sink):
+    get_sinks().remove(sink)
+
+
+def emit(name, **values):
+    """
+    Send a measurement to the sinks and to the summary of the current
+    request, if collected.
+    """
+    summary = getattr(_local, 'summary', None)
+    if summary is not None:
+        totals = summary.setdefault(name, {})
+        totals['calls'] = totals.get('calls', 0) + 1
+        for k, v in values.items():
+            totals[k] = totals.get(k, 0) + v
+    for sink in get_sinks():
+        try:
+            sink(name, **values)
+        except Exception:
+            logger.exception('Error in bookmarks instrumentation sink.')
+
+
+def record_cache(name, hit):
+    """
+    Record a hit or a miss of the cache *name*.
+    """
+    if settings.INSTRUMENTATION['ENABLED']:
+        emit(name, hit=int(hit))
+
+
+class _CountingCursor(object):
+    """
+    Cursor wrapper counting the executed queries in *counter*,
+    a one item list.
+    """
+    def __init__(self, cursor, counter):
+        self.cursor = cursor
+        self.counter = counter
+
+    def execute(self, *args, **kwargs):
+        self.counter[0] += 1
+        return self.cursor.execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        self.counter[0] += 1
+        return self.cursor.executemany(*args, **kwargs)
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class measure(object):
+    """
+    Context manager measuring the time and the queries
+    (on all the databases) of the wrapped code.
+
+    Queries are counted wrapping the cursors created by the connections
+    of the current thread, without enabling the debug cursor (i.e.
+    queries are not logged).
+    """
+    # connection methods returning cursors
+    cursor_methods = ('cursor', 'chunked_cursor')
+
+    def __init__(self, name):
+        self.name = name
+
+    def _wrap(self, method):
+        counter = self.counter
+
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            return _CountingCursor(method(*args, **kwargs), counter)
+        return wrapper
+
+    def __enter__(self):
+        self.counter = [0]
+        self.patched = []
+        for connection in connections.all():
+            for attr in self.cursor_methods:
+                method = getattr(connection, attr, None)
+                if method is not None:
+                    # the previous instance attribute, e.g. when nested
+                    self.patched.append((connection, attr,
+                        connection.__dict__.get(attr)))
+                    setattr(connection, attr, self._wrap(method))
+        self.start = timeit.default_timer()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        seconds = timeit.default_timer() - self.start
+        for connection, attr, previous in reversed(self.patched):
+            if previous is None:
+                delattr(connection, attr)
+            else:
+                setattr(connection, attr, previous)
+        emit(self.name, seconds=seconds, queries=self.counter[0])
+
+
+def instrumented(name):
+    """
+    Decorator measuring the decorated function as *name*.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not settings.INSTRUMENTATION['ENABLED']:
+                return func(*args, **kwargs)
+            with measure(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def measure_iteration(name, iterable):
+    """
+    Return an iterator over *iterable* measuring the whole iteration as
+    *name*, e.g. the content of a streaming response. The measured time
+    includes the time spent by the consumer between items.
+    """
+    if not settings.INSTRUMENTATION['ENABLED']:
+        return iterable
+    return _measure_iteration(name, iterable)
+
+
+def _measure_iteration(name, iterable):
+    with measure(name):
+        for item in iterable:
+            yield item
+
+
+class InstrumentedBackend(object):
+    """
+    Wrap a bookmarks *backend*, measuring its operations.
+    Other attributes are delegated to the backend.
+    """
+    def __init__(self, backend):
+        self.backend = backend
+        for operation in BACKEND_OPERATIONS:
+            method = getattr(backend, operation, None)
+            if method is not None:
+                setattr(self, operation, self._wrap(operation, method))
+
+    def _wrap(self, operation, method):
+        name = 'backend.%s' % operation
+
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            with measure(name):
+                return method(*args, **kwargs)
+        return wrapper
+
+    def __getattr__(self, attr):
+        return getattr(self.backend, attr)
+
+
+class SummaryMiddleware(object):
+    """
+    Debug middleware adding to each response a header (*X-Bookmarks-Summary*)
+    summarizing the bookmark operations performed by the request, e.g.::
+
+        X-Bookmarks-Summary: backend.exists calls=2 ms=1.2 queries=2
+
+    Intended for development: add
+    *'bookmarks.instrumentation.SummaryMiddleware'* to *MIDDLEWARE_CLASSES*
+    and enable instrumentation.
+    """
+    def process_request(self, request):
+        _local.summary = {} if is_enabled() else None
+
+    def process_response(self, request, response):
+        summary = getattr(_local, 'summary', None)
+        _local.summary = None
+        if summary:
+            response[SUMMARY_HEADER] = '; '.join(
+                _format(name, summary[name]) for name in sorted(summary))
+        return response
+
+
+def _format(name, totals):
+    parts = [name, 'calls=%d' % totals['calls']]
+    if 'seconds' in totals:
+        parts.append('ms=%.1f' % (totals['seconds'] * 1000))
+    if 'queries' in totals:
+        parts.append('queries=%d' % totals['queries'])
+    if 'hit' in totals:
+        parts.append('hits=%d' % totals['hit'])
+    return ' '.join(parts)
@@ -0,0 +1,182 @@
+"""
+Registry mapping bookmark keys to small integers.
+
+Bookmark models store the key as a small integer code, while the
+application API (handlers, backends, forms and templatetags) keeps using
+key names. Codes are stored in the *BookmarkKey* table: a code is
+created the first time a bookmark with that key is saved (lookups never
+register keys), and both directions of the mapping are cached in the
+current process, e.g.::
+
+    >>> from bookmarks import keys
+    >>> keys.get_code('main')
+    1
+    >>> keys.get_name(1)
+    'main'
+
+Since a code is never changed or deleted, the cache never needs
+to be invalidated. Lookups of keys that are not registered are cached
+for *MISS_TIMEOUT* seconds, since the key can be registered later by
+another process.
+
+The registry table is optional: if *settings.GENERIC_BOOKMARKS_KEY_CODES*
+is not empty, codes are taken from that mapping and the table is
+never queried.
+"""
+import threading
+import time
+
+from django import VERSION, forms
+from django.db import models
+from django.utils import six
+
+from bookmarks import settings, instrumentation
+
+# the code used in lookups for keys that are not registered:
+# generated codes start from 1, so it never matches a bookmark
+UNKNOWN = 0
+
+# seconds after which a key that is not registered is looked up again
+MISS_TIMEOUT = 60
+
+_codes = {}
+_names = {}
+_misses = {}
+_lock = threading.Lock()
+
+
+def _cache(name, code):
+    with _lock:
+        _codes[name] = code
+        _names[code] = name
+        _misses.pop(name, None)
+
+
+def _is_missing(name):
+    missed_at = _misses.get(name)
+    return missed_at is not None and time.time() - missed_at < MISS_TIMEOUT
+
+
+def _lookup_code(name, create):
+    static_codes = settings.KEY_CODES
+    if static_codes:
+        code = static_codes.get(name)
+        if code is None and create:
+            raise ValueError('Bookmark key %r is not defined in '
+                'GENERIC_BOOKMARKS_KEY_CODES.' % name)
+        return code
+    from bookmarks.models import BookmarkKey
+    if create:
+        return BookmarkKey.objects.get_or_create(name=name)[0].pk
+    codes = BookmarkKey.objects.filter(name=name).values_list(
+        'pk', flat=True)[:1]
+    return codes[0] if codes else None
+
+
+def _lookup_name(code):
+    static_codes = settings.KEY_CODES
+    if static_codes:
+        for name, static_code in static_codes.items():
+            if static_code == code:
+                return name
+        raise KeyError(code)
+    from bookmarks.models import BookmarkKey
+    return BookmarkKey.objects.get(pk=code).name
+
+
+def get_code(name, create=True):
+    """
+    Return the integer code of the key *name*. A key that is not
+    registered yet is registered if *create* is True, otherwise
+    *UNKNOWN* is returned. Integer codes are returned as they are.
+    """
+    if isinstance(name, six.integer_types):
+        return name
+    try:
+        code = _codes[name]
+    except KeyError:
+        if not create and _is_missing(name):
+            instrumentation.record_cache('keys', True)
+            return UNKNOWN
+        instrumentation.record_cache('keys', False)
+        code = _lookup_code(name, create)
+        if code is None:
+            with _lock:
+                _misses[name] = time.time()
+            return UNKNOWN
+        _cache(name, code)
+        return code
+    instrumentation.record_cache('keys', True)
+    return code
+
+
+def get_name(code):
+    """
+    Return the key name corresponding to the integer *code*. Key names
+    are returned as they are.
+    """
+    if not isinstance(code, six.integer_types):
+        return code
+    try:
+        name = _names[code]
+    except KeyError:
+        instrumentation.record_cache('keys', False)
+        name = _lookup_name(code)
+        _cache(name, code)
+        return name
+    instrumentation.record_cache('keys', True)
+    return name
+
+
+def clear_cache():
+    with _lock:
+        _codes.clear()
+        _names.clear()
+        _misses.clear()
+
+
+if VERSION < (1, 8):
+    _KeyFieldBase = six.with_metaclass(models.SubfieldBase,
+        models.PositiveSmallIntegerField)
+else:
+    # values are converted by from_db_value
+    _KeyFieldBase = models.PositiveSmallIntegerField
+
+
+class KeyField(_KeyFieldBase):
+    """
+    Model field storing a bookmark key as a small integer.
+
+    The field value is always the key name, and key names can be used
+    in lookups, e.g. *Bookmark.objects.filter(key='main')*. Keys are
+    registered when bookmarks are saved: looking up a key that is not
+    registered matches nothing.
+
+    Starting from Django 1.8, *values* and *values_list* return key names
+    too; on older versions they return codes (see *get_name*).
+    """
+    description = 'Bookmark key stored as a small integer'
+
+    def to_python(self, value):
+        if isinstance(value, six.integer_types):
+            return get_name(value)
+        return value
+
+    def from_db_value(self, value, expression, connection, context):
+        return self.to_python(value)
+
+    def get_prep_value(self, value):
+        # used by lookups: keys are never registered here
+        if value is None or isinstance(value, six.integer_types):
+            return value
+        return get_code(value, create=False)
+
+    def get_db_prep_save(self, value, connection):
+        if value is not None and not isinstance(value, six.integer_types):
+            value = get_code(value)
+        return super(KeyField, self).get_db_prep_save(value, connection)
+
+    def formfield(self, **kwargs):
+        defaults = {'form_class': forms.CharField, 'max_length': 16}
+        defaults.update(kwargs)
+        return models.Field.formfield(self, **defaults)
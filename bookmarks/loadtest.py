@@ -0,0 +1,329 @@
+"""
+Synthetic bookmark traffic, used by the *bookmarks_loadtest* command.
+
+A dataset of users and bookmarks is created in bulk (see
+*bookmarks.backends.BaseBackend.bulk_add*) for the instances
+of the given bookmarkable models. The popularity of instances follows
+a Zipf-like distribution: the *skew* exponent is 0 for uniform traffic,
+and greater values concentrate bookmarks on fewer instances.
+
+The traffic is then replayed using the Django test client, going through
+the real views, forms and handlers: a mix of toggles (POST requests to
+the *bookmark* view), existence checks (AJAX requests to the *ajax_form*
+view) and list queries (rendering the *bookmarks* templatetag).
+The client requires the session and authentication middlewares.
+
+Each thread uses its own database connection: use a file-based SQLite
+database, or run a single thread with in-memory databases.
+"""
+import bisect
+import cProfile
+import itertools
+import math
+import pstats
+import random
+import threading
+import timeit
+from importlib import import_module
+
+from django.conf import settings as django_settings
+from django.contrib.auth import login
+from django.contrib.auth.models import User
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.http import HttpRequest
+from django.template import Template, Context
+from django.test import Client
+
+from bookmarks import handlers, exceptions
+
+DEFAULT_MIX = {'toggle': 20, 'exists': 60, 'list': 20}
+
+LIST_TEMPLATE = Template(
+    '{% load bookmarks_tags %}'
+    '{% bookmarks by user as bookmarks %}'
+    '{% for bookmark in bookmarks %}{{ bookmark.content_object.pk }}'
+    '{% endfor %}')
+
+
+class WeightedChoice(object):
+    """
+    Choose *items* randomly, with the given relative *weights*.
+    """
+    def __init__(self, items, weights):
+        self.items = list(items)
+        self.cumulative = []
+        total = 0
+        for weight in weights:
+            total += weight
+            self.cumulative.append(total)
+
+    def __call__(self, rnd=random):
+        value = rnd.random() * self.cumulative[-1]
+        return self.items[bisect.bisect(self.cumulative, value)]
+
+
+def skewed_choice(items, skew=1.0):
+    """
+    Return a *WeightedChoice* of *items* with a Zipf-like distribution:
+    the weight of the item in position *i* is *1 / (i + 1) ** skew*.
+    """
+    items = list(items)
+    return WeightedChoice(items,
+        [1.0 / (i + 1) ** skew for i in range(len(items))])
+
+
+def percentile(values, p):
+    """
+    Return the *p* percentile of *values*, using the nearest rank method.
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    rank = int(math.ceil(p / 100.0 * len(values)))
+    return values[max(rank, 1) - 1]
+
+
+class Dataset(object):
+    """
+    Synthetic users and the bookmarkable instances, with keys.
+    """
+    def __init__(self, users, instances, prefix):
+        self.users = users
+        # list of *(instance, keys)* tuples
+        self.instances = instances
+        self.prefix = prefix
+
+    def delete(self):
+        """
+        Remove the bookmarks of the users created for the dataset,
+        using the bookmarks backend, and delete the users.
+        """
+        backend = handlers.library.backend
+        for user in self.users:
+            for bookmark in list(backend.filter(user=user)):
+                if bookmark.content_object is None:
+                    # removed with the user, if stored in the database
+                    continue
+                try:
+                    backend.remove(user, bookmark.content_object,
+                        bookmark.key)
+                except exceptions.DoesNotExist:
+                    pass
+        User.objects.filter(pk__in=[i.pk for i in self.users]).delete()
+
+
+def create_dataset(bookmarked_models, users=100, objects=1000, keys=1,
+        bookmarks=None, skew=1.0, prefix='loadtest', seed=None,
+        batch_size=500):
+    """
+    Create *users* users and *bookmarks* bookmarks (default: ten for each
+    user), using at most *objects* existing instances of the given
+    *bookmarked_models*, and at most *keys* allowed keys for each model.
+    Return a *Dataset*.
+    """
+    rnd = random.Random(seed)
+    usernames = ['%s%d' % (prefix, i) for i in range(users)]
+    User.objects.bulk_create([User(username=i) for i in usernames],
+        batch_size=batch_size)
+    # only the created users, not the existing ones sharing the prefix
+    user_list = []
+    for i in range(0, len(usernames), batch_size):
+        user_list.extend(User.objects.filter(
+            username__in=usernames[i:i + batch_size]))
+    instances = []
+    per_model = max(objects // len(bookmarked_models), 1)
+    for model in bookmarked_models:
+        handler = handlers.library.get_handler(model)
+        model_keys = list(handler.allowed_keys or [handler.default_key])
+        instances.extend((instance, model_keys[:keys])
+            for instance in model.objects.all()[:per_model])
+    if not instances:
+        Dataset(user_list, instances, prefix).delete()
+        raise ValueError('No instances of the given models.')
+    rnd.shuffle(instances)
+
+    # bookmarked instances follow the skewed distribution
+    backend = handlers.library.backend
+    choose = skewed_choice(instances, skew)
+    if bookmarks is None:
+        bookmarks = users * 10
+    pending = set()
+    for i in range(bookmarks * 3):
+        if len(pending) >= bookmarks:
+            break
+        instance, model_keys = choose(rnd)
+        pending.add((rnd.choice(user_list).pk, type(instance), instance.pk,
+            rnd.choice(model_keys), None))
+    pending = list(pending)
+    for i in range(0, len(pending), batch_size):
+        backend.bulk_add(pending[i:i + batch_size])
+    return Dataset(user_list, instances, prefix)
+
+
+def _login(client, user):
+    # *Client.force_login* is only available in Django >= 1.9
+    if hasattr(client, 'force_login'):
+        client.force_login(user)
+        return
+    engine = import_module(django_settings.SESSION_ENGINE)
+    request = HttpRequest()
+    request.session = engine.SessionStore()
+    user.backend = 'django.contrib.auth.backends.ModelBackend'
+    login(request, user)
+    request.session.save()
+    client.cookies[django_settings.SESSION_COOKIE_NAME] = (
+        request.session.session_key)
+
+
+class Results(object):
+    """
+    Latencies (in seconds) and errors of each kind of operation.
+    """
+    def __init__(self):
+        self.timings = {}
+        self.errors = {}
+        self.elapsed = 0
+        self.stats = None
+        self._lock = threading.Lock()
+
+    def add(self, operation, seconds, ok):
+        with self._lock:
+            self.timings.setdefault(operation, []).append(seconds)
+            if not ok:
+                self.errors[operation] = self.errors.get(operation, 0) + 1
+
+    def add_profile(self, profile):
+        with self._lock:
+            if self.stats is None:
+                self.stats = pstats.Stats(profile)
+            else:
+                self.stats.add(profile)
+
+    def count(self):
+        return sum(len(i) for i in self.timings.values())
+
+    def throughput(self):
+        return self.count() / self.elapsed if self.elapsed else 0
+
+    def summary(self):
+        """
+        Return a list of *(operation, count, errors, p50, p95, p99)*
+        tuples, latencies in milliseconds, the last one for all operations.
+        """
+        rows = []
+        items = sorted(self.timings.items())
+        items.append(('total', list(itertools.chain(
+            *self.timings.values()))))
+        for operation, timings in items:
+            errors = sum(self.errors.values()) if operation == 'total' else (
+                self.errors.get(operation, 0))
+            rows.append((operation, len(timings), errors) + tuple(
+                percentile(timings, p) * 1000 for p in (50, 95, 99)))
+        return rows
+
+
+class Worker(object):
+    """
+    Replay operations on *dataset*, using a client for each user.
+    """
+    def __init__(self, dataset, skew, mix, rnd):
+        self.dataset = dataset
+        self.choose = skewed_choice(dataset.instances, skew)
+        operations = sorted(mix)
+        self.operations = WeightedChoice(operations,
+            [mix[i] for i in operations])
+        self.rnd = rnd
+        self.clients = {}
+        self.bookmark_url = reverse('bookmarks_bookmark')
+        self.ajax_form_url = reverse('bookmarks_ajax_form')
+
+    def get_client(self, user):
+        if user.pk not in self.clients:
+            client = Client()
+            _login(client, user)
+            self.clients[user.pk] = client
+        return self.clients[user.pk]
+
+    def get_data(self, instance, keys):
+        return {
+            'model': str(instance._meta),
+            'object_id': str(instance.pk),
+            'key': self.rnd.choice(keys),
+        }
+
+    def toggle(self, user):
+        instance, keys = self.choose(self.rnd)
+        response = self.get_client(user).post(self.bookmark_url,
+            self.get_data(instance, keys), HTTP_REFERER='/')
+        return response.status_code < 400
+
+    def exists(self, user):
+        instance, keys = self.choose(self.rnd)
+        response = self.get_client(user).get(self.ajax_form_url,
+            self.get_data(instance, keys),
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        return response.status_code < 400
+
+    def list(self, user):
+        LIST_TEMPLATE.render(Context({'user': user}))
+        return True
+
+    def run(self, requests, results):
+        for i in range(requests):
+            user = self.rnd.choice(self.dataset.users)
+            operation = self.operations(self.rnd)
+            start = timeit.default_timer()
+            try:
+                ok = getattr(self, operation)(user)
+            except Exception:
+                ok = False
+            results.add(operation, timeit.default_timer() - start, ok)
+
+
+def replay(dataset, requests=1000, threads=4, skew=1.0, mix=None,
+        profile=False, seed=None):
+    """
+    Replay *requests* operations on *dataset* from *threads* threads,
+    and return the *Results*. The *mix* is a dict mapping operations
+    (*'toggle'*, *'exists'* and *'list'*) to their relative frequency.
+    If *profile* is True, *results.stats* contains the *pstats.Stats*
+    collected by all the threads.
+    """
+    mix = dict(DEFAULT_MIX if mix is None else mix)
+    unknown = set(mix) - set(DEFAULT_MIX)
+    if unknown:
+        raise ValueError('Unknown operations: %s.' % ', '.join(
+            sorted(unknown)))
+    results = Results()
+    seeds = random.Random(seed)
+
+    def target(requests, rnd, close):
+        worker = Worker(dataset, skew, mix, rnd)
+        profiler = cProfile.Profile() if profile else None
+        try:
+            if profiler is not None:
+                profiler.enable()
+            worker.run(requests, results)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                results.add_profile(profiler)
+            if close:
+                connection.close()
+
+    counts = [requests // threads + (1 if i < requests % threads else 0)
+        for i in range(threads)]
+    start = timeit.default_timer()
+    if threads == 1:
+        target(requests, random.Random(seeds.random()), False)
+    else:
+        workers = [threading.Thread(target=target,
+            args=(count, random.Random(seeds.random()), True))
+            for count in counts]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+    results.elapsed = timeit.default_timer() - start
+    return results
@@ -0,0 +1,115 @@
+"""
+A pure Python, in-process stand-in for the subset of the Redis client API
+used by *bookmarks.backends.RedisBackend*.
+
+This is useful in tests and in development, when a Redis server (or the
+*fakeredis* package) is not available, e.g.::
+
+    from bookmarks.backends import RedisBackend
+    from bookmarks.localredis import LocalRedis
+
+    backend = RedisBackend(client=LocalRedis())
+
+Data is not shared between processes and is lost when the process exits.
+"""
+import threading
+
+
+class LocalRedis(object):
+    """
+    In-process implementation of Redis sorted sets.
+    """
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.RLock()
+
+    def _get_members(self, name):
+        members = self._data.get(name, {})
+        return sorted(members.items(), key=lambda i: (i[1], i[0]))
+
+    def zadd(self, name, mapping, nx=False):
+        with self._lock:
+            members = self._data.setdefault(name, {})
+            added = 0
+            for member, score in mapping.items():
+                if member not in members:
+                    added += 1
+                elif nx:
+                    continue
+                members[member] = float(score)
+            return added
+
+    def zrem(self, name, *values):
+        with self._lock:
+            members = self._data.get(name, {})
+            removed = 0
+            for member in values:
+                if members.pop(member, None) is not None:
+                    removed += 1
+            if not members:
+                self._data.pop(name, None)
+            return removed
+
+    def zscore(self, name, value):
+        with self._lock:
+            return self._data.get(name, {}).get(value)
+
+    def zcard(self, name):
+        with self._lock:
+            return len(self._data.get(name, {}))
+
+    def zrange(self, name, start, end, desc=False, withscores=False):
+        with self._lock:
+            members = self._get_members(name)
+        if desc:
+            members.reverse()
+        end = len(members) + end + 1 if end < 0 else end + 1
+        members = members[start:end]
+        if withscores:
+            return members
+        return [member for member, score in members]
+
+    def zrevrange(self, name, start, end, withscores=False):
+        return self.zrange(name, start, end, desc=True, withscores=withscores)
+
+    def delete(self, *names):
+        with self._lock:
+            return len([self._data.pop(i) for i in names if i in self._data])
+
+    def flushdb(self):
+        with self._lock:
+            self._data.clear()
+        return True
+
+    def pipeline(self, transaction=True):
+        return LocalPipeline(self)
+
+
+class LocalPipeline(object):
+    """
+    Queue commands and execute them at once while holding the client lock.
+    """
+    def __init__(self, client):
+        self._client = client
+        self._commands = []
+
+    def __getattr__(self, name):
+        method = getattr(self._client, name)
+
+        def queue(*args, **kwargs):
+            self._commands.append((method, args, kwargs))
+            return self
+        return queue
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self._commands = []
+
+    def execute(self):
+        with self._client._lock:
+            results = [method(*args, **kwargs)
+                for method, args, kwargs in self._commands]
+        self._commands = []
+        return results
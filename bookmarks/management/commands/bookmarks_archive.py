@@ -0,0 +1,30 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from bookmarks import archive
+
+
+class Command(BaseCommand):
+    help = ('Move bookmarks older than the given number of days '
+        'to the bookmarks archive.')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--days', type='int', dest='days', default=None,
+            help='Archive bookmarks older than this number of days '
+                '(default: GENERIC_BOOKMARKS_ARCHIVE["AFTER_DAYS"]).'),
+        make_option('--batch-size', type='int', dest='batch_size',
+            default=None,
+            help='Number of bookmarks moved in each transaction '
+                '(default: GENERIC_BOOKMARKS_ARCHIVE["BATCH_SIZE"]).'),
+        make_option('--database', dest='database', default=None,
+            help='Database alias storing bookmarks.'),
+    )
+
+    def handle(self, *args, **options):
+        before = archive.get_threshold(options['days'])
+        archived = archive.archive_bookmarks(before,
+            batch_size=options['batch_size'], using=options['database'])
+        if int(options.get('verbosity', 1)) > 0:
+            self.stdout.write('Archived %d bookmarks created before %s.' % (
+                archived, before))
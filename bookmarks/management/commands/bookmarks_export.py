@@ -0,0 +1,54 @@
+from optparse import make_option
+
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import six
+
+from bookmarks import export
+from bookmarks.handlers import library
+
+
+class Command(BaseCommand):
+    help = ('Export bookmarks as CSV or JSON Lines, optionally only the '
+        'bookmarks saved by a user or the bookmarks of a model.')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--user', dest='user', default=None,
+            help='Username of the user who saved the bookmarks.'),
+        make_option('--model', dest='model', default=None,
+            help='Bookmarked model, e.g. "blog.article".'),
+        make_option('--format', dest='format', default='csv',
+            choices=sorted(export.FORMATS),
+            help='Export format: csv (default) or jsonl.'),
+        make_option('--output', dest='output', default=None,
+            help='Output file (default: standard output).'),
+        make_option('--chunk-size', type='int', dest='chunk_size',
+            default=None,
+            help='Number of bookmarks retreived by each query '
+                '(default: GENERIC_BOOKMARKS_EXPORT_CHUNK_SIZE).'),
+    )
+
+    def handle(self, *args, **options):
+        user = model = None
+        if options['user'] is not None:
+            try:
+                user = User.objects.get(username=options['user'])
+            except User.DoesNotExist:
+                raise CommandError('Invalid user: %s.' % options['user'])
+        if options['model'] is not None:
+            try:
+                model = apps.get_model(*options['model'].split('.'))
+            except (LookupError, TypeError, ValueError):
+                raise CommandError('Invalid model: %s.' % options['model'])
+        lines = export.export(library.backend, user=user, model=model,
+            format=options['format'], chunk_size=options['chunk_size'])
+        if options['output'] is None:
+            for line in lines:
+                self.stdout.write(line, ending='')
+        else:
+            with open(options['output'], 'wb') as output:
+                for line in lines:
+                    if isinstance(line, six.text_type):
+                        line = line.encode('utf-8')
+                    output.write(line)
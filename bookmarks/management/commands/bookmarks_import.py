@@ -0,0 +1,65 @@
+import io
+import sys
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import six
+
+from bookmarks import importer
+from bookmarks.handlers import library
+
+
+class Command(BaseCommand):
+    args = '<path>'
+    help = ('Import bookmarks from a CSV or JSON Lines file '
+        '(use "-" to read the standard input).')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--format', dest='format', default=None,
+            choices=sorted(importer.READERS),
+            help='Input format: csv or jsonl (default: guessed from the '
+                'file extension, csv for the standard input).'),
+        make_option('--chunk-size', type='int', dest='chunk_size',
+            default=None,
+            help='Number of rows processed at once '
+                '(default: GENERIC_BOOKMARKS_IMPORT_CHUNK_SIZE).'),
+    )
+
+    def open(self, path):
+        if path == '-':
+            return sys.stdin
+        if six.PY2:
+            # the csv module of Python 2 reads bytes
+            return open(path, 'rb')
+        return io.open(path, encoding='utf-8', newline='')
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError('Usage: bookmarks_import %s' % self.args)
+        path = args[0]
+        format = options['format'] or (
+            'jsonl' if path.endswith('.jsonl') else 'csv')
+        verbosity = int(options.get('verbosity', 1))
+
+        def progress(result):
+            if verbosity > 0:
+                self.stdout.write('Processed %d rows: %d added, '
+                    '%d duplicates, %d rejected.' % (result.processed,
+                    result.added, result.duplicates, result.rejected))
+
+        def reject(number, row, reason):
+            if verbosity > 1:
+                self.stderr.write('Row %d rejected: %s' % (number, reason))
+
+        try:
+            lines = self.open(path)
+        except IOError as err:
+            raise CommandError(err)
+        try:
+            importer.import_bookmarks(library.backend,
+                importer.READERS[format](lines),
+                chunk_size=options['chunk_size'], progress=progress,
+                reject=reject)
+        finally:
+            if lines is not sys.stdin:
+                lines.close()
@@ -0,0 +1,107 @@
+from optparse import make_option
+
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from bookmarks import loadtest
+from bookmarks.handlers import library
+
+
+def parse_mix(value):
+    """
+    Parse a mix given as *'toggle=20,exists=60,list=20'*.
+    """
+    mix = {}
+    for item in value.split(','):
+        operation, _, weight = item.partition('=')
+        try:
+            mix[operation.strip()] = float(weight)
+        except ValueError:
+            raise CommandError('Invalid mix: %s.' % value)
+    return mix
+
+
+class Command(BaseCommand):
+    help = ('Create a synthetic dataset of bookmarks and replay '
+        'bookmark traffic, reporting latencies and throughput.')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--models', dest='models', default=None,
+            help='Comma separated bookmarked models, e.g. "blog.article" '
+                '(default: all the registered models, or auth.user).'),
+        make_option('--users', type='int', dest='users', default=100,
+            help='Number of users created.'),
+        make_option('--objects', type='int', dest='objects', default=1000,
+            help='Maximum number of bookmarked instances.'),
+        make_option('--keys', type='int', dest='keys', default=1,
+            help='Maximum number of keys used for each model.'),
+        make_option('--bookmarks', type='int', dest='bookmarks',
+            default=None,
+            help='Number of bookmarks created (default: 10 for each user).'),
+        make_option('--skew', type='float', dest='skew', default=1.0,
+            help='Zipf exponent of the popularity of instances '
+                '(0 for uniform traffic).'),
+        make_option('--requests', type='int', dest='requests', default=1000,
+            help='Number of replayed operations.'),
+        make_option('--threads', type='int', dest='threads', default=4,
+            help='Number of threads replaying operations.'),
+        make_option('--mix', dest='mix',
+            default='toggle=20,exists=60,list=20',
+            help='Relative frequency of operations.'),
+        make_option('--profile', dest='profile', default=None,
+            help='Dump cProfile stats to this file.'),
+        make_option('--seed', type='int', dest='seed', default=None,
+            help='Seed of the random generators.'),
+        make_option('--keep', action='store_true', dest='keep',
+            default=False, help='Do not delete the synthetic dataset.'),
+    )
+
+    def get_models(self, value):
+        if value is None:
+            return library.get_registered_models() or [User]
+        models = []
+        for name in value.split(','):
+            try:
+                models.append(apps.get_model(*name.strip().split('.')))
+            except (LookupError, TypeError, ValueError):
+                raise CommandError('Invalid model: %s.' % name)
+        return models
+
+    def handle(self, *args, **options):
+        models = self.get_models(options['models'])
+        mix = parse_mix(options['mix'])
+        # unregistered models are registered while the command runs
+        registered = [i for i in models if library.get_handler(i) is None]
+        library.register(registered)
+        try:
+            dataset = loadtest.create_dataset(models, users=options['users'],
+                objects=options['objects'], keys=options['keys'],
+                bookmarks=options['bookmarks'], skew=options['skew'],
+                seed=options['seed'])
+            try:
+                results = loadtest.replay(dataset,
+                    requests=options['requests'], threads=options['threads'],
+                    skew=options['skew'], mix=mix,
+                    profile=options['profile'] is not None,
+                    seed=options['seed'])
+            finally:
+                if not options['keep']:
+                    dataset.delete()
+        except ValueError as err:
+            raise CommandError(err)
+        finally:
+            library.unregister(registered)
+        self.report(results)
+        if options['profile'] is not None:
+            results.stats.dump_stats(options['profile'])
+            self.stdout.write('Profile stats dumped to %s.' %
+                options['profile'])
+
+    def report(self, results):
+        self.stdout.write('%-8s %8s %8s %10s %10s %10s' % (
+            'op', 'count', 'errors', 'p50 ms', 'p95 ms', 'p99 ms'))
+        for row in results.summary():
+            self.stdout.write('%-8s %8d %8d %10.2f %10.2f %10.2f' % row)
+        self.stdout.write('%d operations in %.2f seconds: %.1f ops/s.' % (
+            results.count(), results.elapsed, results.throughput()))
@@ -0,0 +1,46 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from bookmarks import recommendations
+from bookmarks.handlers import library
+
+
+class Command(BaseCommand):
+    help = ('Refresh the related objects of bookmarked objects, computed '
+        'from the bookmarks saved by the same users (requires NumPy and '
+        'SciPy).')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--full', action='store_true', dest='full',
+            default=False,
+            help='Rebuild the whole index, instead of updating only the '
+                'objects bookmarked by users who saved bookmarks after the '
+                'last refresh.'),
+        make_option('--keys', dest='keys', default=None,
+            help='Comma separated keys of the bookmarks used '
+                '(default: GENERIC_BOOKMARKS_RECOMMENDATIONS["KEYS"]).'),
+        make_option('--neighbours', type='int', dest='neighbours',
+            default=None,
+            help='Number of related objects stored for each object '
+                '(default: GENERIC_BOOKMARKS_RECOMMENDATIONS["NEIGHBOURS"]).'),
+        make_option('--batch-size', type='int', dest='batch_size',
+            default=None,
+            help='Number of bookmarks and objects processed at once '
+                '(default: GENERIC_BOOKMARKS_RECOMMENDATIONS["BATCH_SIZE"]).'),
+    )
+
+    def handle(self, *args, **options):
+        keys = None
+        if options['keys'] is not None:
+            keys = [i.strip() for i in options['keys'].split(',')]
+        try:
+            updated = recommendations.refresh(library.backend,
+                full=options['full'], keys=keys,
+                neighbours=options['neighbours'],
+                batch_size=options['batch_size'])
+        except ImportError as err:
+            raise CommandError('NumPy and SciPy are required: %s.' % err)
+        if int(options.get('verbosity', 1)) > 0:
+            self.stdout.write('Updated the related objects of %d objects.' %
+                updated)
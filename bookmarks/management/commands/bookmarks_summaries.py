@@ -0,0 +1,30 @@
+from optparse import make_option
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from bookmarks import summaries
+from bookmarks.handlers import library
+
+
+class Command(BaseCommand):
+    help = ('Rebuild the summaries of bookmarks saved by all the users, '
+        'or by the given user.')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--user', dest='user', default=None,
+            help='Username of the user whose summary is rebuilt.'),
+    )
+
+    def handle(self, *args, **options):
+        users = User.objects.all()
+        if options['user'] is not None:
+            users = users.filter(username=options['user'])
+            if not users.exists():
+                raise CommandError('Invalid user: %s.' % options['user'])
+        rebuilt = 0
+        for user_id in users.values_list('pk', flat=True).iterator():
+            summaries.rebuild(user_id, library.backend)
+            rebuilt += 1
+        if int(options.get('verbosity', 1)) > 0:
+            self.stdout.write('Rebuilt %d bookmark summaries.' % rebuilt)
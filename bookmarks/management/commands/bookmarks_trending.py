@@ -0,0 +1,32 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from bookmarks import trending
+from bookmarks.handlers import library
+
+
+class Command(BaseCommand):
+    help = ('Recompute the trending scores of bookmarked objects from the '
+        'stored bookmarks (requires NumPy).')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--half-life', type='int', dest='half_life',
+            default=None,
+            help='Number of seconds after which the weight of a bookmark '
+                'halves (default: GENERIC_BOOKMARKS_TRENDING["HALF_LIFE"]).'),
+        make_option('--batch-size', type='int', dest='batch_size',
+            default=None,
+            help='Number of bookmarks processed at once '
+                '(default: GENERIC_BOOKMARKS_TRENDING["BATCH_SIZE"]).'),
+    )
+
+    def handle(self, *args, **options):
+        try:
+            scored = trending.recompute(library.backend,
+                half_life=options['half_life'],
+                batch_size=options['batch_size'])
+        except ImportError as err:
+            raise CommandError('NumPy is required: %s.' % err)
+        if int(options.get('verbosity', 1)) > 0:
+            self.stdout.write('Scored %d objects and keys.' % scored)
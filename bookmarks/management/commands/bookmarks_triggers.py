@@ -0,0 +1,34 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from bookmarks import triggers
+from bookmarks.handlers import library
+
+
+class Command(BaseCommand):
+    help = ('Install the database triggers removing the bookmarks of '
+        'deleted objects, for all the models registered with db_cascade.')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--uninstall', action='store_true', dest='uninstall',
+            default=False, help='Remove the triggers.'),
+        make_option('--all', action='store_true', dest='all', default=False,
+            help='Manage triggers for all the registered models.'),
+        make_option('--database', dest='database', default=None,
+            help='Database alias storing bookmarks.'),
+    )
+
+    def handle(self, *args, **options):
+        function = triggers.uninstall if options['uninstall'] else (
+            triggers.install)
+        for model in library.get_registered_models():
+            handler = library.get_handler(model)
+            if handler.storage == 'dedicated':
+                continue
+            if handler.db_cascade or options['all']:
+                function(model, using=options['database'])
+                if int(options.get('verbosity', 1)) > 0:
+                    self.stdout.write('%s triggers for %s.' % (
+                        'Removed' if options['uninstall'] else 'Installed',
+                        model._meta.object_name))
@@ -1,55 +1,178 @@
-from django.db import models
 from django.contrib.contenttypes.models import ContentType
+from django.db import IntegrityError, models, transaction
 
 from bookmarks import exceptions, utils
 
 
-class QuerysetWithContents(object):
-    """
-    Queryset wrapper.
-    """
-    def __init__(self, queryset):
-        self.queryset = queryset
-
-    def __getattr__(self, name):
-        if name in ('get', 'create', 'get_or_create', 'count', 'in_bulk',
-                'iterator', 'latest', 'aggregate', 'exists', 'update', 'delete'):
-            return getattr(self.queryset, name)
-        if hasattr(self.queryset, name):
-            attr = getattr(self.queryset, name)
-            if callable(attr):
-                def _wrap(*args, **kwargs):
-                    return self.__class__(attr(*args, **kwargs))
-                return _wrap
-            return attr
-        raise AttributeError(name)
-
-    def __getitem__(self, key):
-        return self.__class__(self.queryset[key])
-
-    def __iter__(self):
-        objects = list(self.queryset)
-        generics = {}
-        for i in objects:
-            generics.setdefault(i.content_type_id, set()).add(i.object_id)
-        content_types = ContentType.objects.in_bulk(generics.keys())
-        relations = {}
-        for content_type_id, pk_list in generics.items():
-            model = content_types[content_type_id].model_class()
-            relations[content_type_id] = model.objects.in_bulk(pk_list)
-        for i in objects:
-            setattr(i, '_content_object_cache',
-                relations[i.content_type_id][i.object_id])
-        return iter(objects)
-
-    def __len__(self):
-        return len(self.queryset)
+class BookmarkQuerySet(models.query.QuerySet):
+    """
+    Queryset used by *Bookmark* model.
+    """
+    def with_contents(self):
+        """
+        Retreive the content objects of all bookmarks in bulk, using
+        one query for each content type, e.g.::
+
+            for bookmark in Bookmark.objects.filter(key='main').with_contents():
+                bookmark.content_object # this does not hit the db
+
+        Content objects are loaded using the Django prefetch machinery, so
+        the returned queryset can be further filtered, sliced, paginated,
+        pickled, or combined with *select_related* and *only*.
+        """
+        return self.prefetch_related('content_object')
+
+    def with_users(self, *fields):
+        """
+        Retreive the users who saved the bookmarks in the same query.
+
+        If *fields* are given, only those user fields (and the user primary
+        key) are loaded, keeping the row payload small when listing a lot
+        of bookmarkers, e.g.::
+
+            for bookmark in Bookmark.objects.filter_for(article).with_users(
+                    'username'):
+                bookmark.user.username # this does not hit the db
+        """
+        queryset = self.select_related('user')
+        if fields:
+            opts = self.model._meta
+            user_opts = opts.get_field('user').rel.to._meta
+            names = [i.name for i in opts.local_fields]
+            names.extend('user__%s' % i for i in (user_opts.pk.name,) + fields)
+            queryset = queryset.only(*names)
+        return queryset
+
+
+class StringBookmarkQuerySet(BookmarkQuerySet):
+    """
+    Queryset used by *StringBookmark* model.
+
+    Object ids are stored as strings, while the generic prefetch compares
+    them with the primary keys of content objects (e.g. UUIDs): content
+    objects are retreived using *utils.load_contents* when the queryset
+    is evaluated.
+    """
+    _with_contents = False
+
+    def with_contents(self):
+        clone = self._clone()
+        clone._with_contents = True
+        return clone
+
+    def _clone(self, *args, **kwargs):
+        clone = super(StringBookmarkQuerySet, self)._clone(*args, **kwargs)
+        clone._with_contents = self._with_contents
+        return clone
+
+    def _fetch_all(self):
+        load = self._with_contents and self._result_cache is None
+        super(StringBookmarkQuerySet, self)._fetch_all()
+        if load:
+            utils.load_contents([i for i in self._result_cache
+                if isinstance(i, self.model)])
+
+
+class DedicatedBookmarkQuerySet(BookmarkQuerySet):
+    """
+    Queryset used by bookmark models dedicated to a single model.
+
+    Generic *content_type* and *object_id* lookups are translated to
+    lookups on the foreign key to the bookmarked model, so that dedicated
+    bookmarks can be queried like the generic ones, also inside *Q*
+    objects. Looking up another content type raises a *ValueError*.
+    """
+    # a condition always true, replacing matching content type lookups
+    _always = ('pk__isnull', False)
+
+    def _translate(self, name):
+        if name == 'object_id' or name.startswith('object_id__'):
+            return 'content_object_id' + name[len('object_id'):]
+        return name
+
+    def _is_content_type_lookup(self, name):
+        return name.split('__')[0] in ('content_type', 'content_type_id')
+
+    def _check_content_type(self, name, value):
+        """
+        Raise a *ValueError* unless the content type lookup *name*
+        matches the content type of the bookmarked model.
+        """
+        parts = name.split('__')
+        if parts[0] == 'content_type' and parts[1:] in (['id'], ['pk']):
+            parts = ['content_type_id']
+        if parts[1:] in ([], ['exact']):
+            values = [value]
+        elif parts[1:] == ['in']:
+            values = list(value)
+        else:
+            raise ValueError('Unsupported lookup %r on dedicated bookmarks.'
+                % name)
+        model = self.model._meta.get_field('content_object').rel.to
+        content_type_id = utils.get_content_type_for_model(model).pk
+        if not any(int(getattr(i, 'pk', i)) == content_type_id
+                for i in values):
+            raise ValueError('%s only stores bookmarks of %s.' % (
+                self.model.__name__, model.__name__))
+
+    def _translate_q(self, q):
+        children = []
+        for child in q.children:
+            if isinstance(child, models.Q):
+                child = self._translate_q(child)
+            else:
+                name, value = child
+                if self._is_content_type_lookup(name):
+                    self._check_content_type(name, value)
+                    child = self._always
+                else:
+                    child = (self._translate(name), value)
+            children.append(child)
+        translated = models.Q()
+        translated.connector, translated.negated = q.connector, q.negated
+        translated.children = children
+        return translated
+
+    def _filter_or_exclude(self, negate, *args, **kwargs):
+        args = [self._translate_q(i) if isinstance(i, models.Q) else i
+            for i in args]
+        lookups = {}
+        for name, value in kwargs.items():
+            if self._is_content_type_lookup(name):
+                self._check_content_type(name, value)
+                if negate:
+                    # e.g. excluding all the bookmarks of the model
+                    lookups[self._always[0]] = self._always[1]
+            else:
+                lookups[self._translate(name)] = value
+        return super(DedicatedBookmarkQuerySet, self)._filter_or_exclude(
+            negate, *args, **lookups)
+
+    def values_list(self, *fields, **kwargs):
+        fields = [self._translate(i) for i in fields]
+        return super(DedicatedBookmarkQuerySet, self).values_list(
+            *fields, **kwargs)
+
+    def with_contents(self):
+        """
+        Retreive the content objects in the same query.
+        """
+        return self.select_related('content_object')
 
 
 class BookmarksManager(models.Manager):
     """
     Manager used by *Bookmark* model.
     """
+    def get_queryset(self):
+        return BookmarkQuerySet(self.model, using=self._db)
+
+    def with_contents(self):
+        return self.get_queryset().with_contents()
+
+    def with_users(self, *fields):
+        return self.get_queryset().with_users(*fields)
+
     def get_for(self, content_object, key, **kwargs):
         """
         Return the instance related to *content_object* and matching *kwargs*.
@@ -93,7 +216,7 @@ class BookmarksManager(models.Manager):
             queryset = self.filter_for(content_object, **kwargs)
         else:
             queryset = self.filter(**kwargs)
-        return QuerysetWithContents(queryset)
+        return queryset.with_contents()
 
     def add(self, user, content_object, key):
         """
@@ -104,9 +227,10 @@ class BookmarksManager(models.Manager):
         """
         content_type = utils.get_content_type_for_model(type(content_object))
         try:
-            return self.create(user=user, content_type=content_type,
-                object_id=content_object.pk, key=key)
-        except Exception:  # TODO: IntegrityError?
+            with transaction.atomic(using=self.db):
+                return self.create(user=user, content_type=content_type,
+                    object_id=content_object.pk, key=key)
+        except IntegrityError:
             raise exceptions.AlreadyExists
 
     def remove(self, user, content_object, key):
@@ -134,4 +258,83 @@ class BookmarksManager(models.Manager):
         """
         content_type = utils.get_content_type_for_model(type(content_object))
         self.filter(content_type=content_type,
-            object_id=content_object.id).delete()
+            object_id=content_object.pk).delete()
+
+
+class BookmarkNeighboursManager(models.Manager):
+    """
+    Manager used by *BookmarkNeighbour* model.
+    """
+    def related_to(self, content_object, limit=None):
+        """
+        Return the objects most often bookmarked by the users who bookmarked
+        *content_object*, best first, e.g.::
+
+            for article in BookmarkNeighbour.objects.related_to(article, 5):
+                ...
+
+        Objects are retreived using a query for each content type, and
+        deleted objects are skipped.
+        """
+        content_type = utils.get_content_type_for_model(type(content_object))
+        neighbours = list(self.filter(content_type=content_type,
+            object_id=content_object.pk).order_by('-score').values_list(
+            'neighbour_content_type_id', 'neighbour_object_id')[:limit])
+        object_ids = {}
+        for content_type_id, object_id in neighbours:
+            object_ids.setdefault(content_type_id, []).append(object_id)
+        objects = {}
+        for content_type_id, pk_list in object_ids.items():
+            manager = ContentType.objects.get_for_id(
+                content_type_id).model_class()._default_manager
+            for pk, obj in manager.in_bulk(pk_list).items():
+                objects[content_type_id, pk] = obj
+        return [objects[i] for i in neighbours if i in objects]
+
+
+class TrendingScoresManager(models.Manager):
+    """
+    Manager used by *TrendingScore* model.
+    """
+    def filter_for(self, content_object):
+        """
+        Return the scores of *content_object*, one for each key.
+        """
+        content_type = utils.get_content_type_for_model(type(content_object))
+        return self.filter(content_type=content_type,
+            object_id=content_object.pk)
+
+    def top(self, model, key=None, limit=10):
+        """
+        Return the scores of the *limit* trending *model* instances for
+        *key* (default: *settings.GENERIC_BOOKMARKS_DEFAULT_KEY*),
+        best first.
+        """
+        from bookmarks import settings
+        content_type = utils.get_content_type_for_model(model)
+        return self.filter(content_type=content_type,
+            key=key or settings.DEFAULT_KEY).order_by('-score')[:limit]
+
+
+class StringBookmarksManager(BookmarksManager):
+    """
+    Manager used by *StringBookmark* model.
+    """
+    def get_queryset(self):
+        return StringBookmarkQuerySet(self.model, using=self._db)
+
+
+class DedicatedBookmarksManager(BookmarksManager):
+    """
+    Manager used by bookmark models dedicated to a single model.
+    """
+    def get_queryset(self):
+        return DedicatedBookmarkQuerySet(self.model, using=self._db)
+
+    def add(self, user, content_object, key):
+        try:
+            with transaction.atomic(using=self.db):
+                return self.create(user=user, content_object=content_object,
+                    key=key)
+        except IntegrityError:
+            raise exceptions.AlreadyExists
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookmarks', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='bookmark',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+            preserve_default=True,
+        ),
+        migrations.AlterIndexTogether(
+            name='bookmark',
+            index_together=set([('content_type', 'created_at')]),
+        ),
+    ]
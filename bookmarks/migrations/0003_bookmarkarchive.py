@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+from django.conf import settings
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('contenttypes', '0001_initial'),
+        ('bookmarks', '0002_created_at_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookmarkArchive',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('object_id', models.PositiveIntegerField()),
+                ('key', models.CharField(max_length=16)),
+                ('created_at', models.DateTimeField(db_index=True)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('content_type', models.ForeignKey(to='contenttypes.ContentType')),
+                ('user', models.ForeignKey(related_name='archived_bookmarks', blank=True, to=settings.AUTH_USER_MODEL, null=True)),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.AlterUniqueTogether(
+            name='bookmarkarchive',
+            unique_together=set([('content_type', 'object_id', 'key', 'user')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='bookmarkarchive',
+            index_together=set([('content_type', 'created_at')]),
+        ),
+    ]
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+import bookmarks.keys
+
+
+def fill_key_codes(apps, schema_editor):
+    from bookmarks import settings
+    BookmarkKey = apps.get_model('bookmarks', 'BookmarkKey')
+    using = schema_editor.connection.alias
+    for model_name in ('Bookmark', 'BookmarkArchive'):
+        model = apps.get_model('bookmarks', model_name)
+        names = model.objects.using(using).values_list(
+            'key', flat=True).distinct()
+        for name in list(names):
+            if settings.KEY_CODES:
+                # the registry table is not used
+                code = settings.KEY_CODES[name]
+            else:
+                code = BookmarkKey.objects.using(using).get_or_create(
+                    name=name)[0].pk
+            model.objects.using(using).filter(key=name).update(
+                key_code=code)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookmarks', '0003_bookmarkarchive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookmarkKey',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('name', models.CharField(unique=True, max_length=16)),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.AddField(
+            model_name='bookmark',
+            name='key_code',
+            field=models.PositiveSmallIntegerField(null=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='bookmarkarchive',
+            name='key_code',
+            field=models.PositiveSmallIntegerField(null=True),
+            preserve_default=True,
+        ),
+        migrations.RunPython(fill_key_codes),
+        migrations.AlterUniqueTogether(
+            name='bookmark',
+            unique_together=set([]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='bookmarkarchive',
+            unique_together=set([]),
+        ),
+        migrations.RemoveField(
+            model_name='bookmark',
+            name='key',
+        ),
+        migrations.RemoveField(
+            model_name='bookmarkarchive',
+            name='key',
+        ),
+        migrations.RenameField(
+            model_name='bookmark',
+            old_name='key_code',
+            new_name='key',
+        ),
+        migrations.RenameField(
+            model_name='bookmarkarchive',
+            old_name='key_code',
+            new_name='key',
+        ),
+        migrations.AlterField(
+            model_name='bookmark',
+            name='key',
+            field=bookmarks.keys.KeyField(),
+            preserve_default=True,
+        ),
+        migrations.AlterField(
+            model_name='bookmarkarchive',
+            name='key',
+            field=bookmarks.keys.KeyField(),
+            preserve_default=True,
+        ),
+        migrations.AlterUniqueTogether(
+            name='bookmark',
+            unique_together=set([('content_type', 'object_id', 'key', 'user')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='bookmarkarchive',
+            unique_together=set([('content_type', 'object_id', 'key', 'user')]),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+from django.conf import settings
+
+import bookmarks.keys
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('contenttypes', '0001_initial'),
+        ('bookmarks', '0004_bookmark_key_codes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StringBookmark',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('object_id', models.CharField(max_length=64)),
+                ('key', bookmarks.keys.KeyField()),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('content_type', models.ForeignKey(to='contenttypes.ContentType')),
+                ('user', models.ForeignKey(related_name='string_bookmarks', blank=True, to=settings.AUTH_USER_MODEL, null=True)),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.AlterUniqueTogether(
+            name='stringbookmark',
+            unique_together=set([('content_type', 'object_id', 'key', 'user')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='stringbookmark',
+            index_together=set([('content_type', 'created_at')]),
+        ),
+    ]
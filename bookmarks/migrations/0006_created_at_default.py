@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookmarks', '0005_stringbookmark'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='bookmark',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False, db_index=True),
+            preserve_default=True,
+        ),
+        migrations.AlterField(
+            model_name='stringbookmark',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False, db_index=True),
+            preserve_default=True,
+        ),
+    ]
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+from django.conf import settings
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('bookmarks', '0006_created_at_default'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookmarkSummary',
+            fields=[
+                ('user', models.OneToOneField(related_name='bookmark_summary', primary_key=True, serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('data', models.TextField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0001_initial'),
+        ('bookmarks', '0007_bookmarksummary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookmarkNeighbour',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('object_id', models.PositiveIntegerField()),
+                ('neighbour_object_id', models.PositiveIntegerField()),
+                ('score', models.FloatField()),
+                ('updated_until', models.DateTimeField(db_index=True)),
+                ('content_type', models.ForeignKey(related_name='+', to='contenttypes.ContentType')),
+                ('neighbour_content_type', models.ForeignKey(related_name='+', to='contenttypes.ContentType')),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.AlterIndexTogether(
+            name='bookmarkneighbour',
+            index_together=set([('content_type', 'object_id', 'score')]),
+        ),
+    ]
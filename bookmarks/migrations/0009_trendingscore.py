@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import bookmarks.keys
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0001_initial'),
+        ('bookmarks', '0008_bookmarkneighbour'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrendingScore',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('object_id', models.PositiveIntegerField()),
+                ('key', bookmarks.keys.KeyField()),
+                ('score', models.FloatField()),
+                ('content_type', models.ForeignKey(related_name='+', to='contenttypes.ContentType')),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.AlterUniqueTogether(
+            name='trendingscore',
+            unique_together=set([('content_type', 'object_id', 'key')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='trendingscore',
+            index_together=set([('content_type', 'key', 'score')]),
+        ),
+    ]
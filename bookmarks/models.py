@@ -1,11 +1,13 @@
+import math
 import string
 
-from django.db import models
+from django.db import models, connections
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes import fields
 from django.contrib.auth.models import User
+from django.utils import timezone
 
-from bookmarks import managers
+from bookmarks import managers, keys
 
 
 class Bookmark(models.Model):
@@ -29,7 +31,7 @@ class Bookmark(models.Model):
 
     .. py:attribute:: key
 
-        the bookmark key
+        the bookmark key (stored as a small integer, see *BookmarkKey*)
 
     .. py:attribute:: user
 
@@ -44,26 +46,348 @@ class Bookmark(models.Model):
     object_id = models.PositiveIntegerField()
     content_object = fields.GenericForeignKey('content_type', 'object_id')
 
-    key = models.CharField(max_length=16)
+    key = keys.KeyField()
 
     user = models.ForeignKey(User, blank=True, null=True,
         related_name='bookmarks')
 
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(default=timezone.now, editable=False,
+        db_index=True)
 
     # manager
     objects = managers.BookmarksManager()
 
     class Meta:
         unique_together = ('content_type', 'object_id', 'key', 'user')
+        index_together = [('content_type', 'created_at')]
+
+    def __unicode__(self):
+        return u'Bookmark for %s by %s' % (self.content_object, self.user)
+
+
+class StringBookmark(models.Model):
+    """
+    A user's bookmark for a content object whose primary key is not
+    an integer, e.g. a string or an UUID.
+
+    This model has the same fields as *Bookmark*, but *object_id* is a
+    string, so that bookmarks can be looked up using the primary key
+    of the content object without casts.
+
+    Use *get_bookmark_model* to retreive the bookmark model storing
+    bookmarks for a given model.
+    """
+    content_type = models.ForeignKey(ContentType)
+    object_id = models.CharField(max_length=64)
+    content_object = fields.GenericForeignKey('content_type', 'object_id')
+
+    key = keys.KeyField()
+
+    user = models.ForeignKey(User, blank=True, null=True,
+        related_name='string_bookmarks')
+
+    created_at = models.DateTimeField(default=timezone.now, editable=False,
+        db_index=True)
+
+    # manager
+    objects = managers.StringBookmarksManager()
+
+    class Meta:
+        unique_together = ('content_type', 'object_id', 'key', 'user')
+        index_together = [('content_type', 'created_at')]
 
     def __unicode__(self):
         return u'Bookmark for %s by %s' % (self.content_object, self.user)
 
 
+def get_bookmark_model(model_or_instance):
+    """
+    Return the model storing bookmarks for *model_or_instance*, based on
+    the type of its primary key: *Bookmark* for integer primary keys,
+    *StringBookmark* otherwise.
+    """
+    from bookmarks import utils
+    pk = utils.get_pk_field(model_or_instance)
+    if isinstance(pk, (models.AutoField, models.IntegerField)):
+        return Bookmark
+    return StringBookmark
+
+
+class BookmarkKey(models.Model):
+    """
+    Registry of bookmark keys: bookmarks store the id of the key,
+    so that the key does not bloat the table and its indexes.
+
+    Keys are registered the first time they are used
+    (see *bookmarks.keys*).
+
+    .. py:attribute:: name
+
+        the bookmark key
+    """
+    name = models.CharField(max_length=16, unique=True)
+
+    def __unicode__(self):
+        return self.name
+
+
+class BookmarkArchive(models.Model):
+    """
+    A bookmark moved out of the *Bookmark* table because it is older than
+    the archival threshold (see :doc:`customization`).
+
+    The archive has the same fields as *Bookmark*, and it is consulted by
+    the model backend only when the *Bookmark* table does not contain the
+    requested bookmarks.
+
+    .. py:attribute:: archived_at
+
+        the datetime the bookmark was archived
+    """
+    content_type = models.ForeignKey(ContentType)
+    object_id = models.PositiveIntegerField()
+    content_object = fields.GenericForeignKey('content_type', 'object_id')
+
+    key = keys.KeyField()
+
+    user = models.ForeignKey(User, blank=True, null=True,
+        related_name='archived_bookmarks')
+
+    created_at = models.DateTimeField(db_index=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    # manager
+    objects = managers.BookmarksManager()
+
+    class Meta:
+        unique_together = ('content_type', 'object_id', 'key', 'user')
+        index_together = [('content_type', 'created_at')]
+
+    def __unicode__(self):
+        return u'Archived bookmark for %s by %s' % (
+            self.content_object, self.user)
+
+
+class BookmarkSummary(models.Model):
+    """
+    The summary of bookmarks saved by a user (see *bookmarks.summaries*).
+
+    .. py:attribute:: data
+
+        the JSON encoded summary: the number of bookmarks for each key
+        and content type, and the most recent bookmarks
+
+    .. py:attribute:: updated_at
+
+        the datetime the summary was last updated
+    """
+    user = models.OneToOneField(User, primary_key=True,
+        related_name='bookmark_summary')
+    data = models.TextField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __unicode__(self):
+        return u'Bookmark summary of %s' % self.user
+
+
+class BookmarkNeighbour(models.Model):
+    """
+    An object often bookmarked by the users who bookmarked another object
+    (see *bookmarks.recommendations*).
+
+    .. py:attribute:: content_object
+
+        the bookmarked object
+
+    .. py:attribute:: neighbour
+
+        the related object
+
+    .. py:attribute:: score
+
+        the cosine similarity of the users who bookmarked the two objects
+
+    .. py:attribute:: updated_until
+
+        bookmarks created up to this datetime were used to compute the score
+    """
+    content_type = models.ForeignKey(ContentType, related_name='+')
+    object_id = models.PositiveIntegerField()
+    content_object = fields.GenericForeignKey('content_type', 'object_id')
+
+    neighbour_content_type = models.ForeignKey(ContentType, related_name='+')
+    neighbour_object_id = models.PositiveIntegerField()
+    neighbour = fields.GenericForeignKey('neighbour_content_type',
+        'neighbour_object_id')
+
+    score = models.FloatField()
+    updated_until = models.DateTimeField(db_index=True)
+
+    # manager
+    objects = managers.BookmarkNeighboursManager()
+
+    class Meta:
+        index_together = [('content_type', 'object_id', 'score')]
+
+    def __unicode__(self):
+        return u'%s related to %s' % (self.neighbour, self.content_object)
+
+
+class BookmarkWatermark(models.Model):
+    """
+    The greatest primary key of a table storing bookmarks when related
+    objects were last refreshed (see *bookmarks.recommendations*).
+
+    .. py:attribute:: source
+
+        the database alias and the name of the table
+
+    .. py:attribute:: last_pk
+
+        bookmarks with greater primary keys are handled by the next refresh
+    """
+    source = models.CharField(max_length=255, unique=True)
+    last_pk = models.BigIntegerField()
+
+    def __unicode__(self):
+        return u'%s up to %s' % (self.source, self.last_pk)
+
+
+class TrendingScore(models.Model):
+    """
+    The time-decayed score of an object bookmarked using a key
+    (see *bookmarks.trending*).
+
+    .. py:attribute:: content_object
+
+        the bookmarked object
+
+    .. py:attribute:: key
+
+        the bookmark key
+
+    .. py:attribute:: score
+
+        the logarithm of the sum of the weights of the bookmarks,
+        measured at *bookmarks.trending.EPOCH*
+    """
+    content_type = models.ForeignKey(ContentType, related_name='+')
+    object_id = models.PositiveIntegerField()
+    content_object = fields.GenericForeignKey('content_type', 'object_id')
+
+    key = keys.KeyField()
+
+    score = models.FloatField()
+
+    # manager
+    objects = managers.TrendingScoresManager()
+
+    class Meta:
+        unique_together = ('content_type', 'object_id', 'key')
+        index_together = [('content_type', 'key', 'score')]
+
+    def __unicode__(self):
+        return u'Trending score of %s' % self.content_object
+
+    def get_value(self, now=None, half_life=None):
+        """
+        Return the decayed score at *now* (default: the current time),
+        i.e. the sum of the weights of the bookmarks, where the weight of a
+        bookmark halves every *half_life* seconds.
+        """
+        from bookmarks import trending
+        now = trending.get_timestamp(now or timezone.now())
+        return math.exp(self.score - trending.get_rate(half_life) * (
+            now - trending.EPOCH))
+
+
+class DedicatedBookmark(models.Model):
+    """
+    Base class of the bookmark models dedicated to a single model,
+    created using *create_dedicated_model*.
+
+    Dedicated bookmarks have a real foreign key (named *content_object*)
+    to the bookmarked model, while the *content_type* and *object_id*
+    attributes are provided for compatibility with generic bookmarks.
+    """
+    key = keys.KeyField()
+
+    user = models.ForeignKey(User, blank=True, null=True, related_name='+')
+
+    created_at = models.DateTimeField(default=timezone.now, editable=False,
+        db_index=True)
+
+    # manager
+    objects = managers.DedicatedBookmarksManager()
+
+    class Meta:
+        abstract = True
+
+    def __unicode__(self):
+        return u'Bookmark for %s by %s' % (self.content_object, self.user)
+
+    @property
+    def object_id(self):
+        return self.content_object_id
+
+    @property
+    def content_type(self):
+        from bookmarks import utils
+        return utils.get_content_type_for_model(
+            self._meta.get_field('content_object').rel.to)
+
+
+_dedicated_models = {}
+
+
+def create_dedicated_model(model):
+    """
+    Create and return a bookmark model dedicated to *model*: its table has
+    a foreign key to the *model* table, so that bookmarks are deleted in
+    cascade and indexes only contain bookmarks of *model* instances.
+
+    The bookmark model is named adding *Bookmark* to the name of *model*
+    and it belongs to the same app, so it must be created in the
+    *models.py* of that app to be included in its migrations, e.g.::
+
+        from bookmarks.models import create_dedicated_model
+
+        class Article(models.Model):
+            ...
+
+        ArticleBookmark = create_dedicated_model(Article)
+
+    Then *model* must be registered using dedicated storage::
+
+        library.register(Article, storage='dedicated')
+    """
+    meta = type('Meta', (object,), {
+        'app_label': model._meta.app_label,
+        'unique_together': ('content_object', 'key', 'user'),
+        'index_together': [('user', 'created_at')],
+    })
+    name = '%sBookmark' % model.__name__
+    bookmark_model = type(name, (DedicatedBookmark,), {
+        '__module__': model.__module__,
+        'content_object': models.ForeignKey(model,
+            related_name='dedicated_bookmarks'),
+        'Meta': meta,
+    })
+    _dedicated_models[model] = bookmark_model
+    return bookmark_model
+
+
+def get_dedicated_model(model):
+    """
+    Return the bookmark model dedicated to *model*, or None.
+    """
+    return _dedicated_models.get(model)
+
+
 # IN BULK SELECT QUERIES
 
-def annotate_bookmarks(queryset_or_model, key, user, attr='is_bookmarked'):
+def annotate_bookmarks(queryset_or_model, key, user, attr='is_bookmarked',
+        bookmark_model=None):
     """
     Annotate *queryset_or_model* with bookmarks, in order to retreive from
     the database all bookmark values in bulk.
@@ -73,6 +397,10 @@ def annotate_bookmarks(queryset_or_model, key, user, attr='is_bookmarked'):
 
     The bookmarks are filtered using given *user*.
 
+    The bookmark table is chosen using the primary key type of the
+    queryset model (see *get_bookmark_model*), unless a *bookmark_model*
+    is given.
+
     A boolean is inserted in an attr named *attr* (default='is_bookmarked')
     of each object in the generated queryset.
 
@@ -91,23 +419,50 @@ def annotate_bookmarks(queryset_or_model, key, user, attr='is_bookmarked'):
         queryset = queryset_or_model
     # preparing arguments for *extra* query
     opts = queryset.model._meta
+    if bookmark_model is None:
+        bookmark_model = get_bookmark_model(queryset.model)
     content_type = utils.get_content_type_for_model(queryset.model)
     mapping = {
-        'bookmark_table': Bookmark._meta.db_table,
+        'bookmark_table': bookmark_model._meta.db_table,
         'model_table': opts.db_table,
-        'model_pk_name': opts.pk.name,
+        'model_pk_name': opts.pk.column,
         'content_type_id': content_type.pk,
     }
+    code = keys.get_code(key, create=False)
+    if issubclass(bookmark_model, StringBookmark):
+        # object ids are strings, while e.g. UUID primary keys can be
+        # stored using a native column type: ids are retreived first,
+        # and compared using the primary key type
+        pk_field = utils.get_pk_field(queryset.model)
+        object_ids = bookmark_model.objects.db_manager(queryset.db).filter(
+            content_type=content_type, user=user, key=code).values_list(
+            'object_id', flat=True)
+        pk_list = [pk_field.get_db_prep_value(pk_field.to_python(i),
+            connections[queryset.db]) for i in object_ids]
+        if not pk_list:
+            return queryset.extra(select={attr: '0'})
+        sql = '%s.%s IN (%s)' % (opts.db_table, opts.pk.column,
+            ', '.join(['%s'] * len(pk_list)))
+        return queryset.extra(select={attr: sql}, select_params=pk_list)
     # building base query
-    template = """
-    SELECT id FROM ${bookmark_table} WHERE
-    ${bookmark_table}.object_id = ${model_table}.${model_pk_name} AND
-    ${bookmark_table}.content_type_id = ${content_type_id} AND
-    ${bookmark_table}.user_id = %s AND
-    ${bookmark_table}.key = %s
-    """
+    if issubclass(bookmark_model, DedicatedBookmark):
+        template = """
+        SELECT id FROM ${bookmark_table} WHERE
+        ${bookmark_table}.content_object_id = ${model_table}.${model_pk_name}
+        AND ${bookmark_table}.user_id = %s AND
+        ${bookmark_table}.key = %s
+        """
+    else:
+        template = """
+        SELECT id FROM ${bookmark_table} WHERE
+        ${bookmark_table}.object_id = ${model_table}.${model_pk_name} AND
+        ${bookmark_table}.content_type_id = ${content_type_id} AND
+        ${bookmark_table}.user_id = %s AND
+        ${bookmark_table}.key = %s
+        """
     select = {attr: string.Template(template).substitute(mapping)}
-    return queryset.extra(select=select, select_params=[user.pk, key])
+    return queryset.extra(select=select,
+        select_params=[user.pk, code])
 
 
 # ABSTRACT MODELS
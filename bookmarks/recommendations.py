@@ -0,0 +1,434 @@
+"""
+Related content recommendations computed from co-bookmark data
+("people who bookmarked this also bookmarked...").
+
+Bookmarks are loaded in chunks as a sparse *users x objects* matrix, and
+the co-occurrences of objects are computed in batches of objects using
+sparse matrix products. For each object the *NEIGHBOURS* objects with the
+highest cosine similarity are stored in the *BookmarkNeighbour* table,
+so that recommendations are retreived with a single indexed query, e.g.::
+
+    from bookmarks.models import BookmarkNeighbour
+
+    BookmarkNeighbour.objects.related_to(article, limit=5)
+
+The index is refreshed using the *bookmarks_related* management command:
+by default only the objects bookmarked by users who saved bookmarks after
+the last refresh, and the objects they are related to, are updated; removed
+bookmarks are reflected by a full rebuild (*--full*).
+
+If bookmarks are stored using Django models, an incremental refresh only
+loads the bookmarks of the users who bookmarked the updated objects, and
+new bookmarks are found comparing primary keys with the greatest ones seen
+by the previous refresh (see *BookmarkWatermark*), so that imported
+bookmarks are included whatever their creation date.
+
+Computing the index requires NumPy and SciPy. Only bookmarks of objects
+with integer primary keys (lower than *2 ** OBJECT_ID_BITS*)
+are considered.
+"""
+from django.db import transaction
+from django.db.models import Count, Max
+from django.utils import six, timezone
+
+from bookmarks import settings, models, utils, export
+
+# item codes combine the content type id and the object id
+OBJECT_ID_BITS = 32
+
+# maximum number of object ids in a single lookup
+LOOKUP_BATCH_SIZE = 500
+
+
+def _encode(content_type_ids, object_ids):
+    return (content_type_ids << OBJECT_ID_BITS) + object_ids
+
+
+def _is_valid(object_ids):
+    # as in *bookmarks.index.encode*, objects whose ids do not fit in
+    # OBJECT_ID_BITS are skipped
+    return (object_ids >= 0) & (object_ids < 1 << OBJECT_ID_BITS)
+
+
+def _decode(item):
+    item = int(item)
+    return item >> OBJECT_ID_BITS, item & ((1 << OBJECT_ID_BITS) - 1)
+
+
+def _get_sources(backend, keys=None):
+    # return (queryset, fields, content_type_id) tuples describing the
+    # tables storing bookmarks of objects with integer primary keys
+    sources = []
+    for queryset in export.get_querysets(backend):
+        bookmark_model = queryset.model
+        if bookmark_model is models.StringBookmark:
+            continue
+        queryset = queryset.filter(user__isnull=False)
+        if keys:
+            queryset = queryset.filter(key__in=keys)
+        if issubclass(bookmark_model, models.DedicatedBookmark):
+            content_type_id = utils.get_content_type_for_model(
+                bookmark_model._meta.get_field('content_object').rel.to).pk
+            sources.append((queryset, ('content_object_id',),
+                content_type_id))
+        else:
+            sources.append((queryset, ('content_type_id', 'object_id'), None))
+    return sources
+
+
+def _get_source_name(queryset):
+    return '%s:%s' % (queryset.db, queryset.model._meta.db_table)
+
+
+def _get_lookups(content_type_id, item_codes):
+    # yield the lookups retreiving, in batches, the bookmarks of
+    # *item_codes* from a source (see *_get_sources*)
+    object_ids = {}
+    for item in item_codes:
+        item_content_type_id, object_id = _decode(item)
+        if content_type_id in (None, item_content_type_id):
+            object_ids.setdefault(item_content_type_id, []).append(object_id)
+    for item_content_type_id, ids in sorted(object_ids.items()):
+        for i in range(0, len(ids), LOOKUP_BATCH_SIZE):
+            batch = ids[i:i + LOOKUP_BATCH_SIZE]
+            if content_type_id is None:
+                yield {'content_type_id': item_content_type_id,
+                    'object_id__in': batch}
+            else:
+                yield {'content_object_id__in': batch}
+
+
+def _filter_users(queryset, users):
+    # return the querysets retreiving, in batches, the bookmarks of
+    # *users* (all the users if None)
+    if users is None:
+        return [queryset]
+    users = sorted(users)
+    return [queryset.filter(user_id__in=users[i:i + LOOKUP_BATCH_SIZE])
+        for i in range(0, len(users), LOOKUP_BATCH_SIZE)]
+
+
+def _iter_chunks(queryset, fields, chunk_size):
+    # keyset pagination on the primary key
+    queryset = queryset.order_by('pk').values_list('pk', 'user_id', *fields)
+    rows = list(queryset[:chunk_size])
+    while rows:
+        yield rows
+        rows = list(queryset.filter(pk__gt=rows[-1][0])[:chunk_size])
+
+
+def load(backend, keys=None, chunk_size=None, users=None):
+    """
+    Return two arrays containing the user ids and the item codes
+    (see *_decode*) of all the bookmarks saved using *keys* (all the keys
+    if empty) by *users* (all the users if None), retreived in chunks of
+    *chunk_size* rows.
+    """
+    import numpy as np
+    chunk_size = chunk_size or settings.RECOMMENDATIONS['BATCH_SIZE']
+    user_ids, items = [], []
+
+    def append(array, content_type_ids, object_ids):
+        valid = _is_valid(object_ids)
+        user_ids.append(array[valid, 0])
+        items.append(_encode(content_type_ids[valid], object_ids[valid]))
+
+    if not hasattr(backend, 'get_models'):
+        # backends not storing bookmarks using Django models
+        rows = [(i.user_id, i.content_type_id, i.object_id)
+            for i in backend.filter() if (not keys or i.key in keys) and
+            (users is None or i.user_id in users) and
+            isinstance(i.object_id, six.integer_types) and
+            0 <= i.object_id < 1 << OBJECT_ID_BITS]
+        if rows:
+            array = np.array(rows, dtype=np.int64)
+            append(array, array[:, 1], array[:, 2])
+    else:
+        for source, fields, content_type_id in _get_sources(backend, keys):
+            for queryset in _filter_users(source, users):
+                for rows in _iter_chunks(queryset, fields, chunk_size):
+                    # the primary key is not needed
+                    array = np.array(rows, dtype=np.int64)[:, 1:]
+                    if content_type_id is None:
+                        append(array, array[:, 1], array[:, 2])
+                    else:
+                        append(array, np.full(len(array), content_type_id,
+                            np.int64), array[:, 1])
+    if not user_ids:
+        return np.zeros(0, np.int64), np.zeros(0, np.int64)
+    return np.concatenate(user_ids), np.concatenate(items)
+
+
+def get_watermarks(backend):
+    """
+    Return a dict mapping the tables storing bookmarks to their greatest
+    primary key.
+    """
+    watermarks = {}
+    for queryset, fields, content_type_id in _get_sources(backend):
+        last_pk = queryset.aggregate(last_pk=Max('pk'))['last_pk']
+        if last_pk is not None:
+            watermarks[_get_source_name(queryset)] = last_pk
+    return watermarks
+
+
+def _get_stored_watermarks():
+    return dict(models.BookmarkWatermark.objects.values_list(
+        'source', 'last_pk'))
+
+
+def _store_watermarks(watermarks):
+    manager = models.BookmarkWatermark.objects
+    for source, last_pk in watermarks.items():
+        if not manager.filter(source=source).update(last_pk=last_pk):
+            manager.create(source=source, last_pk=last_pk)
+
+
+def get_recent_users(backend, since, keys=None, watermarks=None):
+    """
+    Return the ids of the users who saved bookmarks after the last
+    refresh. Bookmarks stored using Django models are new if their primary
+    key is greater than the one stored by the last refresh, and not
+    greater than the one in *watermarks* (see *get_watermarks*), if given;
+    the creation date of other bookmarks is compared with *since*.
+    """
+    if not hasattr(backend, 'get_models'):
+        return set(i.user_id for i in backend.filter()
+            if i.created_at > since and (not keys or i.key in keys))
+    stored = _get_stored_watermarks()
+    users = set()
+    for queryset, fields, content_type_id in _get_sources(backend, keys):
+        name = _get_source_name(queryset)
+        if name in stored:
+            queryset = queryset.filter(pk__gt=stored[name])
+        if watermarks is not None:
+            if name not in watermarks:
+                continue
+            queryset = queryset.filter(pk__lte=watermarks[name])
+        users.update(queryset.order_by().values_list(
+            'user_id', flat=True).distinct())
+    return users
+
+
+def _get_users_of(backend, keys, item_codes):
+    # return the ids of the users who bookmarked *item_codes*
+    users = set()
+    for queryset, fields, content_type_id in _get_sources(backend, keys):
+        for lookups in _get_lookups(content_type_id, item_codes):
+            users.update(queryset.filter(**lookups).order_by().values_list(
+                'user_id', flat=True).distinct())
+    return users
+
+
+def _count_users(backend, keys, item_codes):
+    # return an array containing the number of users who bookmarked
+    # each of *item_codes* (sorted)
+    import numpy as np
+    counts = np.zeros(len(item_codes))
+    for queryset, fields, content_type_id in _get_sources(backend, keys):
+        for lookups in _get_lookups(content_type_id, item_codes):
+            values = queryset.filter(**lookups).order_by().values(
+                *fields).annotate(count=Count('user', distinct=True))
+            for row in values:
+                if content_type_id is None:
+                    item = _encode(row['content_type_id'], row['object_id'])
+                else:
+                    item = _encode(content_type_id, row['content_object_id'])
+                counts[np.searchsorted(item_codes, item)] += row['count']
+    return counts
+
+
+def _get_pointing(item_codes):
+    # return the codes of the objects whose stored neighbours include
+    # *item_codes*: their scores change when the objects are bookmarked
+    object_ids = {}
+    for item in item_codes:
+        content_type_id, object_id = _decode(item)
+        object_ids.setdefault(content_type_id, []).append(object_id)
+    pointing = set()
+    manager = models.BookmarkNeighbour.objects
+    for content_type_id, ids in object_ids.items():
+        for i in range(0, len(ids), LOOKUP_BATCH_SIZE):
+            pointing.update(_encode(c, o) for c, o in manager.filter(
+                neighbour_content_type_id=content_type_id,
+                neighbour_object_id__in=ids[i:i + LOOKUP_BATCH_SIZE]
+            ).values_list('content_type_id', 'object_id').distinct())
+    return pointing
+
+
+def build_matrix(users, items):
+    """
+    Return a binary *users x items* CSR matrix, and the arrays mapping
+    its rows to user ids and its columns to item codes.
+    """
+    import numpy as np
+    from scipy import sparse
+    user_ids, rows = np.unique(users, return_inverse=True)
+    item_codes, columns = np.unique(items, return_inverse=True)
+    matrix = sparse.csr_matrix((np.ones(len(items)), (rows, columns)),
+        shape=(len(user_ids), len(item_codes)))
+    # an object bookmarked using several keys counts once
+    matrix.sum_duplicates()
+    matrix.data[:] = 1
+    return matrix, user_ids, item_codes
+
+
+def compute_neighbours(matrix, columns, neighbours, batch_size,
+        counts=None):
+    """
+    Yield, for each column index in *columns*, a tuple *(column,
+    neighbour_columns, scores)* containing the *neighbours* most similar
+    columns of *matrix*, best first.
+
+    Co-occurrences are computed for *batch_size* columns at once. If
+    *matrix* only contains some users, *counts* is the array of the
+    number of users who bookmarked the object of each column.
+    """
+    import numpy as np
+    if counts is None:
+        counts = np.asarray(matrix.sum(axis=0)).ravel()
+    transposed = matrix.T.tocsr()
+    for start in range(0, len(columns), batch_size):
+        batch = columns[start:start + batch_size]
+        cooccurrences = transposed[batch].dot(matrix).tocsr()
+        for row, column in enumerate(batch):
+            begin, end = cooccurrences.indptr[row:row + 2]
+            others = cooccurrences.indices[begin:end]
+            values = cooccurrences.data[begin:end]
+            mask = others != column
+            others, values = others[mask], values[mask]
+            scores = values / np.sqrt(counts[column] * counts[others])
+            if len(scores) > neighbours:
+                top = np.argpartition(-scores, neighbours)[:neighbours]
+                others, scores = others[top], scores[top]
+            order = np.argsort(-scores, kind='mergesort')
+            yield column, others[order], scores[order]
+
+
+def _delete(item_codes):
+    object_ids = {}
+    for item in item_codes:
+        content_type_id, object_id = _decode(item)
+        object_ids.setdefault(content_type_id, []).append(object_id)
+    manager = models.BookmarkNeighbour.objects
+    for content_type_id, ids in object_ids.items():
+        for i in range(0, len(ids), LOOKUP_BATCH_SIZE):
+            manager.filter(content_type_id=content_type_id,
+                object_id__in=ids[i:i + LOOKUP_BATCH_SIZE]).delete()
+
+
+def store(results, item_codes, updated_until, batch_size):
+    """
+    Replace the stored neighbours of the objects in *results* (as yielded
+    by *compute_neighbours*), in transactions of *batch_size* objects.
+    Return the number of updated objects.
+    """
+    updated = 0
+    batch, neighbours = [], []
+    for column, others, scores in results:
+        batch.append(item_codes[column])
+        content_type_id, object_id = _decode(item_codes[column])
+        for other, score in zip(others, scores):
+            neighbour_content_type_id, neighbour_object_id = _decode(
+                item_codes[other])
+            neighbours.append(models.BookmarkNeighbour(
+                content_type_id=content_type_id, object_id=object_id,
+                neighbour_content_type_id=neighbour_content_type_id,
+                neighbour_object_id=neighbour_object_id,
+                score=float(score), updated_until=updated_until))
+        if len(batch) >= batch_size:
+            updated += _store_batch(batch, neighbours)
+            batch, neighbours = [], []
+    if batch:
+        updated += _store_batch(batch, neighbours)
+    return updated
+
+
+def _store_batch(batch, neighbours):
+    with transaction.atomic():
+        _delete(batch)
+        models.BookmarkNeighbour.objects.bulk_create(neighbours)
+    return len(batch)
+
+
+def get_updated_until():
+    """
+    Return the datetime of the last refresh, or None.
+    """
+    return models.BookmarkNeighbour.objects.aggregate(
+        updated_until=Max('updated_until'))['updated_until']
+
+
+def refresh(backend=None, full=False, keys=None, neighbours=None,
+        batch_size=None):
+    """
+    Refresh the neighbours of bookmarked objects and return the number of
+    updated objects.
+
+    If *full* is False and the index is not empty, only the objects
+    bookmarked by the users who saved bookmarks after the last refresh,
+    and the objects whose neighbours include them, are updated. Only
+    bookmarks saved using *keys* are considered (all the keys if empty).
+    """
+    import numpy as np
+    if backend is None:
+        from bookmarks.handlers import library
+        backend = library.backend
+    options = settings.RECOMMENDATIONS
+    keys = keys if keys is not None else options['KEYS']
+    neighbours = neighbours or options['NEIGHBOURS']
+    batch_size = batch_size or options['BATCH_SIZE']
+    since = None if full else get_updated_until()
+    # bookmarks created from now on are handled by the next refresh
+    updated_until = timezone.now()
+    is_model_backend = hasattr(backend, 'get_models')
+    watermarks = get_watermarks(backend) if is_model_backend else None
+    counts = None
+    if since is None or not is_model_backend:
+        users, items = load(backend, keys=keys, chunk_size=batch_size)
+        targets = None
+        if since is not None:
+            recent = get_recent_users(backend, since, keys)
+            targets = _get_targets(users, items, recent)
+    else:
+        # only the bookmarks of the users who bookmarked the updated
+        # objects are loaded
+        recent = get_recent_users(backend, since, keys, watermarks)
+        users, items = load(backend, keys=keys, chunk_size=batch_size,
+            users=recent)
+        targets = _get_targets(users, items, recent)
+        users, items = load(backend, keys=keys, chunk_size=batch_size,
+            users=_get_users_of(backend, keys, targets))
+    updated = 0
+    if len(items):
+        matrix, user_ids, item_codes = build_matrix(users, items)
+        if targets is None:
+            columns = np.arange(len(item_codes))
+        else:
+            # objects no longer bookmarked are removed by a full rebuild
+            columns = np.searchsorted(item_codes, targets)
+            columns = columns[(columns < len(item_codes)) & (
+                item_codes[np.minimum(columns, len(item_codes) - 1)] ==
+                targets)]
+            if is_model_backend:
+                counts = _count_users(backend, keys, item_codes)
+        results = compute_neighbours(matrix, columns, neighbours, batch_size,
+            counts=counts)
+        updated = store(results, item_codes, updated_until, batch_size)
+    if full:
+        # neighbours of objects no longer bookmarked
+        models.BookmarkNeighbour.objects.filter(
+            updated_until__lt=updated_until).delete()
+    if watermarks is not None:
+        _store_watermarks(watermarks)
+    return updated
+
+
+def _get_targets(users, items, recent):
+    # return the sorted array of the codes of the objects bookmarked by
+    # the *recent* users, and of the objects related to them
+    import numpy as np
+    recent = np.array(sorted(recent), dtype=np.int64)
+    objects = set(int(i) for i in np.unique(items[np.isin(users, recent)]))
+    objects.update(_get_pointing(objects))
+    return np.array(sorted(objects), dtype=np.int64)
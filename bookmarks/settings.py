@@ -1,5 +1,15 @@
 from django.conf import settings
 
+
+def _get_options(name, defaults):
+    """
+    Return the *defaults* updated with the options given in the Django
+    setting *name*, so that the setting can override only some of them.
+    """
+    options = dict(defaults)
+    options.update(getattr(settings, name, {}))
+    return options
+
 # default bookmark model (if None, *bookmarks.backends.ModelBackend* is used)
 # to use MongoDB backend you can just write::
 # GENERIC_BOOKMARKS_BACKEND = 'bookmarks.backends.MongoBackend'
@@ -17,6 +27,35 @@ NEXT_QUERYSTRING_KEY = getattr(settings,
 CAN_REMOVE_BOOKMARKS = getattr(settings,
     'GENERIC_BOOKMARKS_CAN_REMOVE_BOOKMARKS', True)
 
+# database aliases used by the model backend to read bookmarks, e.g.::
+# GENERIC_BOOKMARKS_READ_DATABASES = ['replica1', 'replica2']
+# if empty, Django routers are used for both reads and writes
+READ_DATABASES = getattr(settings, 'GENERIC_BOOKMARKS_READ_DATABASES', [])
+
+# database alias used by the model backend to write bookmarks
+# (only used if GENERIC_BOOKMARKS_READ_DATABASES is not empty)
+WRITE_DATABASE = getattr(settings, 'GENERIC_BOOKMARKS_WRITE_DATABASE',
+    'default')
+
+# number of seconds a user reads bookmarks from the write database
+# after adding or removing a bookmark
+READ_YOUR_WRITES_TIMEOUT = getattr(settings,
+    'GENERIC_BOOKMARKS_READ_YOUR_WRITES_TIMEOUT', 10)
+
+# database aliases used by *bookmarks.backends.ShardedModelBackend*
+# to partition bookmarks by user, e.g.::
+# GENERIC_BOOKMARKS_SHARDS = ['bookmarks1', 'bookmarks2', 'bookmarks3']
+SHARDS = getattr(settings, 'GENERIC_BOOKMARKS_SHARDS', [])
+
+# codes of bookmark keys stored by bookmark models, e.g.::
+# GENERIC_BOOKMARKS_KEY_CODES = {'main': 1, 'favourites': 2}
+# if empty, codes are registered in the *BookmarkKey* table
+KEY_CODES = getattr(settings, 'GENERIC_BOOKMARKS_KEY_CODES', {})
+
+# set to True if bookmarks of deleted objects are removed by database
+# triggers (see *bookmarks.triggers*) instead of a *pre_delete* receiver
+DB_CASCADE = getattr(settings, 'GENERIC_BOOKMARKS_DB_CASCADE', False)
+
 # mongodb backend connection parameters
 # if the instance of MongoDB is executed in localhost without authentication
 # you can just write::
@@ -27,3 +66,107 @@ MONGODB = getattr(settings, "GENERIC_BOOKMARKS_MONGODB", {
     'PASSWORD': '',
     'PARAMETERS': {},
 })
+
+# redis backend connection parameters and prefix of the keys used to store
+# bookmarks, e.g. to use a Redis instance executed in localhost::
+# GENERIC_BOOKMARKS_REDIS = {'PARAMETERS': {'host': 'localhost', 'db': 0}}
+REDIS = getattr(settings, 'GENERIC_BOOKMARKS_REDIS', {
+    'PREFIX': 'bookmarks',
+    'PARAMETERS': {},
+})
+
+# write-behind options used by *bookmarks.backends.BufferedModelBackend*:
+# pending operations are written to the database by a background thread
+# every FLUSH_INTERVAL seconds (None to disable the thread and flush
+# manually) in batches of BATCH_SIZE bookmarks
+BUFFER = getattr(settings, 'GENERIC_BOOKMARKS_BUFFER', {
+    'FLUSH_INTERVAL': 1.0,
+    'BATCH_SIZE': 500,
+})
+
+# archival of old bookmarks: bookmarks older than AFTER_DAYS days are
+# moved to the archive table in batches of BATCH_SIZE bookmarks by the
+# *bookmarks_archive* management command; if ENABLED, the model backend
+# looks up the archive when bookmarks are not found in the main table
+ARCHIVE = getattr(settings, 'GENERIC_BOOKMARKS_ARCHIVE', {
+    'ENABLED': False,
+    'AFTER_DAYS': 365,
+    'BATCH_SIZE': 1000,
+})
+
+# number of threads used to run backend operations from coroutines
+# when the backend does not provide a native asynchronous implementation
+ASYNC_WORKERS = getattr(settings, 'GENERIC_BOOKMARKS_ASYNC_WORKERS', 4)
+
+# number of bookmarks retreived by each query when exporting bookmarks
+# (see *bookmarks.export*)
+EXPORT_CHUNK_SIZE = getattr(settings, 'GENERIC_BOOKMARKS_EXPORT_CHUNK_SIZE',
+    500)
+
+# number of rows processed at once when importing bookmarks
+# (see *bookmarks.importer*)
+IMPORT_CHUNK_SIZE = getattr(settings, 'GENERIC_BOOKMARKS_IMPORT_CHUNK_SIZE',
+    1000)
+
+# per-user summaries of bookmarks (see *bookmarks.summaries*): if ENABLED,
+# summaries are updated when bookmarks are added or removed; RECENT is the
+# number of recent bookmarks included, and summaries are cached for
+# CACHE_TIMEOUT seconds
+SUMMARIES = _get_options('GENERIC_BOOKMARKS_SUMMARIES', {
+    'ENABLED': False,
+    'RECENT': 10,
+    'CACHE_TIMEOUT': 86400,
+})
+
+# related content recommendations (see *bookmarks.recommendations*):
+# the NEIGHBOURS most related objects are stored for each object, computed
+# using bookmarks saved with KEYS (all the keys if empty) in batches of
+# BATCH_SIZE bookmarks and objects
+RECOMMENDATIONS = _get_options('GENERIC_BOOKMARKS_RECOMMENDATIONS', {
+    'NEIGHBOURS': 10,
+    'KEYS': [],
+    'BATCH_SIZE': 1000,
+})
+
+# trending objects (see *bookmarks.trending*): if ENABLED, scores are
+# updated when bookmarks are added or removed; the weight of a bookmark
+# halves every HALF_LIFE seconds, and scores are recomputed in batches of
+# BATCH_SIZE bookmarks
+TRENDING = _get_options('GENERIC_BOOKMARKS_TRENDING', {
+    'ENABLED': False,
+    'HALF_LIFE': 7 * 24 * 3600,
+    'BATCH_SIZE': 1000,
+})
+
+# Bloom filters of the bookmarks of each user (see *bookmarks.bloom*): if
+# ENABLED, existence checks of bookmarks not contained in the filter of the
+# user do not query the backend; filters have a false positive rate of
+# ERROR_RATE, room for at least MIN_CAPACITY bookmarks, and are cached
+# for TIMEOUT seconds
+BLOOM = _get_options('GENERIC_BOOKMARKS_BLOOM', {
+    'ENABLED': False,
+    'ERROR_RATE': 0.01,
+    'MIN_CAPACITY': 64,
+    'TIMEOUT': 3600,
+})
+
+# in-memory indexes of the bookmarks of each user (see *bookmarks.index*):
+# if ENABLED, existence checks are answered using the index of the user;
+# indexes are kept for the current request (SCOPE = 'request', requires
+# *bookmarks.index.IndexMiddleware*) or shared by the threads of the
+# process (SCOPE = 'process'), for at most MAX_USERS users and TIMEOUT
+# seconds
+INDEX = _get_options('GENERIC_BOOKMARKS_INDEX', {
+    'ENABLED': False,
+    'SCOPE': 'request',
+    'MAX_USERS': 100,
+    'TIMEOUT': 10,
+})
+
+# instrumentation of backend operations, views and templatetags
+# (see *bookmarks.instrumentation*): if ENABLED, timing, query counts
+# and cache hits are sent to SINKS (callables or dotted paths)
+INSTRUMENTATION = _get_options('GENERIC_BOOKMARKS_INSTRUMENTATION', {
+    'ENABLED': False,
+    'SINKS': ['bookmarks.instrumentation.log_sink'],
+})
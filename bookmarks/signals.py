@@ -4,3 +4,7 @@ from django.dispatch import Signal
 bookmark_pre_save = Signal(providing_args=['form', 'request'])
 # fired after a bookmark is added or removed
 bookmark_post_save = Signal(providing_args=['bookmark', 'request', 'created'])
+# fired for each measurement if instrumentation is enabled and
+# *bookmarks.instrumentation.signal_sink* is used
+bookmark_measured = Signal(providing_args=['name', 'seconds', 'queries',
+    'hit'])
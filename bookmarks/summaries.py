@@ -0,0 +1,367 @@
+"""
+Per-user summaries of bookmarks.
+
+A summary contains the number of bookmarks saved by a user for each key
+and content type, and the most recent bookmarks of the user, so that a
+profile page (e.g. "42 favourites, 7 read-later, latest 5 items") can be
+rendered with a single cache lookup instead of several queries over the
+bookmarks table.
+
+If *settings.GENERIC_BOOKMARKS_SUMMARIES['ENABLED']* is True, the backend
+is wrapped by *SummarizedBackend*, updating the summaries incrementally
+when bookmarks are added or removed. Summaries are stored in the
+*BookmarkSummary* table and in the Django cache: a missing summary is
+built from the backend the first time it is requested, e.g.::
+
+    from bookmarks import summaries
+
+    summary = summaries.get_summary(user)
+    summary.count(key='favourite')
+    summary.count(model=Article)
+    summary.get_recent(limit=5)
+
+Summaries can be rebuilt using the *bookmarks_summaries* management
+command. Note that bookmarks removed by database triggers (see
+*bookmarks.triggers*) are not reflected in summaries until they are
+rebuilt.
+"""
+import json
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.utils import six
+
+from bookmarks import settings, models, utils, keys, export, instrumentation
+
+try:
+    from bookmarks.aio import AsyncBackendMixin
+except SyntaxError:
+    # the asynchronous API requires Python >= 3.5
+    AsyncBackendMixin = object
+
+
+def _get_user_id(user):
+    return getattr(user, 'pk', user)
+
+
+def _get_object_id(pk):
+    # string bookmarks store non-integer primary keys as text
+    if isinstance(pk, six.integer_types):
+        return pk
+    return six.text_type(pk)
+
+
+def _get_content_type_id(bookmark):
+    # generic bookmarks store the content type id, dedicated ones
+    # only provide the content type
+    content_type_id = getattr(bookmark, 'content_type_id', None)
+    if content_type_id is None:
+        content_type_id = bookmark.content_type.pk
+    return content_type_id
+
+
+def get_cache_key(user):
+    return 'bookmarks:summary:%s' % _get_user_id(user)
+
+
+class Summary(object):
+    """
+    Bookmarks saved by a user.
+
+    .. py:attribute:: counts
+
+        a dict mapping *(key, content_type_id)* tuples to the number
+        of bookmarks
+
+    .. py:attribute:: recent
+
+        a list of *(content_type_id, object_id, key)* tuples, at most
+        *settings.GENERIC_BOOKMARKS_SUMMARIES['RECENT']*, describing the
+        most recent bookmarks (newest first)
+    """
+    def __init__(self, counts=None, recent=None):
+        self.counts = counts or {}
+        self.recent = recent or []
+
+    @classmethod
+    def from_json(cls, data):
+        data = json.loads(data)
+        counts = dict(((key, content_type_id), count)
+            for key, content_type_id, count in data['counts'])
+        return cls(counts, [tuple(i) for i in data['recent']])
+
+    def to_json(self):
+        return json.dumps({
+            'counts': sorted([key, content_type_id, count]
+                for (key, content_type_id), count in self.counts.items()),
+            'recent': [list(i) for i in self.recent],
+        })
+
+    @property
+    def total(self):
+        return sum(self.counts.values())
+
+    @property
+    def keys(self):
+        """
+        A dict mapping keys to the number of bookmarks, e.g. to be used
+        in templates as *summary.keys.favourite*.
+        """
+        counts = {}
+        for (key, content_type_id), count in self.counts.items():
+            counts[key] = counts.get(key, 0) + count
+        return counts
+
+    def count(self, key=None, model=None):
+        """
+        Return the number of bookmarks using *key* and/or of *model*
+        instances (all the bookmarks if both are None).
+        """
+        content_type_id = None
+        if model is not None:
+            content_type_id = utils.get_content_type_for_model(model).pk
+        return sum(count for (k, c), count in self.counts.items()
+            if key in (None, k) and content_type_id in (None, c))
+
+    def get_recent(self, key=None, model=None, limit=None):
+        """
+        Return the *(content_type_id, object_id, key)* tuples of the most
+        recent bookmarks using *key* and/or of *model* instances.
+        """
+        content_type_id = None
+        if model is not None:
+            content_type_id = utils.get_content_type_for_model(model).pk
+        recent = [i for i in self.recent
+            if key in (None, i[2]) and content_type_id in (None, i[0])]
+        return recent[:limit]
+
+    def get_recent_objects(self, key=None, model=None, limit=None):
+        """
+        Return the most recently bookmarked objects, retreived using
+        a query for each content type. Deleted objects are skipped.
+        """
+        recent = self.get_recent(key=key, model=model, limit=limit)
+        object_ids = {}
+        for content_type_id, object_id, _ in recent:
+            object_ids.setdefault(content_type_id, set()).add(object_id)
+        objects = {}
+        for content_type_id, ids in object_ids.items():
+            model_class = ContentType.objects.get_for_id(
+                content_type_id).model_class()
+            for obj in model_class._default_manager.filter(pk__in=ids):
+                objects[content_type_id, _get_object_id(obj.pk)] = obj
+        return [objects[i[:2]] for i in recent if i[:2] in objects]
+
+    def recent_objects(self):
+        # callable without arguments, to be used in templates
+        return self.get_recent_objects()
+
+    def add(self, content_type_id, object_id, key):
+        identity = (key, content_type_id)
+        self.counts[identity] = self.counts.get(identity, 0) + 1
+        self.recent.insert(0, (content_type_id, object_id, key))
+        del self.recent[settings.SUMMARIES['RECENT']:]
+
+    def remove(self, content_type_id, object_id, key):
+        """
+        Remove a bookmark from the summary. Return False if the summary
+        must be rebuilt, i.e. if a recent bookmark is removed and older
+        ones may take its place.
+        """
+        identity = (key, content_type_id)
+        count = self.counts.get(identity, 0) - 1
+        if count > 0:
+            self.counts[identity] = count
+        else:
+            self.counts.pop(identity, None)
+        bookmark = (content_type_id, object_id, key)
+        if bookmark not in self.recent:
+            return True
+        self.recent.remove(bookmark)
+        return self.total == len(self.recent)
+
+
+def _iter_bookmarks(backend, user):
+    # yield (content_type_id, object_id, key, created_at) tuples for the
+    # bookmarks saved by *user*, without retreiving content objects
+    # if bookmarks are stored using Django models
+    if not hasattr(backend, 'get_models'):
+        for bookmark in backend.filter(user=user):
+            yield (_get_content_type_id(bookmark),
+                _get_object_id(bookmark.object_id), bookmark.key,
+                bookmark.created_at)
+        return
+    for queryset in export.get_querysets(backend, user=user):
+        bookmark_model = queryset.model
+        if issubclass(bookmark_model, models.DedicatedBookmark):
+            content_type_id = utils.get_content_type_for_model(
+                bookmark_model._meta.get_field('content_object').rel.to).pk
+            values = queryset.values_list('content_object_id', 'key',
+                'created_at')
+            for object_id, code, created_at in values.iterator():
+                yield (content_type_id, object_id, keys.get_name(code),
+                    created_at)
+        else:
+            values = queryset.values_list('content_type_id', 'object_id',
+                'key', 'created_at')
+            for content_type_id, object_id, code, created_at in (
+                    values.iterator()):
+                yield (content_type_id, object_id, keys.get_name(code),
+                    created_at)
+
+
+def build(user, backend):
+    """
+    Return the *Summary* of bookmarks saved by *user*, built
+    using *backend*. Buffered operations are flushed first.
+    """
+    export.flush(backend)
+    counts = {}
+    latest = []
+    for content_type_id, object_id, key, created_at in _iter_bookmarks(
+            backend, user):
+        identity = (key, content_type_id)
+        counts[identity] = counts.get(identity, 0) + 1
+        latest.append((created_at, (content_type_id, object_id, key)))
+    latest.sort(key=lambda i: i[0], reverse=True)
+    recent = [i[1] for i in latest[:settings.SUMMARIES['RECENT']]]
+    return Summary(counts, recent)
+
+
+def _store(user_id, summary):
+    model = models.BookmarkSummary
+    data = summary.to_json()
+    if not model.objects.filter(user_id=user_id).update(data=data):
+        try:
+            with transaction.atomic():
+                model.objects.create(user_id=user_id, data=data)
+        except IntegrityError:
+            # created concurrently
+            model.objects.filter(user_id=user_id).update(data=data)
+    cache.set(get_cache_key(user_id), data,
+        settings.SUMMARIES['CACHE_TIMEOUT'])
+
+
+def rebuild(user, backend=None):
+    """
+    Build, store and return the *Summary* of bookmarks saved by *user*.
+    """
+    if backend is None:
+        from bookmarks.handlers import library
+        backend = library.backend
+    user_id = _get_user_id(user)
+    with transaction.atomic():
+        # bookmarks added or removed while the summary is built are
+        # recorded after it is stored (see *_update*)
+        list(models.BookmarkSummary.objects.select_for_update().filter(
+            user_id=user_id).values_list('pk', flat=True))
+        summary = build(user_id, backend)
+        _store(user_id, summary)
+    return summary
+
+
+def get_summary(user, backend=None):
+    """
+    Return the *Summary* of bookmarks saved by *user*, looking up
+    the cache, then the database, and building it if missing.
+    """
+    user_id = _get_user_id(user)
+    data = cache.get(get_cache_key(user_id))
+    instrumentation.record_cache('summaries', data is not None)
+    if data is not None:
+        return Summary.from_json(data)
+    try:
+        data = models.BookmarkSummary.objects.values_list(
+            'data', flat=True).get(user_id=user_id)
+    except models.BookmarkSummary.DoesNotExist:
+        return rebuild(user_id, backend)
+    cache.set(get_cache_key(user_id), data,
+        settings.SUMMARIES['CACHE_TIMEOUT'])
+    return Summary.from_json(data)
+
+
+def invalidate(users):
+    """
+    Delete the stored summaries of *users*: they are built again
+    the next time they are requested.
+    """
+    user_ids = set(_get_user_id(i) for i in users)
+    if user_ids:
+        models.BookmarkSummary.objects.filter(user_id__in=user_ids).delete()
+        cache.delete_many([get_cache_key(i) for i in user_ids])
+
+
+def _update(user, instance, key, backend, method, change=None):
+    # apply *method* to the stored summary of *user*, locking its row;
+    # *change*, if given, adds or removes the bookmark while the row
+    # is locked, so that a concurrent rebuild cannot record it twice
+    user_id = _get_user_id(user)
+    model = models.BookmarkSummary
+    with transaction.atomic():
+        try:
+            data = model.objects.select_for_update().values_list(
+                'data', flat=True).get(user_id=user_id)
+        except model.DoesNotExist:
+            data = None
+        result = None if change is None else change()
+        if data is None:
+            # the summary is built when requested
+            cache.delete(get_cache_key(user_id))
+            return result
+        summary = Summary.from_json(data)
+        content_type_id = utils.get_content_type_for_model(type(instance)).pk
+        if getattr(summary, method)(content_type_id,
+                _get_object_id(instance.pk), key) is False:
+            summary = build(user_id, backend)
+        _store(user_id, summary)
+    return result
+
+
+def record_add(user, instance, key, backend):
+    """
+    Update the summary of *user* after a bookmark is added.
+    """
+    _update(user, instance, key, backend, 'add')
+
+
+def record_remove(user, instance, key, backend):
+    """
+    Update the summary of *user* after a bookmark is removed.
+    """
+    _update(user, instance, key, backend, 'remove')
+
+
+class SummarizedBackend(AsyncBackendMixin):
+    """
+    Wrap a bookmarks *backend*, keeping the summaries of users up to date.
+    Other attributes are delegated to the backend.
+
+    Coroutine methods run the wrapped synchronous methods in the bookmarks
+    thread pool (see *bookmarks.aio*).
+    """
+    def __init__(self, backend):
+        self.backend = backend
+
+    def add(self, user, instance, key):
+        return _update(user, instance, key, self.backend, 'add',
+            lambda: self.backend.add(user, instance, key))
+
+    def remove(self, user, instance, key):
+        return _update(user, instance, key, self.backend, 'remove',
+            lambda: self.backend.remove(user, instance, key))
+
+    def remove_all_for(self, instance):
+        users = set(i.user_id for i in self.backend.filter(instance=instance))
+        self.backend.remove_all_for(instance)
+        invalidate(users)
+
+    def bulk_add(self, bookmarks):
+        bookmarks = list(bookmarks)
+        added = self.backend.bulk_add(bookmarks)
+        if added:
+            invalidate(i[0] for i in bookmarks)
+        return added
+
+    def __getattr__(self, attr):
+        return getattr(self.backend, attr)
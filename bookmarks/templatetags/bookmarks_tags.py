@@ -1,3 +1,4 @@
+import copy
 import re
 
 from django import template
@@ -6,8 +7,11 @@ from django.contrib.auth import REDIRECT_FIELD_NAME
 from django.core.urlresolvers import reverse
 from django import http
 from django.db.models import get_model
+from django.utils.html import conditional_escape
 
-from bookmarks import handlers, utils, exceptions
+from bookmarks import (handlers, instrumentation, summaries, utils,
+    exceptions, deferred)
+from bookmarks.models import BookmarkNeighbour
 
 register = template.Library()
 
@@ -78,11 +82,16 @@ def bookmark(parser, token):
         - the user is not authenticated
         - the instance is not bookmarkable
         - the bookmark does not exist
+
+    If *bookmarks.deferred.DeferredBookmarksMiddleware* is installed,
+    the bookmarks of the current user for the model of the instance and
+    the key are retreived in bulk by the first tag.
     """
     return BookmarkNode(**_parse_args(parser, token, BOOKMARK_EXPRESSION))
 
 
 class BookmarkNode(BaseNode):
+    @instrumentation.instrumented('tag.bookmark')
     def render(self, context):
         # user validation
         request = context['request']
@@ -100,10 +109,16 @@ class BookmarkNode(BaseNode):
         key = handler.get_key(request, instance, self._get_key(context))
 
         # retreiving bookmark
-        try:
-            context[self.varname] = handler.get(request.user, instance, key)
-        except exceptions.DoesNotExist:
-            pass
+        collector = deferred.get_collector(request)
+        if collector is not None:
+            bookmark = collector.get_bookmark(handler.backend, instance, key)
+        else:
+            try:
+                bookmark = handler.get(request.user, instance, key)
+            except exceptions.DoesNotExist:
+                bookmark = None
+        # e.g. inside a for loop, the previous value is replaced
+        context[self.varname] = bookmark
         return u''
 
 
@@ -197,6 +212,10 @@ class BookmarkFormNode(BaseNode):
 
     template_name = 'form.html'
 
+    # if True, the form is rendered when the response is returned if
+    # *bookmarks.deferred.DeferredBookmarksMiddleware* is installed
+    deferrable = True
+
     @classmethod
     def get_template_context(cls, request, form, instance, key):
         """
@@ -211,6 +230,7 @@ class BookmarkFormNode(BaseNode):
             'next': REDIRECT_FIELD_NAME,
         }
 
+    @instrumentation.instrumented('tag.bookmark_form')
     def render(self, context):
         # user validation
         request = context['request']
@@ -236,18 +256,38 @@ class BookmarkFormNode(BaseNode):
             'key': key,
         }
         form = handler.get_form(request, data=data)
+        # the instance is not retreived again during validation
+        deferred.prime(form, instance, None)
 
         if self.varname is None:
-            # rendering the form
-            ctx = template.RequestContext(request,
-                self.get_template_context(context, form, instance, key))
-            templates = utils.get_templates(instance, key, self.template_name)
-            return template.loader.render_to_string(templates, ctx)
+            collector = deferred.get_collector(request)
+            if (self.deferrable and collector is not None and
+                    request.user.is_authenticated()):
+                # the bookmark is checked, together with the others,
+                # when the response is returned: the context is copied,
+                # since it is changed while rendering (e.g. by loops)
+                form_context = copy.copy(context)
+                form_context.dicts = [dict(i) for i in context.dicts]
+
+                def callback(exists):
+                    deferred.prime(form, instance, exists)
+                    return self._render(request, form_context, form,
+                        instance, key)
+                return collector.defer(handler.backend, instance, key,
+                    callback)
+            return self._render(request, context, form, instance, key)
         else:
             # form as template variable
             context[self.varname] = form
             return u''
 
+    def _render(self, request, context, form, instance, key):
+        # rendering the form
+        ctx = template.RequestContext(request,
+            self.get_template_context(context, form, instance, key))
+        templates = utils.get_templates(instance, key, self.template_name)
+        return template.loader.render_to_string(templates, ctx)
+
 
 AJAX_BOOKMARK_FORM_EXPRESSION = re.compile(r"""
     ^ # begin of line
@@ -276,6 +316,7 @@ def ajax_bookmark_form(parser, token):
 
 class AJAXBookmarkFormNode(BookmarkFormNode):
     template_name = 'ajax_form.html'
+    deferrable = False
 
     @classmethod
     def get_template_context(cls, request, form, instance, key):
@@ -292,6 +333,78 @@ class AJAXBookmarkFormNode(BookmarkFormNode):
         return ctx
 
 
+BOOKMARK_STATE_EXPRESSION = re.compile(r"""
+    ^ # begin of line
+    for\s+(?P<instance>[\w.]+) # instance
+    (\s+using\s+(?P<key>[\w.'"]+))? # key
+    (\s+values\s+(?P<on>"[^"]*"|'[^']*')\s+(?P<off>"[^"]*"|'[^']*'))? # values
+    $ # end of line
+""", re.VERBOSE)
+
+
+@register.tag
+def bookmark_state(parser, token):
+    """
+    Output a value if the given instance is bookmarked by the current user
+    using the given key, another value otherwise.
+
+    Usage:
+
+    .. code-block:: html+django
+
+        {% bookmark_state for *instance* [using *key*] [values *on* *off*] %}
+
+    The key can be given hardcoded (surrounded by quotes)
+    or as a template variable, and defaults to the key returned by the
+    handler's *get_key* method. The values must be given surrounded by
+    quotes, and default to "bookmarked" and "". E.g.:
+
+    .. code-block:: html+django
+
+        <li class="{% bookmark_state for article %}">{{ article }}</li>
+
+    If *bookmarks.deferred.DeferredBookmarksMiddleware* is installed,
+    all the bookmarks are checked in bulk when the response is returned.
+    """
+    args = _parse_args(parser, token, BOOKMARK_STATE_EXPRESSION)
+    on, off = args.pop('on'), args.pop('off')
+    return BookmarkStateNode(varname=None,
+        on=u'bookmarked' if on is None else on[1:-1],
+        off=u'' if off is None else off[1:-1], **args)
+
+
+class BookmarkStateNode(BaseNode):
+    def __init__(self, on, off, **kwargs):
+        super(BookmarkStateNode, self).__init__(**kwargs)
+        self.on, self.off = conditional_escape(on), conditional_escape(off)
+
+    @instrumentation.instrumented('tag.bookmark_state')
+    def render(self, context):
+        # user validation
+        request = context['request']
+        if request.user.is_anonymous():
+            return self.off
+
+        # instance and handler
+        instance = self.instance.resolve(context)
+        handler = handlers.library.get_handler(instance)
+        # handler validation
+        if handler is None:
+            return self.off
+
+        # key
+        key = handler.get_key(request, instance, self._get_key(context))
+
+        # checking bookmark
+        collector = deferred.get_collector(request)
+        if collector is not None:
+            return collector.defer(handler.backend, instance, key,
+                lambda exists: self.on if exists else self.off)
+        if handler.backend.exists(request.user, instance, key):
+            return self.on
+        return self.off
+
+
 BOOKMARKS_EXPRESSION = re.compile(r"""
     ^ # begin of line
     (of\s+(?P<model>[\w.'"]+))? # model
@@ -366,6 +479,7 @@ class BookmarksNode(template.Node):
         # varname
         self.varname = varname
 
+    @instrumentation.instrumented('tag.bookmarks')
     def render(self, context):
         # parsing arguments to build lookups
         lookups = {'reversed': self.reverse_order}
@@ -377,6 +491,8 @@ class BookmarksNode(template.Node):
         # user
         if self.user is not None:
             lookups['user'] = self.user.resolve(context)
+        else:
+            lookups['with_users'] = True
         # key
         if self.key_variable:
             lookups['key'] = self.key_variable.resolve(context)
@@ -385,3 +501,125 @@ class BookmarksNode(template.Node):
         # retreiving bookmarks
         context[self.varname] = handlers.library.backend.filter(**lookups)
         return u''
+
+
+BOOKMARK_SUMMARY_EXPRESSION = re.compile(r"""
+    ^ # begin of line
+    (for\s+(?P<user>[\w.]+)\s+)? # user
+    as\s+(?P<varname>\w+) # varname
+    $ # end of line
+""", re.VERBOSE)
+
+
+@register.tag
+def bookmark_summary(parser, token):
+    """
+    Return as a template variable the summary of bookmarks saved by
+    the given user, or by the current user (see *bookmarks.summaries*).
+
+    Usage:
+
+    .. code-block:: html+django
+
+        {% bookmark_summary [for *user*] as *varname* %}
+
+    Example:
+
+    .. code-block:: html+django
+
+        {% bookmark_summary for profile_user as summary %}
+        {{ summary.keys.favourite|default:0 }} favourites,
+        {{ summary.total }} bookmarks
+        {% for object in summary.recent_objects|slice:":5" %}
+            {{ object }}
+        {% endfor %}
+
+    The template variable will be None if the current user is not
+    authenticated and no user is given.
+    """
+    return BookmarkSummaryNode(**_parse_args(parser, token,
+        BOOKMARK_SUMMARY_EXPRESSION))
+
+
+class BookmarkSummaryNode(template.Node):
+    def __init__(self, user, varname):
+        self.user = template.Variable(user) if user else None
+        self.varname = varname
+
+    @instrumentation.instrumented('tag.bookmark_summary')
+    def render(self, context):
+        if self.user is not None:
+            user = self.user.resolve(context)
+        else:
+            user = context['request'].user
+            if user.is_anonymous():
+                context[self.varname] = None
+                return u''
+        context[self.varname] = summaries.get_summary(user,
+            handlers.library.backend)
+        return u''
+
+
+BOOKMARK_RELATED_EXPRESSION = re.compile(r"""
+    ^ # begin of line
+    for\s+(?P<instance>[\w.]+) # instance
+    (\s+limit\s+(?P<limit>[\w.]+))? # limit
+    (\s+as\s+(?P<varname>\w+))? # varname
+    $ # end of line
+""", re.VERBOSE)
+
+
+@register.tag
+def bookmark_related(parser, token):
+    """
+    Return, as html or as a template variable, the objects most often
+    bookmarked by the users who bookmarked the given instance, best first
+    (see *bookmarks.recommendations*).
+
+    Usage:
+
+    .. code-block:: html+django
+
+        {% bookmark_related for *instance* [limit *limit*] [as *varname*] %}
+
+    The limit can be given as a number or as a template variable.
+
+    If the *varname* is used then it will be a context variable
+    containing the list of objects.
+    Otherwise the objects are rendered using the first template found in
+    the order that follows::
+
+        bookmarks/[app_name]/[model_name]/related.html
+        bookmarks/[app_name]/related.html
+        bookmarks/related.html
+    """
+    return BookmarkRelatedNode(**_parse_args(parser, token,
+        BOOKMARK_RELATED_EXPRESSION))
+
+
+class BookmarkRelatedNode(template.Node):
+    def __init__(self, instance, limit, varname):
+        self.instance = template.Variable(instance)
+        self.limit = template.Variable(limit) if limit else None
+        self.varname = varname
+
+    @instrumentation.instrumented('tag.bookmark_related')
+    def render(self, context):
+        instance = self.instance.resolve(context)
+        limit = None
+        if self.limit is not None:
+            limit = int(self.limit.resolve(context))
+        objects = BookmarkNeighbour.objects.related_to(instance, limit)
+        if self.varname is not None:
+            context[self.varname] = objects
+            return u''
+        opts = instance._meta
+        templates = [
+            'bookmarks/%s/%s/related.html' % (opts.app_label,
+                opts.model_name),
+            'bookmarks/%s/related.html' % opts.app_label,
+            'bookmarks/related.html',
+        ]
+        return template.loader.render_to_string(templates,
+            {'instance': instance, 'objects': objects})
+
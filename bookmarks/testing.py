@@ -0,0 +1,75 @@
+"""
+Testing utilities.
+
+Tests can declare the maximum number of database queries performed
+by bookmark operations, e.g. rendering the bookmark templatetags
+for N objects or toggling a bookmark through the view::
+
+    from django.test import TestCase
+    from bookmarks.testing import QueryBudgetMixin
+
+    class MyTestCase(QueryBudgetMixin, TestCase):
+        def test_article_list(self):
+            with self.assertMaxQueries(3):
+                self.client.get('/articles/')
+
+When the budget is exceeded the test fails, and the failure message
+lists the executed queries.
+"""
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.test.utils import CaptureQueriesContext
+
+
+class QueryBudget(CaptureQueriesContext):
+    """
+    Context manager raising an *AssertionError* if the wrapped code
+    performs more than *budget* queries on the database *using*.
+    """
+    def __init__(self, budget, using=DEFAULT_DB_ALIAS, msg=None):
+        super(QueryBudget, self).__init__(connections[using])
+        self.budget = budget
+        self.msg = msg
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        super(QueryBudget, self).__exit__(exc_type, exc_value, traceback)
+        if exc_type is None and len(self) > self.budget:
+            queries = '\n'.join('%d. %s' % (i, query['sql'])
+                for i, query in enumerate(self.captured_queries, 1))
+            raise AssertionError('%s%d queries executed, budget is %d:\n%s' % (
+                '%s: ' % self.msg if self.msg else '', len(self),
+                self.budget, queries))
+
+
+def query_budget(budget, using=DEFAULT_DB_ALIAS, msg=None):
+    """
+    Return a *QueryBudget* context manager.
+    """
+    return QueryBudget(budget, using=using, msg=msg)
+
+
+class QueryBudgetMixin(object):
+    """
+    Mixin for test cases, providing the *assertMaxQueries* assertion.
+    """
+    def assertMaxQueries(self, budget, func=None, *args, **kwargs):
+        """
+        Fail if calling *func* with given args and kwargs performs more
+        than *budget* queries on the default database. If *func* is None,
+        return a context manager.
+
+        The database alias can only be given, as the *using* keyword
+        argument, to the context manager, so that all the kwargs are
+        passed to *func*, e.g.::
+
+            with self.assertMaxQueries(2, using='replica'):
+                ...
+        """
+        if func is not None:
+            with query_budget(budget):
+                func(*args, **kwargs)
+            return
+        # emulating a keyword-only argument on Python 2
+        using = kwargs.pop('using', DEFAULT_DB_ALIAS)
+        if args or kwargs:
+            raise TypeError('Arguments are only accepted with a callable.')
+        return query_budget(budget, using=using)
@@ -1,13 +1,38 @@
 from __future__ import print_function
 from django.utils import unittest
 
-from django.db import models
+import csv
+import datetime
+import json
+import math
+import os
+import pickle
+import tempfile
+import threading
+import uuid
+
+from django import http
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection, models, DatabaseError
+from django.db.models.signals import pre_delete
 from django.contrib.auth.models import User, AnonymousUser
+from django.contrib.contenttypes.models import ContentType
 from django.template import Template, Context
 from django.test import client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import six, timezone
 
-from bookmarks import settings, exceptions, backends, handlers, forms, views
-from bookmarks.models import annotate_bookmarks
+from bookmarks import (settings, exceptions, backends, handlers, forms, views,
+    admin, archive, keys, triggers, instrumentation, signals, loadtest,
+    export, importer, summaries, recommendations, trending, bloom, index,
+    deferred, utils)
+from bookmarks.models import (Bookmark, BookmarkArchive, BookmarkKey,
+    BookmarkNeighbour, BookmarkSummary, BookmarkWatermark, StringBookmark,
+    TrendingScore, annotate_bookmarks, create_dedicated_model)
+from bookmarks.templatetags import bookmarks_tags
+from bookmarks.testing import QueryBudgetMixin
 
 
 class RequestFactory(client.RequestFactory):
@@ -28,7 +53,32 @@ class BookmarkTestModel(models.Model):
         return unicode(self.name)
 
 
-class BookmarkTestMixin(object):
+class StringBookmarkTestModel(models.Model):
+    code = models.CharField(max_length=36, primary_key=True)
+
+    def __unicode__(self):
+        return unicode(self.code)
+
+
+if hasattr(models, 'UUIDField'):
+    class UUIDBookmarkTestModel(models.Model):
+        id = models.UUIDField(primary_key=True, default=uuid.uuid4)
+else:
+    # Django < 1.8
+    UUIDBookmarkTestModel = None
+
+
+class DedicatedTestModel(models.Model):
+    name = models.CharField(max_length=8)
+
+    def __unicode__(self):
+        return unicode(self.name)
+
+
+DedicatedTestModelBookmark = create_dedicated_model(DedicatedTestModel)
+
+
+class BookmarkTestMixin(QueryBudgetMixin):
     """
     Mixin for tests.
     """
@@ -54,12 +104,20 @@ class BookmarkTestMixin(object):
 
     def clean(self):
         BookmarkTestModel.objects.all().delete()
+        StringBookmarkTestModel.objects.all().delete()
+        DedicatedTestModel.objects.all().delete()
+        BookmarkNeighbour.objects.all().delete()
+        BookmarkWatermark.objects.all().delete()
+        TrendingScore.objects.all().delete()
         User.objects.all().delete()
 
 
 # BACKEND TESTS
 
 class BaseBackendTest(BookmarkTestMixin):
+    def assertBookmarksEqual(self, first, second):
+        self.assertEqual(first, second)
+
     def test_add_bookmark(self):
         user, instance, key = self.get_user_instance_key('add')
         bookmark = self.backend.add(user, instance, key)
@@ -116,16 +174,16 @@ class BaseBackendTest(BookmarkTestMixin):
             instance=instance1, user=user1, key=key2))
         bookmarks_model = list(self.backend.filter(model=BookmarkTestModel))
 
-        self.assertEqual(bookmarks_user1, [bookmark1, bookmark3, bookmark4])
-        self.assertEqual(bookmarks_user1_reversed,
+        self.assertBookmarksEqual(bookmarks_user1, [bookmark1, bookmark3, bookmark4])
+        self.assertBookmarksEqual(bookmarks_user1_reversed,
             [bookmark4, bookmark3, bookmark1])
-        self.assertEqual(bookmarks_user2_key2, [bookmark5])
-        self.assertEqual(bookmarks_instance1, [bookmark1, bookmark2, bookmark5])
-        self.assertEqual(bookmarks_instance1_reversed,
+        self.assertBookmarksEqual(bookmarks_user2_key2, [bookmark5])
+        self.assertBookmarksEqual(bookmarks_instance1, [bookmark1, bookmark2, bookmark5])
+        self.assertBookmarksEqual(bookmarks_instance1_reversed,
             [bookmark5, bookmark2, bookmark1])
-        self.assertEqual(bookmarks_instance2_user1, [bookmark3, bookmark4])
-        self.assertEqual(bookmarks_instance1_user2_key1, [bookmark2])
-        self.assertEqual(bookmarks_instance1_user1_key2, [])
+        self.assertBookmarksEqual(bookmarks_instance2_user1, [bookmark3, bookmark4])
+        self.assertBookmarksEqual(bookmarks_instance1_user2_key1, [bookmark2])
+        self.assertBookmarksEqual(bookmarks_instance1_user1_key2, [])
         self.assertEqual(len(bookmarks_model), 5)
 
     def test_get_bookmark(self):
@@ -138,7 +196,7 @@ class BaseBackendTest(BookmarkTestMixin):
         self.backend.add(user1, instance1, key)
         bookmark2 = self.backend.add(user2, instance1, key)
 
-        self.assertEqual(self.backend.get(user2, instance1, key), bookmark2)
+        self.assertBookmarksEqual(self.backend.get(user2, instance1, key), bookmark2)
         self.assertRaises(exceptions.DoesNotExist,
             self.backend.get, user1, instance2, key)
 
@@ -159,8 +217,16 @@ class BaseBackendTest(BookmarkTestMixin):
         bookmarks_instance1 = list(self.backend.filter(instance=instance1))
         bookmarks_instance2 = list(self.backend.filter(instance=instance2))
 
-        self.assertEqual(bookmarks_instance1, [])
-        self.assertEqual(bookmarks_instance2, [remaining])
+        self.assertBookmarksEqual(bookmarks_instance1, [])
+        self.assertBookmarksEqual(bookmarks_instance2, [remaining])
+
+    def test_exists_many(self):
+        user, instance1, key = self.get_user_instance_key('exists_many')
+        instance2 = self.create_instance('exists_many2')
+        self.backend.add(user, instance2, key)
+        self.assertEqual(self.backend.exists_many(user,
+            [instance1, instance2, instance2], key), [False, True, True])
+        self.assertEqual(self.backend.exists_many(user, [], key), [])
 
     def test_bookmark_model(self):
         user, instance, key = self.get_user_instance_key('model')
@@ -177,11 +243,253 @@ class DefaultBackendTestCase(unittest.TestCase, BaseBackendTest):
         self.clean()
 
 
+class ReadDatabasesTestCase(unittest.TestCase, BookmarkTestMixin):
+    def setUp(self):
+        self.backend = backends.ModelBackend()
+        self.backend.read_databases = ['replica']
+        self.backend.write_database = 'default'
+        self.user1, self.instance, self.key = self.get_user_instance_key(
+            'replica')
+        self.user2 = self.create_user('replica2')
+
+    def tearDown(self):
+        cache.delete_many([self.backend._get_pin_key(self.user1),
+            self.backend._get_pin_key(self.user2)])
+        self.clean()
+
+    def test_db_for_read(self):
+        self.assertEqual(self.backend.db_for_read(), 'replica')
+        self.assertEqual(self.backend.db_for_read(self.user1), 'replica')
+        self.assertEqual(self.backend.db_for_write(), 'default')
+
+    def test_read_your_writes(self):
+        self.backend.add(self.user1, self.instance, self.key)
+        self.assertEqual(self.backend.db_for_read(self.user1), 'default')
+        self.assertEqual(self.backend.db_for_read(self.user1.pk), 'default')
+        self.assertEqual(self.backend.db_for_read(self.user2), 'replica')
+        # the pinned user reads bookmarks from the write database
+        self.assertTrue(self.backend.exists(self.user1, self.instance,
+            self.key))
+
+    def test_no_read_databases(self):
+        self.backend.read_databases = []
+        self.assertIsNone(self.backend.db_for_read(self.user1))
+        self.assertIsNone(self.backend.db_for_write())
+
+    def test_replica_reads(self):
+        self.backend.add(self.user1, self.instance, self.key)
+        # the replica mirrors the default database in tests
+        self.assertFalse(self.backend.exists(self.user2, self.instance,
+            self.key))
+        self.assertEqual(len(self.backend.filter(instance=self.instance)), 1)
+
+    def test_subclass_without_constructor(self):
+        class Backend(backends.ModelBackend):
+            def __init__(self):
+                pass
+        backend = Backend()
+        self.assertIsNone(backend.db_for_read(self.user1))
+        self.assertEqual(backend.get_model_for(self.instance), Bookmark)
+        backend.set_dedicated_model(type(self.instance), None)
+        self.assertEqual(backends.ModelBackend.dedicated_models, {})
+
+
+class ArchiveBackendTestCase(unittest.TestCase, BaseBackendTest):
+    def setUp(self):
+        self.backend = backends.ModelBackend()
+        self.backend.use_archive = True
+
+    def tearDown(self):
+        BookmarkArchive.objects.all().delete()
+        self.clean()
+
+
+class ShardedBackendTestCase(unittest.TestCase, BaseBackendTest):
+    def setUp(self):
+        self.backend = backends.ShardedModelBackend(
+            shards=['shard1', 'shard2'])
+
+    def tearDown(self):
+        for alias in self.backend.shards:
+            Bookmark.objects.using(alias).all().delete()
+        self.clean()
+
+    def test_shard_for(self):
+        user = self.create_user('shard_for')
+        alias = self.backend.shard_for(user)
+        self.assertTrue(alias in self.backend.shards)
+        self.assertEqual(self.backend.shard_for(user.pk), alias)
+
+    def test_bookmarks_stored_in_user_shard(self):
+        user, instance, key = self.get_user_instance_key('shard')
+        self.backend.add(user, instance, key)
+        alias = self.backend.shard_for(user)
+        for shard in self.backend.shards:
+            count = Bookmark.objects.using(shard).filter(user=user).count()
+            self.assertEqual(count, 1 if shard == alias else 0)
+        self.assertEqual(Bookmark.objects.filter(user=user).count(), 0)
+
+    def test_filter_merges_shards(self):
+        instance = self.create_instance('shard_merge')
+        users = []
+        while len(users) < 4 or len(set(map(self.backend.shard_for,
+                users))) < 2:
+            users.append(self.create_user('shard_merge_%d' % len(users)))
+        for user in users:
+            self.backend.add(user, instance, 'merge')
+        bookmarks = self.backend.filter(instance=instance)
+        self.assertEqual([i.user for i in bookmarks], users)
+        self.assertEqual(len(bookmarks), len(users))
+        self.assertEqual([i.user for i in bookmarks[1:3]], users[1:3])
+        self.assertEqual(bookmarks[0].content_object, instance)
+        reversed_bookmarks = self.backend.filter(instance=instance,
+            reversed=True)
+        self.assertEqual([i.user for i in reversed_bookmarks[:2]],
+            users[:-3:-1])
+
+    def test_filter_reads_shards_in_chunks(self):
+        instance = self.create_instance('shard_chunks')
+        users = []
+        while len(users) < 6 or len(set(map(self.backend.shard_for,
+                users))) < 2:
+            users.append(self.create_user('shard_chunks_%d' % len(users)))
+        for user in users:
+            self.backend.add(user, instance, 'chunks')
+        calls = []
+        _map = self.backend._map
+
+        def map_func(func, items=None):
+            calls.append(list(items))
+            return _map(func, items)
+        self.backend._map = map_func
+        try:
+            for is_reversed in (False, True):
+                bookmarks = self.backend.filter(instance=instance,
+                    reversed=is_reversed)
+                bookmarks.chunk_size = 2
+                expected = users[::-1] if is_reversed else users
+                self.assertEqual([i.user for i in bookmarks], expected)
+        finally:
+            del self.backend._map
+        # the first chunks of all the shards are read together
+        self.assertEqual(calls[0], [0, 1])
+        self.assertGreater(len(calls), 2)
+
+    def test_annotate(self):
+        user, instance, key = self.get_user_instance_key('shard_annotate')
+        other = self.create_instance('shard_annotate_other')
+        self.backend.add(user, instance, key)
+        annotated = dict((i.pk, bool(i.is_bookmarked))
+            for i in self.backend.annotate(BookmarkTestModel, key, user))
+        self.assertEqual(annotated, {instance.pk: True, other.pk: False})
+
+
+class BufferedBackendTestCase(unittest.TestCase, BaseBackendTest):
+    def setUp(self):
+        self.backend = backends.BufferedModelBackend()
+        # flushing manually
+        self.backend.flush_interval = None
+
+    def tearDown(self):
+        self.backend.buffer.pop_all()
+        self.clean()
+
+    def assertBookmarksEqual(self, first, second):
+        # pending bookmarks are not saved model instances
+        def get_identity(bookmark):
+            return (bookmark.user_id, bookmark.content_type_id,
+                bookmark.object_id, bookmark.key)
+        if isinstance(second, list):
+            self.assertEqual([get_identity(i) for i in first],
+                [get_identity(i) for i in second])
+        else:
+            self.assertEqual(get_identity(first), get_identity(second))
+
+    def test_pending_operations(self):
+        user, instance, key = self.get_user_instance_key('pending')
+        self.backend.add(user, instance, key)
+        self.assertTrue(self.backend.exists(user, instance, key))
+        self.assertEqual(Bookmark.objects.count(), 0)
+        self.assertEqual(self.backend.flush(), 1)
+        self.assertEqual(Bookmark.objects.count(), 1)
+        self.backend.remove(user, instance, key)
+        self.assertFalse(self.backend.exists(user, instance, key))
+        self.assertRaises(exceptions.DoesNotExist, self.backend.get,
+            user, instance, key)
+        self.assertEqual(Bookmark.objects.count(), 1)
+        self.assertEqual(self.backend.flush(), 1)
+        self.assertEqual(Bookmark.objects.count(), 0)
+
+    def test_coalescing(self):
+        user, instance, key = self.get_user_instance_key('coalescing')
+        self.backend.add(user, instance, key)
+        self.backend.remove(user, instance, key)
+        self.backend.add(user, instance, key)
+        self.backend.remove(user, instance, key)
+        self.assertEqual(len(self.backend.buffer), 0)
+        self.assertEqual(self.backend.flush(), 0)
+        self.assertEqual(Bookmark.objects.count(), 0)
+
+    def test_in_flight_operations(self):
+        user, instance, key = self.get_user_instance_key('in_flight')
+        self.backend.add(user, instance, key)
+        operations = self.backend.buffer.pop_all()
+        # being flushed
+        self.assertEqual(len(self.backend.buffer), 0)
+        self.assertTrue(self.backend.exists(user, instance, key))
+        self.assertEqual(self.backend.exists_many(user, [instance], key),
+            [True])
+        self.assertEqual(self.backend.get(user, instance, key).user_id,
+            user.pk)
+        self.assertRaises(exceptions.AlreadyExists, self.backend.add,
+            user, instance, key)
+        self.backend.buffer.commit(operations)
+        self.assertFalse(self.backend.exists(user, instance, key))
+
+    def test_failed_flush(self):
+        user, instance, key = self.get_user_instance_key('failed_flush')
+        self.backend.add(user, instance, key)
+        operations = self.backend.buffer.pop_all()
+        # removed while being flushed
+        self.backend.remove(user, instance, key)
+        self.backend.buffer.restore(operations)
+        self.assertFalse(self.backend.exists(user, instance, key))
+        self.assertEqual(self.backend.flush(), 0)
+        self.assertEqual(Bookmark.objects.count(), 0)
+
+    def test_flusher_survives_errors(self):
+        flushed = threading.Event()
+        calls = []
+
+        def flush():
+            calls.append(None)
+            if len(calls) == 1:
+                raise DatabaseError('unavailable')
+            flushed.set()
+            return 0
+        self.backend.flush = flush
+        self.backend.flush_interval = 0.01
+        self.backend._start_flusher()
+        self.assertTrue(flushed.wait(5))
+        self.assertTrue(self.backend._flusher.is_alive())
+        self.backend.flush_interval = 3600
+
+    def test_filter_flushes(self):
+        user, instance, key = self.get_user_instance_key('flushes')
+        self.backend.add(user, instance, key)
+        self.backend.add(user, self.create_instance('flushes2'), key)
+        bookmarks = list(self.backend.filter(user=user))
+        self.assertEqual(len(bookmarks), 2)
+        self.assertEqual(bookmarks[0].content_object, instance)
+
+
 try:
     mongo_backend = backends.MongoBackend()
 except ImportError:
+    mongo_backend = None
     print("Skipping mongo backend tests: you must pip install mongoengine.")
 except exceptions.MongodbConnectionError:
+    mongo_backend = None
     print("Skipping mongo backend tests: unable to connect to mongodb.")
 else:
     class MongoBackendTestCase(unittest.TestCase, BaseBackendTest):
@@ -199,12 +507,147 @@ else:
             pass
 
 
+try:
+    from fakeredis import FakeStrictRedis as RedisClient
+except ImportError:
+    from bookmarks.localredis import LocalRedis as RedisClient
+
+
+class RedisBackendTestCase(unittest.TestCase, BaseBackendTest):
+    def setUp(self):
+        self.backend = backends.RedisBackend(client=RedisClient(),
+            prefix='test_bookmarks')
+
+    def tearDown(self):
+        self.clean()
+        self.backend.client.flushdb()
+
+    def test_check_consistency(self):
+        model_backend = backends.ModelBackend()
+        user, instance, key = self.get_user_instance_key('consistency')
+        bookmark = model_backend.add(user, instance, key)
+        self.backend.add(user, self.create_instance('redis_only'), key)
+        missing, unexpected = self.backend.check_consistency(model_backend,
+            repair=True)
+        self.assertEqual(len(missing), 1)
+        self.assertEqual(len(unexpected), 1)
+        self.assertTrue(self.backend.exists(user, instance, key))
+        self.assertEqual(self.backend.check_consistency(), (set(), set()))
+        bookmarks = list(self.backend.filter(user=user))
+        self.assertEqual(len(bookmarks), 1)
+        self.assertEqual(bookmarks[0].content_object, bookmark.content_object)
+
+
+try:
+    from bookmarks import aio
+except SyntaxError:
+    print("Skipping asynchronous API tests: Python >= 3.5 is required.")
+else:
+    import asyncio
+
+    class AsyncBackendTestCase(unittest.TestCase):
+        def setUp(self):
+            class Backend(backends.BaseBackend):
+                def exists(self, user, instance, key):
+                    return key == 'exists'
+
+                def filter(self, **kwargs):
+                    return iter([kwargs])
+            self.backend = Backend()
+            self.loop = asyncio.new_event_loop()
+
+        def tearDown(self):
+            self.loop.close()
+
+        def run_coroutine(self, coroutine):
+            return self.loop.run_until_complete(coroutine)
+
+        def test_exists(self):
+            self.assertTrue(self.run_coroutine(
+                self.backend.aexists(None, None, 'exists')))
+            self.assertFalse(self.run_coroutine(
+                self.backend.aexists(None, None, 'missing')))
+
+        def test_filter(self):
+            bookmarks = self.run_coroutine(self.backend.afilter(key='key'))
+            self.assertEqual(bookmarks, [{'key': 'key'}])
+
+        def test_not_implemented(self):
+            self.assertRaises(NotImplementedError, self.run_coroutine,
+                self.backend.aadd(None, None, 'key'))
+
+    class AsyncModelBackendTestCase(unittest.TestCase, BookmarkTestMixin):
+        def get_backend(self):
+            return backends.ModelBackend()
+
+        def setUp(self):
+            self.backend = self.get_backend()
+            self.loop = asyncio.new_event_loop()
+
+        def tearDown(self):
+            self.loop.close()
+            self.clean()
+
+        def run_coroutine(self, coroutine):
+            return self.loop.run_until_complete(coroutine)
+
+        def test_operations(self):
+            user, instance, key = self.get_user_instance_key('async')
+            other = self.create_instance('async_other')
+            bookmark = self.run_coroutine(self.backend.aadd(user, instance,
+                key))
+            self.assertEqual(bookmark.key, key)
+            self.assertRaises(exceptions.AlreadyExists, self.run_coroutine,
+                self.backend.aadd(user, instance, key))
+            self.assertTrue(self.run_coroutine(
+                self.backend.aexists(user, instance, key)))
+            self.assertEqual(self.run_coroutine(self.backend.aexists_many(
+                user, [instance, other], key)), [True, False])
+            bookmark = self.run_coroutine(self.backend.aget(user, instance,
+                key))
+            self.assertEqual(bookmark.content_object, instance)
+            bookmarks = self.run_coroutine(self.backend.afilter(user=user))
+            self.assertEqual(len(bookmarks), 1)
+            self.run_coroutine(self.backend.aremove(user, instance, key))
+            self.assertFalse(self.backend.exists(user, instance, key))
+            self.assertRaises(exceptions.DoesNotExist, self.run_coroutine,
+                self.backend.aget(user, instance, key))
+
+        def test_concurrent(self):
+            user = self.create_user('async_concurrent')
+            instances = [self.create_instance('async%d' % i)
+                for i in range(4)]
+            # register the key first: concurrent get_or_create calls
+            # deadlock on SQLite, which cannot upgrade read transactions
+            keys.get_code('main')
+            asyncio.set_event_loop(self.loop)
+            try:
+                self.run_coroutine(asyncio.gather(*[
+                    self.backend.aadd(user, i, 'main') for i in instances]))
+            finally:
+                asyncio.set_event_loop(None)
+            self.assertEqual(len(list(self.backend.filter(user=user))), 4)
+
+    if mongo_backend is not None:
+        class AsyncMongoBackendTestCase(AsyncModelBackendTestCase):
+            def get_backend(self):
+                return mongo_backend
+
+            def tearDown(self):
+                super(AsyncMongoBackendTestCase, self).tearDown()
+                self.backend.db.drop_collection('bookmark')
+
+
 # REGISTRY TESTS
 
 class RegistryTestCase(unittest.TestCase, BookmarkTestMixin):
     def setUp(self):
         self.library = handlers.Registry()
 
+    def tearDown(self):
+        # Disconnect the pre_delete receivers of the handled models.
+        self.library.unregister(self.library.get_registered_models())
+
     def _get_handler(self):
         class CustomHandler(handlers.Handler):
             pass
@@ -911,3 +1354,1706 @@ class ModelsTestCase(unittest.TestCase, BookmarkTestMixin):
     def test_key2_user2(self):
         objects = self.annotate(BookmarkTestModel, self.key2, self.user2)
         self.assertAttrIndexTrue(objects, [])
+
+
+# MANAGER TESTS
+
+class ManagerTestCase(unittest.TestCase, BookmarkTestMixin):
+    def setUp(self):
+        self.backend = backends.ModelBackend()
+        self.user = self.create_user('manager_test')
+        self.instance1 = self.create_instance('manager_test1')
+        self.instance2 = self.create_instance('manager_test2')
+        self.key = 'manager_test'
+        self.backend.add(self.user, self.instance1, self.key)
+        self.backend.add(self.user, self.instance2, self.key)
+        self.backend.add(self.user, self.user, self.key)
+
+    def tearDown(self):
+        self.clean()
+
+    def test_with_contents(self):
+        queryset = Bookmark.objects.filter(user=self.user).order_by(
+            'created_at').with_contents()
+        with CaptureQueriesContext(connection) as context:
+            contents = [i.content_object for i in queryset]
+        # one query for bookmarks, one for each content type
+        self.assertEqual(len(context), 3)
+        self.assertEqual(contents, [self.instance1, self.instance2, self.user])
+
+    def test_related_to(self):
+        content_type = ContentType.objects.get_for_model(BookmarkTestModel)
+        now = datetime.datetime.now()
+        for instance, score in ((self.instance2, 0.5), (self.user, 0.8)):
+            BookmarkNeighbour.objects.create(content_type=content_type,
+                object_id=self.instance1.pk,
+                neighbour_content_type=ContentType.objects.get_for_model(
+                    instance), neighbour_object_id=instance.pk,
+                score=score, updated_until=now)
+        related = BookmarkNeighbour.objects.related_to(self.instance1)
+        self.assertEqual(related, [self.user, self.instance2])
+        self.assertEqual(BookmarkNeighbour.objects.related_to(
+            self.instance1, 1), [self.user])
+        self.assertEqual(BookmarkNeighbour.objects.related_to(
+            self.instance2), [])
+
+    def test_with_contents_chaining(self):
+        queryset = Bookmark.objects.filter_for(
+            self.instance2).with_contents().select_related('user')
+        bookmarks = list(queryset)
+        self.assertEqual(len(bookmarks), 1)
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(bookmarks[0].content_object, self.instance2)
+            self.assertEqual(bookmarks[0].user, self.user)
+        self.assertEqual(len(context), 0)
+
+    def test_with_contents_pickle(self):
+        queryset = Bookmark.objects.filter_with_contents(user=self.user)
+        self.assertEqual(len(pickle.loads(pickle.dumps(queryset))), 3)
+
+    def test_with_users(self):
+        bookmarks = list(Bookmark.objects.filter_for(BookmarkTestModel,
+            user=self.user).with_users())
+        with CaptureQueriesContext(connection) as context:
+            users = [i.user for i in bookmarks]
+        self.assertEqual(len(context), 0)
+        self.assertEqual(users, [self.user, self.user])
+
+    def test_with_users_fields(self):
+        bookmarks = list(self.backend.filter(instance=self.instance1,
+            user_fields=['username']))
+        with CaptureQueriesContext(connection) as context:
+            usernames = [i.user.username for i in bookmarks]
+        self.assertEqual(len(context), 0)
+        self.assertEqual(usernames, [self.user.username])
+
+
+# ADMIN TESTS
+
+class AdminTestCase(unittest.TestCase, BookmarkTestMixin):
+    def setUp(self):
+        self.backend = backends.ModelBackend()
+        self.user = self.create_user('admin_test')
+        for i in range(3):
+            instance = self.create_instance('admin_test%d' % i)
+            self.backend.add(self.user, instance, 'admin_test')
+
+    def tearDown(self):
+        self.clean()
+
+    def test_paginator_count(self):
+        # sqlite does not provide statistics: the exact count is used
+        queryset = Bookmark.objects.order_by('-created_at')
+        paginator = admin.EstimatedCountPaginator(queryset, 2)
+        self.assertEqual(paginator.count, 3)
+        self.assertEqual(paginator.num_pages, 2)
+
+    def test_search(self):
+        model_admin = admin.BookmarkAdmin(Bookmark, admin.admin.site)
+        queryset = Bookmark.objects.all()
+        request = self.get_request(self.user)
+        results, distinct = model_admin.get_search_results(request, queryset,
+            self.user.username)
+        self.assertEqual(len(results), 3)
+        self.assertFalse(distinct)
+        results, distinct = model_admin.get_search_results(request, queryset,
+            str(self.user.pk + 1))
+        self.assertEqual(len(results), 0)
+        results, distinct = model_admin.get_search_results(request, queryset,
+            str(self.user.pk))
+        self.assertEqual(len(results), 3)
+        # numeric usernames are found too
+        numeric = self.create_user('%d' % (self.user.pk + 1000))
+        self.backend.add(numeric, self.create_instance('admin_num'),
+            'admin_test')
+        results, distinct = model_admin.get_search_results(request, queryset,
+            numeric.username)
+        self.assertEqual([i.user_id for i in results], [numeric.pk])
+
+
+# ARCHIVE TESTS
+
+class ArchiveTestCase(unittest.TestCase, BookmarkTestMixin):
+    def setUp(self):
+        self.backend = backends.ModelBackend()
+        self.backend.use_archive = True
+        self.user = self.create_user('archive_test')
+        self.key = 'archive_test'
+        self.instances = [self.create_instance('archive%d' % i)
+            for i in range(4)]
+        for instance in self.instances:
+            self.backend.add(self.user, instance, self.key)
+        # the first two bookmarks are old
+        old = archive.get_threshold(30)
+        for i, bookmark in enumerate(Bookmark.objects.order_by('pk')[:2]):
+            Bookmark.objects.filter(pk=bookmark.pk).update(
+                created_at=old + datetime.timedelta(seconds=i))
+        self.archived = archive.archive_bookmarks(archive.get_threshold(1),
+            batch_size=1)
+
+    def tearDown(self):
+        BookmarkArchive.objects.all().delete()
+        self.clean()
+
+    def test_archive_bookmarks(self):
+        self.assertEqual(self.archived, 2)
+        self.assertEqual(Bookmark.objects.count(), 2)
+        self.assertEqual(BookmarkArchive.objects.count(), 2)
+        self.assertEqual(archive.archive_bookmarks(archive.get_threshold(1)),
+            0)
+
+    def test_exists_and_get(self):
+        instance = self.instances[0]
+        self.assertTrue(self.backend.exists(self.user, instance, self.key))
+        bookmark = self.backend.get(self.user, instance, self.key)
+        self.assertTrue(isinstance(bookmark, BookmarkArchive))
+        self.assertRaises(exceptions.AlreadyExists,
+            self.backend.add, self.user, instance, self.key)
+        self.backend.use_archive = False
+        self.assertFalse(self.backend.exists(self.user, instance, self.key))
+
+    def test_remove(self):
+        instance = self.instances[0]
+        self.backend.remove(self.user, instance, self.key)
+        self.assertFalse(self.backend.exists(self.user, instance, self.key))
+        self.backend.remove_all_for(self.instances[1])
+        self.assertEqual(BookmarkArchive.objects.count(), 0)
+
+    def test_filter(self):
+        bookmarks = self.backend.filter(user=self.user)
+        self.assertEqual(bookmarks.count(), 4)
+        self.assertEqual([i.content_object for i in bookmarks],
+            self.instances)
+        bookmarks = self.backend.filter(user=self.user, reversed=True)
+        self.assertEqual([i.content_object for i in bookmarks[1:3]],
+            self.instances[2:0:-1])
+        self.assertEqual(bookmarks[3].content_object, self.instances[0])
+
+    def test_first_page_does_not_hit_archive(self):
+        bookmarks = self.backend.filter(user=self.user, reversed=True)
+        with CaptureQueriesContext(connection) as context:
+            page = bookmarks[:2]
+        table = BookmarkArchive._meta.db_table
+        self.assertEqual(len(page), 2)
+        self.assertFalse([i for i in context.captured_queries
+            if table in i['sql']])
+
+
+# KEYS TESTS
+
+class KeysTestCase(unittest.TestCase, BookmarkTestMixin):
+    def setUp(self):
+        self.backend = backends.ModelBackend()
+        self.user, self.instance, self.key = self.get_user_instance_key(
+            'keys')
+
+    def tearDown(self):
+        self.clean()
+
+    def test_registry(self):
+        code = keys.get_code(self.key)
+        self.assertTrue(isinstance(code, int))
+        self.assertEqual(keys.get_code(self.key), code)
+        keys.clear_cache()
+        self.assertEqual(keys.get_name(code), self.key)
+        self.assertEqual(BookmarkKey.objects.get(pk=code).name, self.key)
+
+    def test_key_stored_as_code(self):
+        self.backend.add(self.user, self.instance, self.key)
+        bookmark = Bookmark.objects.get(key=self.key)
+        self.assertEqual(bookmark.key, self.key)
+        self.assertEqual(list(map(keys.get_name, Bookmark.objects.values_list(
+            'key', flat=True))), [self.key])
+        self.assertEqual(Bookmark.objects.filter(
+            key__in=[self.key, 'keys_other']).count(), 1)
+
+    def test_lookups_do_not_register(self):
+        self.assertEqual(Bookmark.objects.filter(
+            key='keys_unregistered').count(), 0)
+        self.assertFalse(BookmarkKey.objects.filter(
+            name='keys_unregistered').exists())
+        self.assertEqual(keys.get_code('keys_unregistered', create=False),
+            keys.UNKNOWN)
+
+    def test_cached_misses(self):
+        keys.clear_cache()
+        self.assertEqual(keys.get_code('keys_missed', create=False),
+            keys.UNKNOWN)
+        with self.assertMaxQueries(0):
+            str(Bookmark.objects.filter(key='keys_missed').query)
+            self.assertEqual(keys.get_code('keys_missed', create=False),
+                keys.UNKNOWN)
+        # misses are forgotten when the key is registered
+        code = keys.get_code('keys_missed')
+        self.assertNotEqual(code, keys.UNKNOWN)
+        self.assertEqual(keys.get_code('keys_missed', create=False), code)
+
+    def test_codes_as_they_are(self):
+        code = keys.get_code('keys_codes')
+        with self.assertMaxQueries(0):
+            self.assertEqual(keys.get_code(code), code)
+            self.assertEqual(keys.get_name('keys_codes'), 'keys_codes')
+
+    def test_static_codes(self):
+        original = settings.KEY_CODES
+        settings.KEY_CODES = {'keys_static': 42}
+        keys.clear_cache()
+        try:
+            self.assertEqual(keys.get_code('keys_static'), 42)
+            self.assertEqual(keys.get_name(42), 'keys_static')
+            self.assertRaises(ValueError, keys.get_code, 'keys_missing')
+            self.assertFalse(BookmarkKey.objects.filter(
+                name='keys_static').exists())
+        finally:
+            settings.KEY_CODES = original
+            keys.clear_cache()
+
+
+# TYPED STORAGE TESTS
+
+class StringPrimaryKeyTestCase(unittest.TestCase, BookmarkTestMixin):
+    def setUp(self):
+        self.backend = backends.ModelBackend()
+        self.user, self.instance, self.key = self.get_user_instance_key(
+            'typed')
+        self.string_instance = StringBookmarkTestModel.objects.create(
+            code='8c1f0dd2-9d8e-4d3a-b6f4-2f0d3c3f6a11')
+        handlers.library.register(StringBookmarkTestModel)
+
+    def tearDown(self):
+        handlers.library.unregister(StringBookmarkTestModel)
+        StringBookmark.objects.all().delete()
+        self.clean()
+
+    def test_get_bookmark_model(self):
+        self.assertEqual(self.backend.get_model_for(self.instance), Bookmark)
+        self.assertEqual(self.backend.get_model_for(StringBookmarkTestModel),
+            StringBookmark)
+        self.assertEqual(self.backend.get_models(), [Bookmark, StringBookmark])
+
+    def test_add_and_exists(self):
+        bookmark = self.backend.add(self.user, self.string_instance, self.key)
+        self.assertTrue(isinstance(bookmark, StringBookmark))
+        self.check_bookmark(bookmark, self.user, self.string_instance,
+            self.key)
+        self.assertTrue(self.backend.exists(self.user, self.string_instance,
+            self.key))
+        self.assertEqual(Bookmark.objects.count(), 0)
+        self.backend.remove(self.user, self.string_instance, self.key)
+        self.assertFalse(self.backend.exists(self.user, self.string_instance,
+            self.key))
+
+    def test_filter(self):
+        bookmark1 = self.backend.add(self.user, self.instance, self.key)
+        bookmark2 = self.backend.add(self.user, self.string_instance,
+            self.key)
+        self.assertEqual(list(self.backend.filter(
+            instance=self.string_instance)), [bookmark2])
+        bookmarks = self.backend.filter(user=self.user, reversed=True)
+        self.assertEqual([i.content_object for i in bookmarks],
+            [self.string_instance, self.instance])
+        self.assertEqual(bookmarks[1], bookmark1)
+
+    def test_exists_many(self):
+        self.backend.add(self.user, self.string_instance, self.key)
+        # warming up content types and keys caches
+        self.backend.exists_many(self.user, [self.instance], self.key)
+        with CaptureQueriesContext(connection) as context:
+            exists = self.backend.exists_many(self.user,
+                [self.instance, self.string_instance], self.key)
+        self.assertEqual(exists, [False, True])
+        self.assertEqual(len(context), 2)
+
+    def test_annotate(self):
+        self.backend.add(self.user, self.string_instance, self.key)
+        annotated = self.backend.annotate(StringBookmarkTestModel, self.key,
+            self.user)
+        self.assertTrue(all(i.is_bookmarked for i in annotated))
+
+
+if UUIDBookmarkTestModel is None:
+    print("Skipping UUID primary key tests: Django >= 1.8 is required.")
+else:
+    class UUIDPrimaryKeyTestCase(unittest.TestCase, BookmarkTestMixin):
+        def setUp(self):
+            self.backend = backends.ModelBackend()
+            self.user, self.instance, self.key = self.get_user_instance_key(
+                'uuid')
+            self.uuid_instance = UUIDBookmarkTestModel.objects.create()
+            self.other = UUIDBookmarkTestModel.objects.create()
+            handlers.library.register(UUIDBookmarkTestModel)
+
+        def tearDown(self):
+            handlers.library.unregister(UUIDBookmarkTestModel)
+            StringBookmark.objects.all().delete()
+            UUIDBookmarkTestModel.objects.all().delete()
+            self.clean()
+
+        def test_exists_many(self):
+            self.backend.add(self.user, self.uuid_instance, self.key)
+            self.assertTrue(self.backend.exists(self.user,
+                self.uuid_instance, self.key))
+            self.assertEqual(self.backend.exists_many(self.user,
+                [self.other, self.uuid_instance, self.instance], self.key),
+                [False, True, False])
+
+        def test_annotate(self):
+            self.backend.add(self.user, self.uuid_instance, self.key)
+            annotated = dict((i.pk, bool(i.is_bookmarked))
+                for i in self.backend.annotate(UUIDBookmarkTestModel,
+                self.key, self.user))
+            self.assertEqual(annotated,
+                {self.uuid_instance.pk: True, self.other.pk: False})
+
+        def test_filter(self):
+            self.backend.add(self.user, self.instance, self.key)
+            self.backend.add(self.user, self.uuid_instance, self.key)
+            bookmarks = self.backend.filter(user=self.user, reversed=True)
+            self.assertEqual([i.content_object for i in bookmarks],
+                [self.uuid_instance, self.instance])
+            self.assertEqual(bookmarks[0].content_object, self.uuid_instance)
+
+        def test_load_contents(self):
+            self.backend.add(self.user, self.uuid_instance, self.key)
+            bookmarks = list(StringBookmark.objects.all())
+            utils.load_contents(bookmarks)
+            with CaptureQueriesContext(connection) as context:
+                self.assertEqual(bookmarks[0].content_object,
+                    self.uuid_instance)
+            self.assertEqual(len(context), 0)
+
+        def test_with_contents(self):
+            self.backend.add(self.user, self.uuid_instance, self.key)
+            bookmarks = list(StringBookmark.objects.with_contents())
+            with CaptureQueriesContext(connection) as context:
+                self.assertEqual(bookmarks[0].content_object,
+                    self.uuid_instance)
+            self.assertEqual(len(context), 0)
+
+        def test_redis_filter(self):
+            backend = backends.RedisBackend(client=RedisClient(),
+                prefix='test_uuid')
+            try:
+                backend.add(self.user, self.uuid_instance, self.key)
+                self.assertEqual(len(backend.filter(
+                    instance=self.uuid_instance)), 1)
+                self.assertEqual(len(backend.filter(instance=self.other)), 0)
+            finally:
+                backend.client.flushdb()
+
+
+# DEDICATED STORAGE TESTS
+
+class DedicatedStorageTestCase(unittest.TestCase, BookmarkTestMixin):
+    def setUp(self):
+        self.library = handlers.Registry()
+        self.library.register(DedicatedTestModel, storage='dedicated')
+        self.backend = self.library.backend
+        self.user = self.create_user('dedicated')
+        self.instance = DedicatedTestModel.objects.create(name='dedicated')
+        self.key = 'dedicated'
+
+    def tearDown(self):
+        self.library.unregister(DedicatedTestModel)
+        self.clean()
+
+    def test_registry(self):
+        self.assertEqual(self.backend.get_model_for(self.instance),
+            DedicatedTestModelBookmark)
+        self.assertFalse(pre_delete.has_listeners(DedicatedTestModel))
+        self.assertRaises(ImproperlyConfigured, self.library.register,
+            BookmarkTestModel, storage='dedicated')
+
+    def test_backend_api(self):
+        bookmark = self.backend.add(self.user, self.instance, self.key)
+        self.assertTrue(isinstance(bookmark, DedicatedTestModelBookmark))
+        self.check_bookmark(bookmark, self.user, self.instance, self.key)
+        self.assertEqual(bookmark.object_id, self.instance.pk)
+        self.assertRaises(exceptions.AlreadyExists,
+            self.backend.add, self.user, self.instance, self.key)
+        self.assertTrue(self.backend.exists(self.user, self.instance,
+            self.key))
+        self.assertEqual(self.backend.get(self.user, self.instance, self.key),
+            bookmark)
+        self.assertEqual(list(self.backend.filter(instance=self.instance)),
+            [bookmark])
+        self.assertEqual(self.backend.exists_many(self.user,
+            [self.instance], self.key), [True])
+        self.assertEqual(Bookmark.objects.count(), 0)
+        self.backend.remove(self.user, self.instance, self.key)
+        self.assertFalse(self.backend.exists(self.user, self.instance,
+            self.key))
+
+    def test_generic_lookups(self):
+        bookmark = self.backend.add(self.user, self.instance, self.key)
+        content_type = ContentType.objects.get_for_model(DedicatedTestModel)
+        manager = DedicatedTestModelBookmark.objects
+        self.assertEqual(list(manager.filter(content_type=content_type,
+            object_id=self.instance.pk)), [bookmark])
+        self.assertEqual(list(manager.filter(models.Q(
+            object_id=self.instance.pk) | models.Q(object_id=0))), [bookmark])
+        self.assertEqual(list(manager.filter(models.Q(
+            content_type_id=content_type.pk) & models.Q(user=self.user))),
+            [bookmark])
+        self.assertEqual(list(manager.exclude(content_type=content_type)), [])
+        other = ContentType.objects.get_for_model(BookmarkTestModel)
+        self.assertRaises(ValueError, manager.filter, content_type=other)
+        self.assertRaises(ValueError, manager.filter,
+            models.Q(content_type=other) | models.Q(user=self.user))
+
+    def test_annotate(self):
+        self.backend.add(self.user, self.instance, self.key)
+        other = DedicatedTestModel.objects.create(name='other')
+        annotated = dict((i.pk, bool(i.is_bookmarked)) for i in
+            self.backend.annotate(DedicatedTestModel, self.key, self.user))
+        self.assertEqual(annotated, {self.instance.pk: True, other.pk: False})
+
+    def test_cascade(self):
+        self.backend.add(self.user, self.instance, self.key)
+        DedicatedTestModel.objects.all().delete()
+        self.assertEqual(DedicatedTestModelBookmark.objects.count(), 0)
+
+
+# TRIGGERS TESTS
+
+class TriggersTestCase(unittest.TestCase, BookmarkTestMixin):
+    def setUp(self):
+        self.library = handlers.Registry()
+        self.library.register(BookmarkTestModel, db_cascade=True)
+        self.backend = self.library.backend
+        triggers.install(BookmarkTestModel)
+
+    def tearDown(self):
+        triggers.uninstall(BookmarkTestModel)
+        self.library.unregister(BookmarkTestModel)
+        self.clean()
+
+    def test_receiver_not_connected(self):
+        self.assertFalse(pre_delete.has_listeners(BookmarkTestModel))
+
+    def test_bookmarks_removed(self):
+        user, instance, key = self.get_user_instance_key('triggers')
+        other = self.create_instance('triggers_other')
+        self.backend.add(user, instance, key)
+        remaining = self.backend.add(user, other, key)
+        BookmarkTestModel.objects.filter(pk=instance.pk).delete()
+        self.assertEqual(list(Bookmark.objects.all()), [remaining])
+
+    def test_unsupported_database(self):
+        class Connection(object):
+            vendor = 'unknown'
+            ops = connection.ops
+        self.assertRaises(NotImplementedError, triggers.get_sql,
+            BookmarkTestModel, Connection())
+
+
+# INSTRUMENTATION TESTS
+
+class InstrumentationTestCase(unittest.TestCase, BookmarkTestMixin):
+    def setUp(self):
+        self.original = settings.INSTRUMENTATION
+        settings.INSTRUMENTATION = {'ENABLED': True, 'SINKS': []}
+        self.measurements = []
+        instrumentation.register_sink(self.sink)
+        handlers.library.register(BookmarkTestModel)
+        self.handler = handlers.library.get_handler(BookmarkTestModel)
+        self.backend = instrumentation.InstrumentedBackend(
+            backends.ModelBackend())
+
+    def tearDown(self):
+        instrumentation.unregister_sink(self.sink)
+        settings.INSTRUMENTATION = self.original
+        self.clean()
+        handlers.library.unregister(BookmarkTestModel)
+
+    def sink(self, name, **values):
+        self.measurements.append((name, values))
+
+    def get_names(self):
+        return [name for name, values in self.measurements
+            if 'seconds' in values]
+
+    def get_post_request(self, user, instance):
+        data = {
+            'model': str(instance._meta),
+            'object_id': str(instance.pk),
+            'key': self.handler.default_key,
+        }
+        return RequestFactory(user).post('/', data, HTTP_REFERER='/')
+
+    def test_backend_operations(self):
+        user, instance, key = self.get_user_instance_key('instrumentation')
+        self.backend.add(user, instance, key)
+        self.assertTrue(self.backend.exists(user, instance, key))
+        self.backend.remove(user, instance, key)
+        self.assertEqual(self.get_names(),
+            ['backend.add', 'backend.exists', 'backend.remove'])
+        for name, values in self.measurements:
+            if 'seconds' in values:
+                self.assertTrue(values['queries'] > 0)
+                self.assertTrue(values['seconds'] >= 0)
+
+    def test_backend_delegation(self):
+        self.assertEqual(self.backend.get_model(), Bookmark)
+        self.assertTrue(isinstance(backends.get_backend(),
+            instrumentation.InstrumentedBackend))
+        self.assertTrue(type(backends.unwrap(self.backend)) is
+            backends.ModelBackend)
+        self.assertTrue(type(backends.unwrap(index.IndexedBackend(
+            self.backend))) is backends.ModelBackend)
+
+    def test_debug_cursor_not_enabled(self):
+        user, instance, key = self.get_user_instance_key('debug_cursor')
+        attr = 'force_debug_cursor' if hasattr(connection,
+            'force_debug_cursor') else 'use_debug_cursor'
+        debug_cursor = getattr(connection, attr)
+        with instrumentation.measure('nested'):
+            self.backend.add(user, instance, key)
+            self.assertEqual(getattr(connection, attr), debug_cursor)
+        self.assertFalse('cursor' in connection.__dict__)
+        values = dict(self.measurements)
+        self.assertEqual(values['backend.add']['queries'],
+            values['nested']['queries'])
+        self.assertTrue(values['nested']['queries'] > 0)
+
+    def test_cache(self):
+        keys.get_code('instrumentation')
+        keys.get_code('instrumentation')
+        self.assertIn(('keys', {'hit': 1}), self.measurements)
+
+    def test_disabled(self):
+        settings.INSTRUMENTATION = {'ENABLED': False, 'SINKS': []}
+        user, instance, key = self.get_user_instance_key('instrumentation')
+        views.bookmark(self.get_post_request(user, instance))
+        self.assertFalse(self.measurements)
+        self.assertFalse(isinstance(backends.get_backend(),
+            instrumentation.InstrumentedBackend))
+
+    def test_view(self):
+        user, instance, key = self.get_user_instance_key('instrumentation')
+        views.bookmark(self.get_post_request(user, instance))
+        self.assertIn('view.bookmark', self.get_names())
+        self.assertIn(('form.exists', {'hit': 1}), self.measurements)
+
+    def test_summary_middleware(self):
+        user, instance, key = self.get_user_instance_key('instrumentation')
+        request = self.get_post_request(user, instance)
+        middleware = instrumentation.SummaryMiddleware()
+        middleware.process_request(request)
+        response = middleware.process_response(request,
+            views.bookmark(request))
+        summary = response[instrumentation.SUMMARY_HEADER]
+        self.assertIn('view.bookmark calls=1 ms=', summary)
+        self.assertIn('form.exists calls=', summary)
+
+    def test_signal_sink(self):
+        received = []
+
+        def receiver(sender, **kwargs):
+            received.append(kwargs['name'])
+        signals.bookmark_measured.connect(receiver)
+        try:
+            instrumentation.signal_sink('backend.add', seconds=1, queries=2)
+        finally:
+            signals.bookmark_measured.disconnect(receiver)
+        self.assertEqual(received, ['backend.add'])
+
+    def test_statsd_sink(self):
+        class Client(object):
+            calls = []
+
+            def timing(self, name, value):
+                self.calls.append(('timing', name, value))
+
+            def incr(self, name, count):
+                self.calls.append(('incr', name, count))
+        client = Client()
+        sink = instrumentation.StatsdSink(client)
+        sink('backend.add', seconds=0.5, queries=2)
+        sink('keys', hit=0)
+        self.assertEqual(client.calls, [
+            ('timing', 'bookmarks.backend.add', 500),
+            ('incr', 'bookmarks.backend.add.queries', 2),
+            ('incr', 'bookmarks.keys.miss', 1),
+        ])
+
+
+# QUERY BUDGET TESTS
+
+class QueryBudgetTestCase(unittest.TestCase, BookmarkTestMixin):
+    """
+    Maximum number of queries performed by the hot paths, for
+    *size* bookmarkable objects, half of them bookmarked.
+    """
+    size = 10
+
+    def setUp(self):
+        handlers.library.register(BookmarkTestModel)
+        self.handler = handlers.library.get_handler(BookmarkTestModel)
+        self.backend = self.handler.backend
+        self.key = self.handler.default_key
+        self.user = self.create_user('budget')
+        self.instances = [self.create_instance('budget%d' % i)
+            for i in range(self.size)]
+        for instance in self.instances[::2]:
+            self.backend.add(self.user, instance, self.key)
+        self.request = self.get_request(self.user)
+
+    def tearDown(self):
+        self.clean()
+        handlers.library.unregister(BookmarkTestModel)
+
+    def render(self, template):
+        return Template('{% load bookmarks_tags %}' + template).render(
+            Context({'instances': self.instances, 'request': self.request}))
+
+    def test_budget_exceeded(self):
+        with self.assertRaises(AssertionError):
+            with self.assertMaxQueries(0):
+                list(User.objects.all())
+        self.assertRaises(AssertionError, self.assertMaxQueries, 0,
+            list, User.objects.all())
+        self.assertMaxQueries(1, list, User.objects.all())
+        # kwargs are passed to the callable
+        self.assertMaxQueries(1, lambda using: list(User.objects.using(
+            using)), using='default')
+        self.assertRaises(TypeError, self.assertMaxQueries, 1, using='x',
+            msg='unexpected')
+
+    def test_view_toggle(self):
+        data = {
+            'model': BookmarkTestModel._meta,
+            'object_id': str(self.instances[1].pk),
+            'key': self.key,
+        }
+        request = RequestFactory(self.user).post('/', data, HTTP_REFERER='/')
+        # instance validation, existence check, transaction, savepoint
+        # around the insert (released afterwards) and write
+        self.assertMaxQueries(6, views.bookmark, request)
+        self.assertMaxQueries(5, views.bookmark, request)
+
+    def defer(self):
+        collector = deferred.Collector(self.request)
+        self.request.bookmarks_collector = collector
+        return collector
+
+    def test_bookmark_form(self):
+        collector = self.defer()
+        # one bulk existence check, regardless of the number of objects
+        with self.assertMaxQueries(1):
+            content = self.render('{% for instance in instances %}'
+                '{% bookmark_form for instance %}{% endfor %}')
+            collector.substitute(content.encode('utf-8'), 'utf-8')
+
+    def test_bookmark(self):
+        self.defer()
+        # bookmarks of the user and their content objects, retreived once
+        with self.assertMaxQueries(2):
+            content = self.render('{% for instance in instances %}'
+                '{% bookmark for instance as bookmark %}'
+                '{{ bookmark.key }}{% endfor %}')
+        self.assertEqual(content.count(self.key), self.size // 2)
+
+    def test_bookmarks(self):
+        with self.assertMaxQueries(1):
+            self.render('{% bookmarks as bookmarks %}'
+                '{% for bookmark in bookmarks %}'
+                '{{ bookmark.user.username }}{% endfor %}')
+
+    def test_filter_with_contents(self):
+        with self.assertMaxQueries(2):
+            for bookmark in self.backend.filter(user=self.user):
+                bookmark.content_object.name
+
+    def test_exists_many(self):
+        self.assertMaxQueries(1, self.backend.exists_many, self.user,
+            self.instances, self.key)
+
+    def test_annotate_bookmarks(self):
+        queryset = annotate_bookmarks(BookmarkTestModel, self.key, self.user)
+        with self.assertMaxQueries(1):
+            [i.is_bookmarked for i in queryset]
+
+
+# LOAD TEST TESTS
+
+class LoadTestTestCase(unittest.TestCase, BookmarkTestMixin):
+    def setUp(self):
+        handlers.library.register(BookmarkTestModel)
+        for i in range(5):
+            self.create_instance('loadtest%d' % i)
+
+    def tearDown(self):
+        self.clean()
+        handlers.library.unregister(BookmarkTestModel)
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(loadtest.percentile(values, 50), 50)
+        self.assertEqual(loadtest.percentile(values, 99), 99)
+        self.assertEqual(loadtest.percentile([3], 95), 3)
+        self.assertEqual(loadtest.percentile([], 95), None)
+
+    def test_skewed_choice(self):
+        choose = loadtest.skewed_choice(['a', 'b', 'c'], skew=3)
+        choices = [choose() for i in range(1000)]
+        self.assertTrue(choices.count('a') > choices.count('b') >
+            choices.count('c'))
+
+    def test_create_dataset(self):
+        # an existing user sharing the prefix of the dataset
+        existing = self.create_user('loadtest_existing')
+        dataset = loadtest.create_dataset([BookmarkTestModel], users=3,
+            objects=5, bookmarks=6, seed=1)
+        self.assertEqual(len(dataset.users), 3)
+        self.assertFalse(existing in dataset.users)
+        self.assertEqual(len(dataset.instances), 5)
+        self.assertEqual(Bookmark.objects.count(), 6)
+        dataset.delete()
+        self.assertEqual(Bookmark.objects.count(), 0)
+        self.assertEqual(list(User.objects.all()), [existing])
+
+    def test_replay(self):
+        dataset = loadtest.create_dataset([BookmarkTestModel], users=3,
+            objects=5, seed=1)
+        results = loadtest.replay(dataset, requests=30, threads=1, seed=1)
+        self.assertEqual(results.count(), 30)
+        self.assertFalse(results.errors)
+        self.assertEqual(results.summary()[-1][:3], ('total', 30, 0))
+        self.assertRaises(ValueError, loadtest.replay, dataset,
+            mix={'unknown': 1})
+
+    def test_command(self):
+        stdout = six.StringIO()
+        call_command('bookmarks_loadtest', models='auth.user', users=5,
+            requests=20, threads=1, seed=1, stdout=stdout)
+        self.assertIn('20 operations in', stdout.getvalue())
+        self.assertEqual(handlers.library.get_handler(User), None)
+        self.assertFalse(User.objects.exists())
+
+
+# EXPORT TESTS
+
+class ExportTestCase(unittest.TestCase, BookmarkTestMixin):
+    def setUp(self):
+        handlers.library.register(BookmarkTestModel)
+        self.backend = handlers.library.backend
+        self.user = self.create_user('export')
+        self.instances = [self.create_instance('export%d' % i)
+            for i in range(3)]
+        for instance in self.instances:
+            self.backend.add(self.user, instance, 'main')
+        self.backend.add(self.create_user('export_other'),
+            self.instances[0], 'main')
+
+    def tearDown(self):
+        self.clean()
+        handlers.library.unregister(BookmarkTestModel)
+
+    def test_chunks(self):
+        queryset = export.get_querysets(self.backend, user=self.user)[0]
+        chunks = list(export.iter_chunks(queryset, chunk_size=2))
+        self.assertEqual([len(i) for i in chunks], [2, 1])
+        with CaptureQueriesContext(connection) as context:
+            contents = [i.content_object for i in chunks[0]]
+        self.assertEqual(len(context), 0)
+        self.assertEqual(contents, self.instances[:2])
+
+    def test_csv(self):
+        lines = list(export.export(self.backend, user=self.user,
+            chunk_size=2))
+        rows = list(csv.reader(lines))
+        self.assertEqual(rows[0], list(export.FIELDS))
+        self.assertEqual([i[5] for i in rows[1:]],
+            ['export0', 'export1', 'export2'])
+        self.assertEqual(rows[1][1], 'bookmarks.bookmarktestmodel')
+
+    def test_jsonl(self):
+        rows = [json.loads(i) for i in export.export(self.backend,
+            model=BookmarkTestModel, format='jsonl')]
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(rows[0]['object_id'], self.instances[0].pk)
+        self.assertEqual(rows[0]['key'], 'main')
+
+    def test_invalid_format(self):
+        self.assertRaises(ValueError, export.export, self.backend,
+            format='xml')
+
+    def test_view(self):
+        request = RequestFactory(self.user).get('/', {'format': 'jsonl'})
+        response = views.export(request)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        content = b''.join(response.streaming_content)
+        self.assertEqual(len(content.splitlines()), 3)
+        response = views.export(self.get_request())
+        self.assertEqual(response.status_code, 403)
+
+    def test_buffered_backend(self):
+        backend = backends.BufferedModelBackend()
+        backend.flush_interval = None
+        backend.add(self.user, self.create_instance('export_buffered'),
+            'main')
+        self.assertEqual(len(list(export.iter_bookmarks(backend,
+            user=self.user))), 4)
+        self.assertEqual(len(backend.buffer), 0)
+
+    def test_view_instrumentation(self):
+        original = settings.INSTRUMENTATION
+        settings.INSTRUMENTATION = {'ENABLED': True, 'SINKS': []}
+        measurements = []
+
+        def sink(name, **values):
+            measurements.append((name, values))
+        instrumentation.register_sink(sink)
+        try:
+            request = RequestFactory(self.user).get('/')
+            response = views.export(request)
+            self.assertEqual([i for i in measurements
+                if i[0] == 'view.export'], [])
+            b''.join(response.streaming_content)
+        finally:
+            instrumentation.unregister_sink(sink)
+            settings.INSTRUMENTATION = original
+        values = dict(measurements)['view.export']
+        self.assertTrue(values['queries'] > 0)
+
+    def test_command(self):
+        stdout = six.StringIO()
+        call_command('bookmarks_export', user='export', stdout=stdout)
+        self.assertEqual(len(stdout.getvalue().splitlines()), 4)
+
+
+# IMPORT TESTS
+
+class ImportTestCase(unittest.TestCase, BookmarkTestMixin):
+    def setUp(self):
+        handlers.library.register(BookmarkTestModel)
+        self.backend = handlers.library.backend
+        self.user = self.create_user('import')
+        self.instances = [self.create_instance('import%d' % i)
+            for i in range(3)]
+        self.model = 'bookmarks.bookmarktestmodel'
+
+    def tearDown(self):
+        self.clean()
+        handlers.library.unregister(BookmarkTestModel)
+
+    def get_row(self, instance, key='main', **kwargs):
+        row = {'user': str(self.user.pk), 'model': self.model,
+            'object_id': str(instance.pk), 'key': key}
+        row.update(kwargs)
+        return row
+
+    def test_bulk_add(self):
+        bookmarks = [(self.user.pk, BookmarkTestModel, i.pk, 'main', None)
+            for i in self.instances]
+        self.backend.add(self.user, self.instances[0], 'main')
+        self.assertEqual(self.backend.bulk_add(bookmarks + bookmarks), 2)
+        self.assertEqual(self.backend.filter(user=self.user).count(), 3)
+        self.assertEqual(self.backend.bulk_add(bookmarks), 0)
+
+    def test_base_bulk_add(self):
+        bookmarks = [(self.user.pk, BookmarkTestModel, i.pk, 'main', None)
+            for i in self.instances]
+        self.backend.add(self.user, self.instances[0], 'main')
+        added = backends.BaseBackend.bulk_add(self.backend, bookmarks)
+        self.assertEqual(added, 2)
+        self.assertEqual(self.backend.filter(user=self.user).count(), 3)
+
+    def test_bulk_add_conflict(self):
+        bookmarks = [(self.user.pk, BookmarkTestModel, i.pk, 'main', None)
+            for i in self.instances]
+        backend = backends.unwrap(self.backend)
+        get_existing = backend._get_existing
+
+        def add_concurrently(*args):
+            # the bookmark is added after existing bookmarks are retreived
+            existing = get_existing(*args)
+            if not existing:
+                self.backend.add(self.user, self.instances[0], 'main')
+            return existing
+        backend._get_existing = add_concurrently
+        try:
+            added = backend.bulk_add(bookmarks)
+        finally:
+            del backend._get_existing
+        self.assertEqual(added, 2)
+        self.assertEqual(self.backend.filter(user=self.user).count(), 3)
+
+    def test_import(self):
+        rows = [self.get_row(i) for i in self.instances]
+        self.backend.add(self.user, self.instances[0], 'main')
+        progress = []
+        with self.assertMaxQueries(10):
+            result = importer.import_bookmarks(self.backend, rows,
+                chunk_size=2, progress=progress.append)
+        self.assertEqual((result.processed, result.added, result.duplicates,
+            result.rejected), (3, 2, 1, 0))
+        self.assertEqual(len(progress), 2)
+        self.assertEqual(self.backend.filter(user=self.user).count(), 3)
+
+    def test_rejected(self):
+        rejected = []
+        rows = [
+            self.get_row(self.instances[0]),
+            self.get_row(self.instances[0], user='0'),
+            self.get_row(self.instances[0], object_id='0'),
+            self.get_row(self.instances[0], model='bookmarks.missing'),
+            self.get_row(self.instances[0], key=''),
+            self.get_row(self.instances[0], created_at='yesterday'),
+            {'user': 'nobody'},
+            self.get_row(self.user, model='auth.user'),
+            self.get_row(self.instances[0], key='other'),
+        ]
+        result = importer.import_bookmarks(self.backend, rows,
+            reject=lambda *args: rejected.append(args))
+        self.assertEqual((result.added, result.rejected), (1, 8))
+        self.assertEqual([i[0] for i in rejected], [4, 5, 6, 7, 8, 9, 2, 3])
+        self.assertEqual(rejected[4][2], 'Model not registered.')
+        self.assertEqual(rejected[5][2], 'Key not allowed.')
+        self.assertEqual(rejected[-1][2], 'Invalid object.')
+
+    def test_created_at(self):
+        created_at = '2014-03-01T10:00:00+00:00'
+        rows = [self.get_row(self.instances[0], created_at=created_at)]
+        importer.import_bookmarks(self.backend, rows)
+        bookmark = self.backend.get(self.user, self.instances[0], 'main')
+        expected = datetime.datetime(2014, 3, 1, 10, tzinfo=timezone.utc)
+        if not timezone.is_aware(bookmark.created_at):
+            expected = timezone.make_naive(expected)
+        self.assertEqual(bookmark.created_at, expected)
+
+    def test_created_at_naive(self):
+        rows = [self.get_row(self.instances[0],
+            created_at='2014-03-01T10:00:00')]
+        importer.import_bookmarks(self.backend, rows)
+        bookmark = self.backend.get(self.user, self.instances[0], 'main')
+        self.assertEqual(bookmark.created_at.replace(tzinfo=None),
+            datetime.datetime(2014, 3, 1, 10))
+
+    def test_export_round_trip(self):
+        for instance in self.instances:
+            self.backend.add(self.user, instance, 'main')
+        lines = list(export.export(self.backend, user=self.user))
+        self.backend.remove_all_for(self.instances[1])
+        result = importer.import_bookmarks(self.backend,
+            importer.read_csv(lines))
+        self.assertEqual((result.added, result.duplicates), (1, 2))
+        self.assertTrue(self.backend.exists(self.user, self.instances[1],
+            'main'))
+
+    def test_command(self):
+        path = os.path.join(tempfile.mkdtemp(), 'bookmarks.jsonl')
+        with open(path, 'w') as f:
+            for instance in self.instances:
+                f.write(json.dumps(self.get_row(instance)) + '\n')
+        stdout = six.StringIO()
+        call_command('bookmarks_import', path, stdout=stdout)
+        self.assertIn('3 added', stdout.getvalue())
+        self.assertEqual(self.backend.filter(user=self.user).count(), 3)
+        os.remove(path)
+
+
+# SUMMARIES TESTS
+
+class SummariesTestCase(unittest.TestCase, BookmarkTestMixin):
+    def setUp(self):
+        self.original = settings.SUMMARIES
+        settings.SUMMARIES = dict(self.original, ENABLED=True, RECENT=2)
+        cache.clear()
+        handlers.library.register(BookmarkTestModel)
+        self.backend = summaries.SummarizedBackend(backends.ModelBackend())
+        self.user = self.create_user('summary')
+        self.instances = [self.create_instance('summary%d' % i)
+            for i in range(3)]
+
+    def tearDown(self):
+        settings.SUMMARIES = self.original
+        cache.clear()
+        self.clean()
+        handlers.library.unregister(BookmarkTestModel)
+
+    def test_partial_settings(self):
+        with override_settings(GENERIC_BOOKMARKS_SUMMARIES={'ENABLED': True}):
+            options = settings._get_options('GENERIC_BOOKMARKS_SUMMARIES',
+                {'ENABLED': False, 'RECENT': 10})
+        self.assertEqual(options, {'ENABLED': True, 'RECENT': 10})
+
+    def test_summary(self):
+        summary = summaries.Summary()
+        summary.add(1, 10, 'main')
+        summary.add(1, 11, 'later')
+        summary.add(2, 12, 'main')
+        self.assertEqual(summary.total, 3)
+        self.assertEqual(summary.keys, {'main': 2, 'later': 1})
+        self.assertEqual(summary.recent, [(2, 12, 'main'), (1, 11, 'later')])
+        summary = summaries.Summary.from_json(summary.to_json())
+        self.assertEqual(summary.count(key='main'), 2)
+        self.assertEqual(summary.get_recent(key='main'), [(2, 12, 'main')])
+        # the oldest bookmark is not recent
+        self.assertTrue(summary.remove(1, 10, 'main'))
+        # a recent bookmark can be replaced by an older one
+        summary.add(1, 10, 'main')
+        self.assertFalse(summary.remove(1, 10, 'main'))
+
+    def test_concurrent_rebuild(self):
+        summaries.get_summary(self.user)
+        add = self.backend.backend.add
+
+        def add_and_rebuild(*args):
+            # the summary is rebuilt after the bookmark is saved,
+            # before it is recorded
+            bookmark = add(*args)
+            summaries.rebuild(self.user, self.backend.backend)
+            return bookmark
+        self.backend.backend.add = add_and_rebuild
+        self.backend.add(self.user, self.instances[0], 'main')
+        self.assertEqual(summaries.get_summary(self.user).total, 1)
+
+    def test_buffered_rebuild(self):
+        backend = backends.BufferedModelBackend()
+        backend.flush_interval = None
+        backend.add(self.user, self.instances[0], 'main')
+        self.assertEqual(summaries.rebuild(self.user, backend).total, 1)
+        self.assertEqual(len(backend.buffer), 0)
+
+    def test_incremental(self):
+        self.assertEqual(summaries.get_summary(self.user).total, 0)
+        for instance in self.instances:
+            self.backend.add(self.user, instance, 'main')
+        self.backend.add(self.user, self.instances[0], 'later')
+        self.backend.remove(self.user, self.instances[1], 'main')
+        with self.assertMaxQueries(0):
+            summary = summaries.get_summary(self.user)
+        self.assertEqual(summary.keys, {'main': 2, 'later': 1})
+        self.assertEqual(summary.count(model=BookmarkTestModel), 3)
+        content_type_id = ContentType.objects.get_for_model(
+            BookmarkTestModel).pk
+        self.assertEqual(summary.recent, [
+            (content_type_id, self.instances[0].pk, 'later'),
+            (content_type_id, self.instances[2].pk, 'main'),
+        ])
+
+    def test_rebuild_recent(self):
+        for instance in self.instances:
+            self.backend.add(self.user, instance, 'main')
+        summaries.get_summary(self.user)
+        self.backend.remove(self.user, self.instances[2], 'main')
+        summary = summaries.get_summary(self.user)
+        self.assertEqual([i[1] for i in summary.recent],
+            [self.instances[1].pk, self.instances[0].pk])
+        self.assertEqual(summary.get_recent_objects(),
+            [self.instances[1], self.instances[0]])
+
+    def test_database_fallback(self):
+        self.backend.add(self.user, self.instances[0], 'main')
+        summaries.get_summary(self.user)
+        cache.clear()
+        with self.assertMaxQueries(1):
+            self.assertEqual(summaries.get_summary(self.user).total, 1)
+
+    def test_invalidation(self):
+        for instance in self.instances:
+            self.backend.add(self.user, instance, 'main')
+        summaries.get_summary(self.user)
+        self.backend.remove_all_for(self.instances[0])
+        self.assertFalse(BookmarkSummary.objects.exists())
+        self.assertEqual(summaries.get_summary(self.user).total, 2)
+        bookmarks = [(self.user.pk, BookmarkTestModel,
+            self.instances[0].pk, 'main', None)]
+        self.assertEqual(self.backend.bulk_add(bookmarks), 1)
+        self.assertEqual(summaries.get_summary(self.user).total, 3)
+
+    def test_templatetag(self):
+        self.backend.add(self.user, self.instances[0], 'main')
+        template = Template('{% load bookmarks_tags %}'
+            '{% bookmark_summary as summary %}'
+            '{{ summary.keys.main }} '
+            '{% for object in summary.recent_objects %}{{ object }}{% endfor %}')
+        request = self.get_request(self.user)
+        output = template.render(Context({'request': request}))
+        self.assertEqual(output, '1 summary0')
+        request = self.get_request()
+        output = template.render(Context({'request': request}))
+        self.assertEqual(output, ' ')
+
+    def test_command(self):
+        Bookmark.objects.add(self.user, self.instances[0], 'main')
+        stdout = six.StringIO()
+        call_command('bookmarks_summaries', user='summary', stdout=stdout)
+        self.assertIn('Rebuilt 1 bookmark summaries.', stdout.getvalue())
+        self.assertEqual(summaries.get_summary(self.user).total, 1)
+
+
+# RECOMMENDATIONS TESTS
+
+try:
+    import numpy
+    import scipy
+except ImportError:
+    print("Skipping recommendations tests: you must pip install numpy scipy.")
+else:
+    class RecommendationsTestCase(unittest.TestCase, BookmarkTestMixin):
+        def setUp(self):
+            self.backend = backends.ModelBackend()
+            self.instances = [self.create_instance('related%d' % i)
+                for i in range(4)]
+            a, b, c, d = self.instances
+            for name, instances in (('u1', [a, b]), ('u2', [a, b, c]),
+                    ('u3', [c, d])):
+                user = self.create_user('related_%s' % name)
+                for instance in instances:
+                    self.backend.add(user, instance, 'main')
+
+        def tearDown(self):
+            self.clean()
+
+        def related_to(self, instance):
+            return BookmarkNeighbour.objects.related_to(instance)
+
+        def test_refresh(self):
+            a, b, c, d = self.instances
+            self.assertEqual(recommendations.refresh(self.backend,
+                full=True), 4)
+            self.assertEqual(self.related_to(a), [b, c])
+            self.assertEqual(self.related_to(d), [c])
+            score = BookmarkNeighbour.objects.get(object_id=a.pk,
+                neighbour_object_id=c.pk).score
+            self.assertAlmostEqual(score, 0.5)
+
+        def test_neighbours(self):
+            a, b, c, d = self.instances
+            recommendations.refresh(self.backend, full=True, neighbours=1)
+            self.assertEqual(self.related_to(c), [d])
+
+        def test_incremental(self):
+            a, b, c, d = self.instances
+            recommendations.refresh(self.backend, full=True)
+            user = self.create_user('related_u4')
+            self.backend.add(user, a, 'main')
+            self.backend.add(user, d, 'main')
+            # the objects bookmarked by u4 (a and d), and the objects
+            # related to them (b and c) are updated
+            self.assertEqual(recommendations.refresh(self.backend), 4)
+            self.assertIn(d, self.related_to(a))
+            score = BookmarkNeighbour.objects.get(object_id=c.pk,
+                neighbour_object_id=d.pk).score
+            self.assertAlmostEqual(score, 0.5)
+            scores = self.get_scores()
+            self.assertEqual(recommendations.refresh(self.backend), 0)
+            recommendations.refresh(self.backend, full=True)
+            self.assertEqual(self.get_scores(), scores)
+
+        def test_imported(self):
+            a, b, c, d = self.instances
+            recommendations.refresh(self.backend, full=True)
+            user = self.create_user('related_u4')
+            created_at = timezone.now() - datetime.timedelta(days=365)
+            self.backend.bulk_add([(user.pk, BookmarkTestModel, a.pk, 'main',
+                created_at), (user.pk, BookmarkTestModel, d.pk, 'main',
+                created_at)])
+            self.assertEqual(recommendations.refresh(self.backend), 4)
+            self.assertIn(d, self.related_to(a))
+
+        def test_large_object_ids(self):
+            a, b, c, d = self.instances
+            # the primary key is updated instead of being inserted: this
+            # way the autoincrement sequence of the table is not moved
+            instance = self.create_instance('large')
+            BookmarkTestModel.objects.filter(pk=instance.pk).update(
+                id=1 << 32)
+            instance = BookmarkTestModel.objects.get(pk=1 << 32)
+            self.backend.add(self.create_user('related_u4'), instance,
+                'main')
+            self.backend.add(User.objects.get(username='related_u1'),
+                instance, 'main')
+            self.assertEqual(recommendations.refresh(self.backend,
+                full=True), 4)
+            self.assertEqual(self.related_to(a), [b, c])
+
+        def get_scores(self):
+            return sorted((i.object_id, i.neighbour_object_id,
+                round(i.score, 6)) for i in BookmarkNeighbour.objects.all())
+
+        def test_templatetag(self):
+            a, b, c, d = self.instances
+            recommendations.refresh(self.backend, full=True)
+            template = Template('{% load bookmarks_tags %}'
+                '{% bookmark_related for instance limit 1 as related %}'
+                '{% for object in related %}{{ object }}{% endfor %}')
+            output = template.render(Context({'instance': a}))
+            self.assertEqual(output, 'related1')
+            template = Template('{% load bookmarks_tags %}'
+                '{% bookmark_related for instance %}')
+            output = template.render(Context({'instance': a}))
+            self.assertIn('<li>related1</li>', output)
+
+        def test_command(self):
+            stdout = six.StringIO()
+            call_command('bookmarks_related', full=True, stdout=stdout)
+            self.assertIn('of 4 objects', stdout.getvalue())
+
+
+
+# BLOOM FILTER TESTS
+
+class BloomFilterTestCase(unittest.TestCase, BookmarkTestMixin):
+    def setUp(self):
+        # negligible false positives, so that tests do not depend on ids
+        self.original = settings.BLOOM
+        settings.BLOOM = dict(self.original, ERROR_RATE=1e-9)
+        cache.clear()
+        self.backend = bloom.BloomFilterBackend(backends.ModelBackend())
+        self.user = self.create_user('bloom')
+        self.instances = [self.create_instance('bloom%d' % i)
+            for i in range(4)]
+
+    def tearDown(self):
+        settings.BLOOM = self.original
+        cache.clear()
+        self.clean()
+
+    def test_filter(self):
+        bloom_filter = bloom.BloomFilter(1000, 0.01)
+        self.assertEqual(bloom_filter.hashes, 7)
+        for i in range(1000):
+            bloom_filter.add(six.text_type(i))
+        self.assertTrue(all(six.text_type(i) in bloom_filter
+            for i in range(1000)))
+        false_positives = sum(six.text_type(i) in bloom_filter
+            for i in range(1000, 11000))
+        self.assertLess(false_positives, 200)
+        data = bloom.BloomFilter.from_data(bloom_filter.to_data())
+        self.assertIn('42', data)
+        self.assertEqual(data.count, 1000)
+
+    def test_exists(self):
+        a, b, c, d = self.instances
+        self.backend.add(self.user, a, 'main')
+        self.assertTrue(self.backend.exists(self.user, a, 'main'))
+        # the filter is built once, then negatives do not query the database
+        with CaptureQueriesContext(connection) as context:
+            self.assertFalse(self.backend.exists(self.user, b, 'main'))
+            self.assertFalse(self.backend.exists(self.user, a, 'other'))
+            self.assertEqual(self.backend.exists_many(self.user,
+                [b, c, d], 'main'), [False, False, False])
+            self.assertRaises(exceptions.DoesNotExist, self.backend.get,
+                self.user, b, 'main')
+        self.assertEqual(len(context), 0)
+        self.assertEqual(self.backend.exists_many(self.user,
+            [a, b, c], 'main'), [True, False, False])
+
+    def test_add(self):
+        a, b, c, d = self.instances
+        self.assertFalse(self.backend.exists(self.user, a, 'main'))
+        self.backend.add(self.user, a, 'main')
+        self.assertTrue(self.backend.exists(self.user, a, 'main'))
+        self.backend.bulk_add([(self.user.pk, BookmarkTestModel, b.pk,
+            'main', None)])
+        self.assertTrue(self.backend.exists(self.user, b, 'main'))
+
+    def test_stale_filter(self):
+        a, b, c, d = self.instances
+        self.assertFalse(self.backend.exists(self.user, a, 'main'))
+        # a filter built before a bookmark is added is not used
+        version = bloom.get_version(self.user)
+        stale = bloom.build(self.user, self.backend)
+        self.backend.add(self.user, a, 'main')
+        bloom._store(self.user, version, stale)
+        self.assertTrue(self.backend.exists(self.user, a, 'main'))
+
+    def test_missing_version(self):
+        versions = []
+
+        def incr(key, *args):
+            # the version is missing, and added by a filter being built
+            versions.append(bloom.get_version(self.user))
+            raise ValueError
+        cache.incr = incr
+        try:
+            version = bloom.incr_version(self.user)
+        finally:
+            del cache.incr
+        self.assertNotEqual(version, versions[0])
+        self.assertEqual(bloom.get_version(self.user), version)
+
+    def test_buffered_build(self):
+        a, b, c, d = self.instances
+        backend = backends.BufferedModelBackend()
+        backend.flush_interval = None
+        backend.add(self.user, a, 'main')
+        self.assertIn(bloom._get_instance_item(a, 'main'),
+            bloom.build(self.user, backend))
+        self.assertEqual(len(backend.buffer), 0)
+
+    def test_remove(self):
+        a, b, c, d = self.instances
+        self.backend.add(self.user, a, 'main')
+        self.backend.remove(self.user, a, 'main')
+        # removed bookmarks are possible positives checked by the backend
+        self.assertFalse(self.backend.exists(self.user, a, 'main'))
+
+
+
+# INDEX TESTS
+
+class IndexTestCase(unittest.TestCase, BookmarkTestMixin):
+    def setUp(self):
+        index.clear()
+        self.backend = index.IndexedBackend(backends.ModelBackend())
+        self.user = self.create_user('index')
+        self.instances = [self.create_instance('index%d' % i)
+            for i in range(4)]
+
+    def tearDown(self):
+        index.clear()
+        self.clean()
+
+    def test_index(self):
+        bookmark_index = index.BookmarkIndex()
+        for item in (30, 10, 20, 10):
+            bookmark_index.add('main', item)
+        self.assertEqual(list(bookmark_index.codes['main']), [10, 20, 30])
+        self.assertTrue(bookmark_index.contains('main', 20))
+        self.assertFalse(bookmark_index.contains('main', 15))
+        self.assertFalse(bookmark_index.contains('other', 20))
+        bookmark_index.remove('main', 20)
+        self.assertFalse(bookmark_index.contains('main', 20))
+        self.assertEqual(len(bookmark_index), 2)
+        self.assertEqual(bookmark_index.nbytes, 16)
+        self.assertIsNone(index.encode(1, 'abc'))
+        self.assertIsNone(index.encode(1, 1 << 32))
+
+    def test_exists(self):
+        a, b, c, d = self.instances
+        self.backend.add(self.user, a, 'main')
+        self.backend.add(self.user, b, 'other')
+        with CaptureQueriesContext(connection) as context:
+            self.assertTrue(self.backend.exists(self.user, a, 'main'))
+            self.assertFalse(self.backend.exists(self.user, b, 'main'))
+            self.assertEqual(self.backend.exists_many(self.user,
+                [a, b, c], 'main'), [True, False, False])
+            self.assertEqual(self.backend.exists_many(self.user,
+                [a, b, c], 'other'), [False, True, False])
+            self.assertRaises(exceptions.DoesNotExist, self.backend.get,
+                self.user, c, 'main')
+        # the index is loaded once
+        self.assertEqual(len(context), 1)
+        self.assertEqual(index.get_memory_usage(), (1, 2, 16))
+
+    def test_other_backends(self):
+        a, b, c, d = self.instances
+
+        class Backend(object):
+            # not storing bookmarks using Django models
+            def filter(self, **kwargs):
+                return backends.ModelBackend().filter(**kwargs)
+        self.backend.add(self.user, a, 'main')
+        bookmark_index = index.BookmarkIndex.build(self.user, Backend())
+        self.assertTrue(bookmark_index.contains('main',
+            index._get_item(a)))
+        self.assertEqual(len(bookmark_index), 1)
+
+    def test_buffered_backend(self):
+        a, b, c, d = self.instances
+        backend = backends.BufferedModelBackend()
+        backend.flush_interval = None
+        backend.add(self.user, a, 'main')
+        bookmark_index = index.BookmarkIndex.build(self.user, backend)
+        self.assertTrue(bookmark_index.contains('main',
+            index._get_item(a)))
+
+    def test_add_remove(self):
+        a, b, c, d = self.instances
+        self.assertFalse(self.backend.exists(self.user, a, 'main'))
+        self.backend.add(self.user, a, 'main')
+        self.assertTrue(self.backend.exists(self.user, a, 'main'))
+        self.backend.remove(self.user, a, 'main')
+        self.assertFalse(self.backend.exists(self.user, a, 'main'))
+        self.backend.bulk_add([(self.user.pk, BookmarkTestModel, b.pk,
+            'main', None)])
+        self.assertTrue(self.backend.exists(self.user, b, 'main'))
+
+    def test_middleware(self):
+        a, b, c, d = self.instances
+        self.backend.exists(self.user, a, 'main')
+        self.assertEqual(index.get_memory_usage()[0], 1)
+        middleware = index.IndexMiddleware()
+        request = RequestFactory(self.user).get('/')
+        middleware.process_request(request)
+        self.assertEqual(index.get_memory_usage()[0], 0)
+        self.backend.exists(self.user, a, 'main')
+        middleware.process_response(request, None)
+        self.assertEqual(index.get_memory_usage()[0], 0)
+
+    def test_max_users(self):
+        original = settings.INDEX
+        settings.INDEX = dict(original, MAX_USERS=1)
+        try:
+            a = self.instances[0]
+            other = self.create_user('index_other')
+            self.backend.exists(self.user, a, 'main')
+            self.backend.exists(other, a, 'main')
+            self.assertEqual(index.get_memory_usage()[0], 1)
+        finally:
+            settings.INDEX = original
+
+
+# TRENDING TESTS
+
+class TrendingTestCase(unittest.TestCase, BookmarkTestMixin):
+    def setUp(self):
+        self.backend = trending.TrendingBackend(backends.ModelBackend())
+        self.instances = [self.create_instance('trending%d' % i)
+            for i in range(3)]
+        self.users = [self.create_user('trending_u%d' % i) for i in range(2)]
+
+    def tearDown(self):
+        self.clean()
+
+    def test_logaddexp(self):
+        self.assertAlmostEqual(trending.logaddexp(0, 0), math.log(2))
+        self.assertAlmostEqual(trending.logaddexp(1000, 1000),
+            1000 + math.log(2))
+        self.assertAlmostEqual(trending.logsubexp(math.log(3), 0),
+            math.log(2))
+        self.assertIsNone(trending.logsubexp(1, 1))
+
+    def test_weight(self):
+        now = datetime.datetime(2016, 1, 1, tzinfo=timezone.utc)
+        later = now + datetime.timedelta(seconds=3600)
+        self.assertAlmostEqual(trending.get_weight(later, trending.get_rate(
+            3600)) - trending.get_weight(now, trending.get_rate(3600)),
+            math.log(2))
+
+    def test_get_trending(self):
+        a, b, c = self.instances
+        for user in self.users:
+            self.backend.add(user, a, 'main')
+        self.backend.add(self.users[0], b, 'main')
+        self.backend.add(self.users[0], c, 'other')
+        self.assertEqual(trending.get_trending(BookmarkTestModel), [a, b])
+        self.assertEqual(trending.get_trending(BookmarkTestModel, limit=1),
+            [a])
+        self.assertEqual(trending.get_trending(BookmarkTestModel,
+            key='other'), [c])
+        score = TrendingScore.objects.get(object_id=a.pk)
+        self.assertAlmostEqual(score.get_value(), 2, places=3)
+
+    def test_remove(self):
+        a, b, c = self.instances
+        for user in self.users:
+            self.backend.add(user, a, 'main')
+        self.backend.remove(self.users[0], a, 'main')
+        score = TrendingScore.objects.get(object_id=a.pk)
+        self.assertAlmostEqual(score.get_value(), 1, places=3)
+        self.backend.remove(self.users[1], a, 'main')
+        self.assertFalse(TrendingScore.objects.filter_for(a).exists())
+
+    def test_remove_all_for(self):
+        a, b, c = self.instances
+        self.backend.add(self.users[0], a, 'main')
+        self.backend.add(self.users[0], b, 'main')
+        self.backend.remove_all_for(a)
+        self.assertEqual(trending.get_trending(BookmarkTestModel), [b])
+
+
+try:
+    import numpy
+except ImportError:
+    print("Skipping trending recompute tests: you must pip install numpy.")
+else:
+    class TrendingRecomputeTestCase(unittest.TestCase, BookmarkTestMixin):
+        def setUp(self):
+            self.backend = backends.ModelBackend()
+            self.instances = [self.create_instance('recompute%d' % i)
+                for i in range(2)]
+            a, b = self.instances
+            for i in range(2):
+                user = self.create_user('recompute_u%d' % i)
+                self.backend.add(user, a, 'main')
+                self.backend.add(user, b, 'main' if i else 'other')
+
+        def tearDown(self):
+            self.clean()
+
+        def test_recompute(self):
+            a, b = self.instances
+            self.assertEqual(trending.recompute(self.backend,
+                batch_size=1), 3)
+            self.assertEqual(trending.get_trending(BookmarkTestModel), [a, b])
+            score = TrendingScore.objects.get(object_id=a.pk)
+            self.assertAlmostEqual(score.get_value(), 2, places=3)
+
+        def test_recompute_after_add(self):
+            a, b = self.instances
+            trending.recompute(self.backend)
+            scores = dict(((i.object_id, i.key), i.score)
+                for i in TrendingScore.objects.all())
+            trending.TrendingBackend(self.backend).add(
+                self.create_user('recompute_u2'), b, 'main')
+            trending.recompute(self.backend)
+            score = TrendingScore.objects.get(object_id=b.pk, key='main')
+            self.assertGreater(score.score, scores[b.pk, 'main'])
+            self.assertEqual(TrendingScore.objects.count(), len(scores))
+
+        def test_concurrent_add(self):
+            a, b = self.instances
+            compute = trending._compute
+
+            def compute_and_add(*args):
+                # the bookmark is added while scores are computed
+                scores = compute(*args)
+                trending.TrendingBackend(self.backend).add(
+                    self.create_user('recompute_u2'), b, 'main')
+                return scores
+            trending._compute = compute_and_add
+            try:
+                trending.recompute(self.backend)
+            finally:
+                trending._compute = compute
+            score = TrendingScore.objects.get(object_id=b.pk, key='main')
+            trending.recompute(self.backend)
+            self.assertAlmostEqual(score.score, TrendingScore.objects.get(
+                object_id=b.pk, key='main').score)
+
+        def test_command(self):
+            stdout = six.StringIO()
+            call_command('bookmarks_trending', stdout=stdout)
+            self.assertIn('Scored 3 objects', stdout.getvalue())
+
+
+# DEFERRED TESTS
+
+class DeferredTestCase(unittest.TestCase, BookmarkTestMixin):
+    template = Template(
+        '{% load bookmarks_tags %}'
+        '{% for instance in instances %}'
+        '<li class="{% bookmark_state for instance %}">'
+        '{% bookmark_form for instance %}</li>'
+        '{% endfor %}')
+
+    def setUp(self):
+        handlers.library.register(BookmarkTestModel)
+        self.handler = handlers.library.get_handler(BookmarkTestModel)
+        self.user = self.create_user('deferred')
+        self.instances = [self.create_instance('deferred%d' % i)
+            for i in range(3)]
+        self.handler.backend.add(self.user, self.instances[0],
+            settings.DEFAULT_KEY)
+        self.middleware = deferred.DeferredBookmarksMiddleware()
+
+    def tearDown(self):
+        self.clean()
+        handlers.library.unregister(BookmarkTestModel)
+
+    def render(self, template, request, **kwargs):
+        kwargs['request'] = request
+        return template.render(Context(kwargs))
+
+    def test_bookmark_state(self):
+        request = self.get_request(self.user)
+        template = Template('{% load bookmarks_tags %}'
+            '{% bookmark_state for instance %}|'
+            '{% bookmark_state for instance values "yes" "no" %}')
+        self.assertEqual(self.render(template, request,
+            instance=self.instances[0]), 'bookmarked|yes')
+        self.assertEqual(self.render(template, request,
+            instance=self.instances[1]), '|no')
+        self.assertEqual(self.render(template, self.get_request(),
+            instance=self.instances[0]), '|no')
+
+    def test_deferred(self):
+        request = self.get_request(self.user)
+        self.middleware.process_request(request)
+        with CaptureQueriesContext(connection) as context:
+            html = self.render(self.template, request,
+                instances=self.instances)
+        # bookmarks are not checked while rendering
+        self.assertEqual(len(context), 0)
+        self.assertEqual(html.count('<!--bookmarks:'), 6)
+        with CaptureQueriesContext(connection) as context:
+            response = self.middleware.process_response(request,
+                http.HttpResponse(html))
+        self.assertEqual(len(context), 1)
+        content = response.content.decode('utf-8')
+        self.assertNotIn('<!--bookmarks:', content)
+        self.assertEqual(content.count('<li class="bookmarked">'), 1)
+        self.assertEqual(content.count('<li class="">'), 2)
+        self.assertEqual(content.count(
+            'value="add" style="display: none;"'), 1)
+        self.assertEqual(content.count(
+            'value="remove" style="display: none;"'), 2)
+
+    def test_not_deferred(self):
+        # the same markup is rendered without the middleware
+        request = self.get_request(self.user)
+        html = self.render(self.template, request, instances=self.instances)
+        self.assertNotIn('<!--bookmarks:', html)
+        self.assertEqual(html.count('<li class="bookmarked">'), 1)
+        self.assertEqual(html.count('value="add" style="display: none;"'), 1)
+
+    def test_foreign_placeholders(self):
+        request = self.get_request(self.user)
+        self.middleware.process_request(request)
+        other = deferred.Collector(request)
+        placeholder = other.defer(self.handler.backend, self.instances[0],
+            settings.DEFAULT_KEY, lambda exists: 'x')
+        response = self.middleware.process_response(request,
+            http.HttpResponse(placeholder))
+        self.assertEqual(response.content.decode('utf-8'), placeholder)
+
+    def test_streaming(self):
+        request = self.get_request(self.user)
+        self.middleware.process_request(request)
+        html = self.render(self.template, request, instances=self.instances)
+        expected = self.middleware.process_response(request,
+            http.HttpResponse(html)).content
+        for buffer_size in (deferred.STREAM_BUFFER_SIZE, 10):
+            request = self.get_request(self.user)
+            self.middleware.process_request(request)
+            html = self.render(self.template, request,
+                instances=self.instances).encode('utf-8')
+            # placeholders are split across chunks
+            chunks = [html[i:i + 7] for i in range(0, len(html), 7)]
+            original, deferred.STREAM_BUFFER_SIZE = (
+                deferred.STREAM_BUFFER_SIZE, buffer_size)
+            try:
+                response = self.middleware.process_response(request,
+                    http.StreamingHttpResponse(chunks))
+                with CaptureQueriesContext(connection) as context:
+                    content = b''.join(response.streaming_content)
+            finally:
+                deferred.STREAM_BUFFER_SIZE = original
+            self.assertEqual(content, expected)
+            if buffer_size == original:
+                self.assertEqual(len(context), 1)
+
+    def test_encoded(self):
+        request = self.get_request(self.user)
+        self.middleware.process_request(request)
+        html = self.render(self.template, request, instances=self.instances)
+        response = http.HttpResponse(html)
+        response['Content-Encoding'] = 'gzip'
+        self.assertRaises(ImproperlyConfigured,
+            self.middleware.process_response, request, response)
+
+    def test_form_context(self):
+        request = self.get_request(self.user)
+        self.middleware.process_request(request)
+        node_class = bookmarks_tags.BookmarkFormNode
+        get_template_context = node_class.__dict__['get_template_context']
+        instances = []
+
+        def record(cls, context, *args):
+            instances.append(context['instance'])
+            return get_template_context.__get__(None, cls)(context, *args)
+        node_class.get_template_context = classmethod(record)
+        try:
+            html = self.render(self.template, request,
+                instances=self.instances)
+            self.middleware.process_response(request, http.HttpResponse(html))
+        finally:
+            node_class.get_template_context = get_template_context
+        # each form is rendered using its own template context
+        self.assertEqual(instances, self.instances)
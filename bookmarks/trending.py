@@ -0,0 +1,302 @@
+"""
+Trending objects, scored by bookmarks with exponential time decay.
+
+Each bookmark contributes to the score of its object and key a weight
+that halves every *HALF_LIFE* seconds. Since all the weights decay at the
+same rate, the ranking never changes while time passes: scores are stored
+as the logarithm of the sum of the weights measured at a fixed epoch,
+
+    score = log(sum(exp(rate * (created_at - EPOCH))))
+
+so that adding or removing a bookmark only updates the score of its
+object, and the top objects of a content type and key are retreived with
+a single indexed query, e.g.::
+
+    from bookmarks import trending
+
+    trending.get_trending(Article, key='favourite', limit=10)
+
+If *settings.GENERIC_BOOKMARKS_TRENDING['ENABLED']* is True, the backend
+is wrapped by *TrendingBackend*, updating scores when bookmarks are added
+or removed. Scores can be recomputed from the bookmarks history using the
+*bookmarks_trending* management command (e.g. after bookmarks are added
+in bulk by *bookmarks_import*), which requires NumPy. Bookmarks added or
+removed while scores are recomputed are taken into account, as long as
+bookmarks and scores are stored in the same database.
+
+Only bookmarks of objects with integer primary keys are scored.
+"""
+import calendar
+import math
+import time
+
+from django.db import IntegrityError, connections, router, transaction
+from django.utils import six
+
+from bookmarks import settings, models, utils, keys
+
+try:
+    from bookmarks.aio import AsyncBackendMixin
+except SyntaxError:
+    # the asynchronous API requires Python >= 3.5
+    AsyncBackendMixin = object
+
+# 2015-01-01T00:00:00Z
+EPOCH = 1420070400
+
+
+def get_rate(half_life=None):
+    """
+    Return the decay rate corresponding to *half_life* seconds
+    (default: *settings.GENERIC_BOOKMARKS_TRENDING['HALF_LIFE']*).
+    """
+    return math.log(2) / (half_life or settings.TRENDING['HALF_LIFE'])
+
+
+def get_timestamp(created_at):
+    if created_at.tzinfo is None:
+        timestamp = time.mktime(created_at.timetuple())
+    else:
+        timestamp = calendar.timegm(created_at.utctimetuple())
+    return timestamp + created_at.microsecond / 1e6
+
+
+def get_weight(created_at, rate=None):
+    """
+    Return the logarithm of the weight of a bookmark created at
+    *created_at*, measured at the epoch.
+    """
+    return (rate or get_rate()) * (get_timestamp(created_at) - EPOCH)
+
+
+def logaddexp(a, b):
+    """
+    Return *log(exp(a) + exp(b))* without overflows.
+    """
+    if a < b:
+        a, b = b, a
+    return a + math.log1p(math.exp(b - a))
+
+
+def logsubexp(a, b):
+    """
+    Return *log(exp(a) - exp(b))*, or None if the result is not positive.
+    """
+    if b >= a or a - b < 1e-9:
+        return None
+    return a + math.log1p(-math.exp(b - a))
+
+
+def _update(content_type_id, object_id, key, weight, add):
+    manager = models.TrendingScore.objects
+    lookups = {
+        'content_type_id': content_type_id,
+        'object_id': object_id,
+        'key': key,
+    }
+    with transaction.atomic():
+        try:
+            trending_score = manager.select_for_update().get(**lookups)
+        except models.TrendingScore.DoesNotExist:
+            if not add:
+                return
+            try:
+                with transaction.atomic():
+                    manager.create(score=weight, **lookups)
+                return
+            except IntegrityError:
+                # created concurrently
+                trending_score = manager.select_for_update().get(**lookups)
+        if add:
+            score = logaddexp(trending_score.score, weight)
+        else:
+            score = logsubexp(trending_score.score, weight)
+        if score is None:
+            trending_score.delete()
+        else:
+            manager.filter(pk=trending_score.pk).update(score=score)
+
+
+def record(instance, key, created_at, add=True):
+    """
+    Update the score of *instance* and *key* after a bookmark created
+    at *created_at* is added (or removed if *add* is False).
+    """
+    if not isinstance(instance.pk, six.integer_types):
+        return
+    content_type_id = utils.get_content_type_for_model(type(instance)).pk
+    _update(content_type_id, instance.pk, key, get_weight(created_at), add)
+
+
+def get_trending(model, key=None, limit=10):
+    """
+    Return the *limit* trending *model* instances for *key*
+    (default: *settings.GENERIC_BOOKMARKS_DEFAULT_KEY*), best first.
+    Deleted instances are skipped.
+    """
+    object_ids = [i.object_id for i in models.TrendingScore.objects.top(
+        model, key, limit)]
+    objects = model._default_manager.in_bulk(object_ids)
+    return [objects[i] for i in object_ids if i in objects]
+
+
+def _sum_weights(scores, sources, rate, batch_size):
+    # add to *scores* the weights of the bookmarks retreived by *sources*
+    # (see *bookmarks.recommendations._get_sources*)
+    import numpy as np
+    for queryset, fields, content_type_id in sources:
+        queryset = queryset.order_by('pk').values_list('pk', 'key',
+            'created_at', *fields)
+        rows = list(queryset[:batch_size])
+        while rows:
+            # keys are read as names starting from Django 1.8
+            codes = np.array([(keys.get_code(i[1], create=False),) + i[3:]
+                for i in rows], dtype=np.int64)
+            if content_type_id is not None:
+                codes = np.column_stack([codes[:, 0],
+                    np.full(len(codes), content_type_id, np.int64),
+                    codes[:, 1]])
+            weights = rate * (np.array([get_timestamp(i[2]) for i in rows]) -
+                EPOCH)
+            # sum the weights of each (key, content type, object) group
+            groups, inverse = np.unique(codes, axis=0, return_inverse=True)
+            order = np.argsort(inverse.ravel(), kind='mergesort')
+            starts = np.searchsorted(inverse.ravel()[order],
+                np.arange(len(groups)))
+            sums = np.logaddexp.reduceat(weights[order], starts)
+            for (code, ct, object_id), weight in zip(groups.tolist(), sums):
+                identity = (keys.get_name(code), ct, object_id)
+                score = scores.get(identity)
+                scores[identity] = weight if score is None else logaddexp(
+                    score, weight)
+            rows = list(queryset.filter(pk__gt=rows[-1][0])[:batch_size])
+
+
+def _sum_backend_weights(scores, backend, rate):
+    # backends not storing bookmarks using Django models
+    for bookmark in backend.filter():
+        if bookmark.user_id is None or not isinstance(
+                bookmark.object_id, six.integer_types):
+            continue
+        identity = (bookmark.key, bookmark.content_type_id,
+            bookmark.object_id)
+        weight = get_weight(bookmark.created_at, rate)
+        score = scores.get(identity)
+        scores[identity] = weight if score is None else logaddexp(
+            score, weight)
+
+
+def _get_sources(backend, watermarks, new):
+    # return the sources retreiving the bookmarks up to *watermarks*,
+    # or the *new* ones after them
+    from bookmarks import recommendations
+    sources = []
+    for queryset, fields, content_type_id in recommendations._get_sources(
+            backend):
+        last_pk = watermarks.get(recommendations._get_source_name(queryset))
+        if new and last_pk is not None:
+            queryset = queryset.filter(pk__gt=last_pk)
+        elif not new:
+            if last_pk is None:
+                continue
+            queryset = queryset.filter(pk__lte=last_pk)
+        sources.append((queryset, fields, content_type_id))
+    return sources
+
+
+def _compute(backend, rate, batch_size, watermarks):
+    # return a dict mapping *(key, content_type_id, object_id)* tuples
+    # to the scores of the bookmarks up to *watermarks*
+    scores = {}
+    _sum_weights(scores, _get_sources(backend, watermarks, False), rate,
+        batch_size)
+    return scores
+
+
+def _lock_scores():
+    # block the updates of scores until the end of the transaction:
+    # writing transactions are serialized by SQLite
+    using = router.db_for_write(models.TrendingScore)
+    connection = connections[using]
+    if connection.vendor == 'postgresql':
+        connection.cursor().execute('LOCK TABLE %s IN EXCLUSIVE MODE' %
+            connection.ops.quote_name(models.TrendingScore._meta.db_table))
+    elif connection.vendor != 'sqlite':
+        # also locks the gaps between rows in MySQL
+        list(models.TrendingScore.objects.select_for_update().values_list(
+            'pk', flat=True))
+
+
+def recompute(backend=None, half_life=None, batch_size=None):
+    """
+    Recompute all the scores from the bookmarks stored by *backend*,
+    processing bookmarks in chunks of *batch_size*, and return the number
+    of scored objects and keys.
+
+    Scores are computed from the bookmarks existing when the recomputation
+    starts, then the scores table is locked, the bookmarks added meanwhile
+    are added and the scores are replaced: *TrendingBackend* updates scores
+    in the transactions adding or removing bookmarks, so that they are
+    never lost or counted twice. Bookmarks of backends not storing them
+    using Django models are read while scores are locked.
+    """
+    from bookmarks import recommendations
+    if backend is None:
+        from bookmarks.handlers import library
+        backend = library.backend
+    rate = get_rate(half_life)
+    batch_size = batch_size or settings.TRENDING['BATCH_SIZE']
+    is_model_backend = hasattr(backend, 'get_models')
+    scores = {}
+    if is_model_backend:
+        watermarks = recommendations.get_watermarks(backend)
+        scores = _compute(backend, rate, batch_size, watermarks)
+    with transaction.atomic():
+        _lock_scores()
+        models.TrendingScore.objects.all().delete()
+        if is_model_backend:
+            _sum_weights(scores, _get_sources(backend, watermarks, True),
+                rate, batch_size)
+        else:
+            _sum_backend_weights(scores, backend, rate)
+        trending_scores = [models.TrendingScore(key=key, content_type_id=ct,
+            object_id=object_id, score=float(score))
+            for (key, ct, object_id), score in scores.items()]
+        for i in range(0, len(trending_scores), batch_size):
+            models.TrendingScore.objects.bulk_create(
+                trending_scores[i:i + batch_size])
+    return len(trending_scores)
+
+
+class TrendingBackend(AsyncBackendMixin):
+    """
+    Wrap a bookmarks *backend*, keeping trending scores up to date.
+    Other attributes are delegated to the backend.
+
+    Scores are updated in the transactions adding or removing bookmarks
+    (see *recompute*). Bookmarks added using *bulk_add* are not scored
+    until scores are recomputed. Coroutine methods run the wrapped
+    synchronous methods in the bookmarks thread pool (see *bookmarks.aio*).
+    """
+    def __init__(self, backend):
+        self.backend = backend
+
+    def add(self, user, instance, key):
+        with transaction.atomic():
+            bookmark = self.backend.add(user, instance, key)
+            record(instance, key, bookmark.created_at)
+        return bookmark
+
+    def remove(self, user, instance, key):
+        with transaction.atomic():
+            bookmark = self.backend.remove(user, instance, key)
+            record(instance, key, bookmark.created_at, add=False)
+        return bookmark
+
+    def remove_all_for(self, instance):
+        self.backend.remove_all_for(instance)
+        if isinstance(instance.pk, six.integer_types):
+            models.TrendingScore.objects.filter_for(instance).delete()
+
+    def __getattr__(self, attr):
+        return getattr(self.backend, attr)
@@ -0,0 +1,167 @@
+"""
+Database triggers removing the bookmarks of deleted objects.
+
+By default the registry connects a *pre_delete* receiver to each registered
+model, removing bookmarks whenever an instance is deleted. The receiver
+prevents Django from deleting querysets without retreiving their
+instances: if the models are registered with *db_cascade=True* (or
+*settings.GENERIC_BOOKMARKS_DB_CASCADE* is True) the receiver is not
+connected, and the database itself removes orphaned bookmarks using the
+triggers installed by this module.
+
+Triggers can be installed using the *bookmarks_triggers* management
+command, or in a migration of the app defining the bookmarked model, e.g.::
+
+    from bookmarks.triggers import InstallTriggers
+
+    class Migration(migrations.Migration):
+        dependencies = [
+            ('myapp', '0001_initial'),
+            ('bookmarks', '0005_stringbookmark'),
+        ]
+        operations = [
+            InstallTriggers('Article'),
+        ]
+
+SQLite and PostgreSQL are supported. Triggers only work if bookmarks are
+stored in the database of the bookmarked objects, using generic bookmark
+tables (dedicated bookmark models are deleted in cascade by Django).
+"""
+from django.db import connections, router
+from django.db.migrations.operations.base import Operation
+
+from bookmarks import models
+
+SQLITE_CREATE = """
+CREATE TRIGGER IF NOT EXISTS {name} AFTER DELETE ON {table}
+FOR EACH ROW BEGIN
+{statements}
+END"""
+
+SQLITE_DROP = 'DROP TRIGGER IF EXISTS {name}'
+
+POSTGRESQL_CREATE_FUNCTION = """
+CREATE OR REPLACE FUNCTION {name}() RETURNS trigger AS $$
+BEGIN
+{statements}
+    RETURN OLD;
+END;
+$$ LANGUAGE plpgsql"""
+
+POSTGRESQL_CREATE = """
+CREATE TRIGGER {name} AFTER DELETE ON {table}
+FOR EACH ROW EXECUTE PROCEDURE {name}()"""
+
+POSTGRESQL_DROP = [
+    'DROP TRIGGER IF EXISTS {name} ON {table}',
+    'DROP FUNCTION IF EXISTS {name}()',
+]
+
+DELETE = """    DELETE FROM {bookmark_table} WHERE
+        {bookmark_table}.object_id = OLD.{pk} AND
+        {bookmark_table}.content_type_id = (
+            SELECT id FROM {content_type_table}
+            WHERE app_label = '{app_label}' AND model = '{model_name}');"""
+
+
+def get_bookmark_tables(model):
+    """
+    Return the names of the tables storing the generic bookmarks
+    of *model* instances.
+    """
+    bookmark_model = models.get_bookmark_model(model)
+    tables = [bookmark_model._meta.db_table]
+    if bookmark_model is models.Bookmark:
+        tables.append(models.BookmarkArchive._meta.db_table)
+    return tables
+
+
+def get_sql(model, connection):
+    """
+    Return a tuple *(install, uninstall)* of lists of SQL statements
+    managing the trigger of *model* in the database of *connection*.
+    """
+    from django.contrib.contenttypes.models import ContentType
+    opts = model._meta
+    quote = connection.ops.quote_name
+    name = 'bookmarks_cleanup_%s' % opts.db_table
+    statements = '\n'.join(DELETE.format(bookmark_table=quote(table),
+        pk=quote(opts.pk.column),
+        content_type_table=quote(ContentType._meta.db_table),
+        app_label=opts.app_label, model_name=opts.model_name)
+        for table in get_bookmark_tables(model))
+    context = {
+        'name': quote(name),
+        'table': quote(opts.db_table),
+        'statements': statements,
+    }
+    vendor = connection.vendor
+    if vendor == 'sqlite':
+        return ([SQLITE_CREATE.format(**context)],
+            [SQLITE_DROP.format(**context)])
+    if vendor == 'postgresql':
+        uninstall = [i.format(**context) for i in POSTGRESQL_DROP]
+        install = [POSTGRESQL_CREATE_FUNCTION.format(**context),
+            uninstall[0], POSTGRESQL_CREATE.format(**context)]
+        return install, uninstall
+    raise NotImplementedError(
+        'Bookmark triggers are not supported by %s.' % vendor)
+
+
+def _execute(statements, using):
+    cursor = connections[using].cursor()
+    for statement in statements:
+        cursor.execute(statement)
+
+
+def install(model, using=None):
+    """
+    Install the trigger removing the bookmarks of deleted *model*
+    instances. Installing an existing trigger has no effect.
+    """
+    using = using or router.db_for_write(model)
+    _execute(get_sql(model, connections[using])[0], using)
+
+
+def uninstall(model, using=None):
+    """
+    Remove the trigger of *model*, if present.
+    """
+    using = using or router.db_for_write(model)
+    _execute(get_sql(model, connections[using])[1], using)
+
+
+class InstallTriggers(Operation):
+    """
+    Migration operation installing the trigger of the model named
+    *model_name*, defined by the app of the migration.
+    """
+    reversible = True
+
+    def __init__(self, model_name):
+        self.model_name = model_name
+
+    def state_forwards(self, app_label, state):
+        pass
+
+    def _get_model(self, app_label, state):
+        return state.render().get_model(app_label, self.model_name)
+
+    def database_forwards(self, app_label, schema_editor, from_state,
+            to_state):
+        model = self._get_model(app_label, to_state)
+        connection = schema_editor.connection
+        if self.allowed_to_migrate(connection.alias, model):
+            for statement in get_sql(model, connection)[0]:
+                schema_editor.execute(statement)
+
+    def database_backwards(self, app_label, schema_editor, from_state,
+            to_state):
+        model = self._get_model(app_label, from_state)
+        connection = schema_editor.connection
+        if self.allowed_to_migrate(connection.alias, model):
+            for statement in get_sql(model, connection)[1]:
+                schema_editor.execute(statement)
+
+    def describe(self):
+        return 'Install bookmark triggers for %s' % self.model_name
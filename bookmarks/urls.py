@@ -6,4 +6,5 @@ except ImportError:
 urlpatterns = patterns('bookmarks.views',
     url(r'^bookmark/$', 'bookmark', name='bookmarks_bookmark'),
     url(r'^ajax_form/$', 'ajax_form', name='bookmarks_ajax_form'),
+    url(r'^export/$', 'export', name='bookmarks_export'),
 )
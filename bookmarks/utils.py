@@ -1,3 +1,4 @@
+import heapq
 from functools import wraps
 
 from django.contrib.contenttypes.models import ContentType
@@ -32,6 +33,103 @@ get_content_type_for_model = memoize(get_content_type_for_model,
     _get_content_type_for_model_cache, 1)
 
 
+def get_pk_field(model):
+    """
+    Return the field storing the primary key values of *model*,
+    following multi-table inheritance.
+    """
+    pk = model._meta.pk
+    while pk.rel is not None:
+        pk = pk.rel.get_related_field()
+    return pk
+
+
+def to_pk(model, object_id):
+    """
+    Convert *object_id*, as stored in bookmarks (e.g. a string for
+    *StringBookmark*), to a primary key value of *model*.
+    """
+    return get_pk_field(model).to_python(object_id)
+
+
+class _Reversed(object):
+    # reverses the ordering of the wrapped value
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+
+def merge_sorted(iterables, key, reverse=False):
+    """
+    Lazily merge the *iterables*, each one sorted by *key* (in descending
+    order if *reverse* is True), in a single sorted iterator.
+
+    Like *heapq.merge*, but supporting *key* and *reverse* in Python 2.
+    """
+    heap = []
+    for index, iterable in enumerate(iterables):
+        iterator = iter(iterable)
+        for item in iterator:
+            value = _Reversed(key(item)) if reverse else key(item)
+            # the index makes entries unique: items are never compared
+            heap.append([value, index, item, iterator])
+            break
+    heapq.heapify(heap)
+    while heap:
+        entry = heap[0]
+        yield entry[2]
+        for item in entry[3]:
+            entry[0] = _Reversed(key(item)) if reverse else key(item)
+            entry[2] = item
+            heapq.heapreplace(heap, entry)
+            break
+        else:
+            heapq.heappop(heap)
+
+
+def load_contents(bookmarks):
+    """
+    Retreive in bulk the content objects of given *bookmarks*, using one
+    query for each content type, and store them in the bookmarks, so that
+    *bookmark.content_object* does not hit the db.
+
+    Content objects are retreived using the default manager of their model
+    (i.e. regardless of the database the bookmarks are stored in).
+    """
+    generics = {}
+    for i in bookmarks:
+        generics.setdefault(i.content_type_id, set()).add(i.object_id)
+    relations = {}
+    for content_type_id, pk_list in generics.items():
+        content_type = ContentType.objects.get_for_id(content_type_id)
+        manager = content_type.model_class()._default_manager
+        relations[content_type_id] = manager.in_bulk(pk_list)
+    for i in bookmarks:
+        content_type = ContentType.objects.get_for_id(i.content_type_id)
+        i._content_type_cache = content_type
+        # e.g. UUID primary keys are stored as strings
+        i._content_object_cache = relations[i.content_type_id].get(
+            to_pk(content_type.model_class(), i.object_id))
+
+
+def load_users(bookmarks):
+    """
+    Retreive in bulk the users of given *bookmarks*, and store them in the
+    bookmarks, so that *bookmark.user* does not hit the db.
+    """
+    from django.contrib.auth.models import User
+    users = User.objects.in_bulk(set(i.user_id for i in bookmarks))
+    for i in bookmarks:
+        i._user_cache = users.get(i.user_id)
+
+
 def get_templates(instance, key, name, base='bookmarks'):
     """
     Return a list of template names based on given *instance* and
@@ -3,7 +3,8 @@ from django.shortcuts import render_to_response
 from django.template import RequestContext
 from django import http
 
-from bookmarks import handlers, signals, utils
+from bookmarks import handlers, instrumentation, signals, utils
+from bookmarks import export as bookmarks_export
 from bookmarks.templatetags import bookmarks_tags
 
 ERRORS = {
@@ -14,6 +15,7 @@ ERRORS = {
 }
 
 
+@instrumentation.instrumented('view.bookmark')
 def bookmark(request):
     """
     Add or remove a bookmark based on POST data.
@@ -57,8 +59,8 @@ def bookmark(request):
                         receiver.__name__)
 
             # adding or removing the bookmark
+            created = not form.bookmark_exists()
             bookmark = handler.save(request, form)
-            created = bool(bookmark.pk)
 
             # post-save signal
             # note: one receiver is always called: *handler.post_save*
@@ -75,6 +77,7 @@ def bookmark(request):
     return http.HttpResponseForbidden('Forbidden.')
 
 
+@instrumentation.instrumented('view.ajax_form')
 def ajax_form(request, extra_context=None,
         template=bookmarks_tags.BookmarkFormNode.template_name):
     """
@@ -126,3 +129,26 @@ def ajax_form(request, extra_context=None,
 
     # only answer AJAX requests
     return http.HttpResponseForbidden('Forbidden.')
+
+
+def export(request, format=None):
+    """
+    Stream all the bookmarks of the current user, as CSV or JSON Lines.
+
+    The format can be given as view argument or in the querystring,
+    e.g. ``?format=jsonl``. Default is CSV.
+    """
+    if request.user.is_anonymous():
+        return http.HttpResponseForbidden('Forbidden.')
+    format = format or request.GET.get('format', 'csv')
+    if format not in bookmarks_export.FORMATS:
+        return http.HttpResponseBadRequest(u'Invalid format.')
+    lines = bookmarks_export.export(handlers.library.backend,
+        user=request.user, format=format)
+    # bookmarks are retreived while the response is streamed
+    lines = instrumentation.measure_iteration('view.export', lines)
+    response = http.StreamingHttpResponse(lines,
+        content_type=bookmarks_export.CONTENT_TYPES[format])
+    response['Content-Disposition'] = (
+        'attachment; filename="bookmarks.%s"' % format)
+    return response
@@ -5,6 +5,7 @@ These views are only available if you are using Django >= 1.3.
 from django.contrib.auth.models import User
 from django.views.generic.detail import DetailView
 
+from bookmarks import summaries
 from bookmarks.handlers import library
 
 
@@ -104,8 +105,21 @@ class BookmarksForView(BookmarksMixin, DetailView):
     The default template suffix is ``'_bookmarks'``, and so the template
     used in our example is ``article_bookmarks.html``.
 
+    .. py:attribute:: with_users
 
+        If True, the users who saved the bookmarks are retreived in bulk,
+        so that *bookmark.user* does not hit the database in the template.
+        Default is True.
+
+    .. py:attribute:: user_fields
+
+        A sequence of user field names: if given, only those fields are
+        retreived for each user (e.g. *('username',)*).
+        Default is *None* (all fields are retreived).
     """
+    with_users = True
+    user_fields = None
+
     def get_bookmarks(self, obj, key, is_reversed):
         """
         Return a queryset of bookmarks of *obj*.
@@ -113,6 +127,10 @@ class BookmarksForView(BookmarksMixin, DetailView):
         lookups = {'instance': obj, 'reversed': is_reversed}
         if key is not None:
             lookups['key'] = key
+        if self.with_users:
+            lookups['with_users'] = True
+        if self.user_fields:
+            lookups['user_fields'] = self.user_fields
         return library.backend.filter(**lookups)
 
 
@@ -155,8 +173,22 @@ class BookmarksByView(BookmarksMixin, DetailView):
 
     The default template suffix is ``'_bookmarks'``, and so the template
     used in our example is ``user_bookmarks.html``.
+
+    .. py:attribute:: with_summary
+
+        If True, the summary of bookmarks saved by the user (see
+        *bookmarks.summaries*) is added to the context as *summary*.
+        Default is False.
     """
     model = User
+    with_summary = False
+
+    def get_context_data(self, **kwargs):
+        context = super(BookmarksByView, self).get_context_data(**kwargs)
+        if self.with_summary:
+            context['summary'] = summaries.get_summary(self.object,
+                library.backend)
+        return context
 
     def get_bookmarks(self, obj, key, is_reversed):
         """
@@ -38,8 +38,14 @@ setup(name='django-generic-bookmarks',
     install_requires=[
         'future'
     ],
+    extras_require={
+        'recommendations': ['numpy>=1.13', 'scipy'],
+    },
     packages=[
         'bookmarks',
+        'bookmarks.management',
+        'bookmarks.management.commands',
+        'bookmarks.migrations',
         'bookmarks.templatetags',
         'bookmarks.views',
     ],
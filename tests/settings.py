@@ -1,12 +1,41 @@
-DATABASES = {'default': {'ENGINE': 'django.db.backends.sqlite3'}}
+# test databases are stored in files, so that they are shared by the
+# threads running asynchronous and cross-shard operations; each alias
+# needs its own NAME, since the test database signature is built from it
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': 'default.sqlite3',
+        'TEST': {'NAME': 'test_default.sqlite3'},
+    },
+    'shard1': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': 'shard1.sqlite3',
+        'TEST': {'NAME': 'test_shard1.sqlite3'},
+    },
+    'shard2': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': 'shard2.sqlite3',
+        'TEST': {'NAME': 'test_shard2.sqlite3'},
+    },
+    # a replica of the default database, used to test read databases
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'TEST': {'MIRROR': 'default'},
+    },
+}
 DATABASE_ENGINE = 'sqlite3'
 ROOT_URLCONF = ''
 SITE_ID = 1
 INSTALLED_APPS = (
     'django.contrib.auth',
     'django.contrib.contenttypes',
+    'django.contrib.sessions',
     'bookmarks',
 )
+MIDDLEWARE_CLASSES = (
+    'django.contrib.sessions.middleware.SessionMiddleware',
+    'django.contrib.auth.middleware.AuthenticationMiddleware',
+)
 GENERIC_BOOKMARKS_MONGODB = {"NAME": "test_generic_bookmarks"}
 ROOT_URLCONF = 'urls'
 SECRET_KEY = 'this_is_not_a_secret_key'